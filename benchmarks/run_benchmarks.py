@@ -0,0 +1,227 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import platform
+import subprocess
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+import onnx
+from ezkl import ezkl
+from models.olap_cube import OLAPCube
+from models.query_pipeline import QueryPipeline
+from operations.filter_model import FilteringModel
+from operations.dicing_model import DicingModel
+from operations.slice_model import SliceModel
+from operations.roll_up_model import RollUpModel
+from data_generators.CSV_Generator1 import generate_CSV_1
+from trace_utils import span, dump_metrics, tensor_shape, file_size, onnx_node_count
+from ezkl_workflow.witness_input import write_input
+
+# End-to-end benchmark of the query pipeline across dataset sizes and query shapes.
+#
+# For every size a GHGe1 dataset is generated (same seed, so the runs are comparable between commits),
+# then every standard query goes through the whole pipeline. Every stage runs in a span (trace_utils.py) that
+# records its wall time and the peak RSS of the process while it runs (ezkl runs in-process):
+#   csv_load, encoding, to_tensor, onnx_export, write_input, gen_settings, calibrate_settings, compile_circuit,
+#   get_srs, setup, gen_witness, prove, verify
+# The circuit artifacts are built from scratch (no artifact cache), so every ezkl stage is measured.
+#
+# Usage: python -m benchmarks.run_benchmarks [--sizes 1000 10000] [--prove-max-rows 10000] [--output file.json]
+# Compare two runs with any JSON diff tool, e.g. on the "stages" of the same dataset size and query.
+
+DEFAULT_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+BENCH_DIR = os.path.join("output", "benchmarks")
+ROW_BUCKET = "pow2"
+SEED = 1
+
+
+class StageRecorder:
+    """Wall time and peak RSS of the stages of one benchmark run, measured by the spans of trace_utils."""
+    def __init__(self):
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name, **attributes):
+        try:
+            with span(name, **attributes) as s:
+                yield s
+        finally:
+            # recorded even when the stage fails (the span has already measured it)
+            self.stages[name] = dict(wall_time_s=round(s.duration, 6), peak_rss_bytes=s.peak_rss, **s.attributes)
+
+    def skip(self, *names):
+        for name in names:
+            self.stages[name] = dict(skipped=True)
+
+
+# Standard queries on the GHGe1 schema, built from the column names of the encoded cube
+def _filter_query(cube, col):
+    return [FilteringModel({col["Material"]: cube.category_mappings["Material"]["Canvas"]})]
+
+def _slice_query(cube, col):
+    return [FilteringModel({col["Category"]: cube.category_mappings["Category"]["Shoes"]}),
+            SliceModel([col["Product Name"], col["Category"]])]
+
+def _dice_query(cube, col):
+    materials = [cube.category_mappings["Material"][m] for m in ("Cotton", "Denim")]
+    return [DicingModel({col["Material"]: materials, col["Year"]: [2021, 2022]})]
+
+def _roll_up_query(cube, col, validity_column):
+    group_columns = [col["Material"], col["Year"]]
+    return [FilteringModel({col["Year"]: [2021, 2022, 2023]}),
+            RollUpModel(cube.get_group_values(group_columns), [col["Total Emissions (kgCO₂e)"]],
+                        validity_column=validity_column)]
+
+QUERIES = {
+    "filter": _filter_query,
+    "slice": _slice_query,
+    "dice": _dice_query,
+    "roll_up": _roll_up_query,
+}
+
+PROOF_STAGES = ("write_input", "gen_settings", "calibrate_settings", "compile_circuit", "get_srs", "setup", "gen_witness", "prove", "verify")
+
+
+async def _prove(recorder, work_dir, model_onnx_path, input_json_path):
+    settings_path = os.path.join(work_dir, "settings.json")
+    compiled_path = os.path.join(work_dir, "circuit.compiled")
+    pk_path = os.path.join(work_dir, "test.pk")
+    vk_path = os.path.join(work_dir, "test.vk")
+    witness_path = os.path.join(work_dir, "witness.json")
+    proof_path = os.path.join(work_dir, "test.pf")
+
+    with recorder.stage("gen_settings"):
+        assert ezkl.gen_settings(model_onnx_path, settings_path)
+    with recorder.stage("calibrate_settings"):
+        assert await ezkl.calibrate_settings(input_json_path, model_onnx_path, settings_path, "resources")
+    with recorder.stage("compile_circuit"):
+        assert ezkl.compile_circuit(model_onnx_path, compiled_path, settings_path)
+    with open(settings_path, "r") as f:
+        settings = json.load(f)
+    logrows = settings["run_args"]["logrows"]
+    srs_path = os.path.join(BENCH_DIR, "srs", f"kzg{logrows}.srs")
+    os.makedirs(os.path.dirname(srs_path), exist_ok=True)
+    with recorder.stage("get_srs"):
+        if not os.path.exists(srs_path):
+            assert await ezkl.get_srs(settings_path, logrows=logrows, srs_path=srs_path)
+    with recorder.stage("setup", logrows=logrows) as s:
+        assert ezkl.setup(compiled_path, vk_path, pk_path, srs_path=srs_path)
+        s.set(pk_bytes=file_size(pk_path))
+    with recorder.stage("gen_witness"):
+        await ezkl.gen_witness(input_json_path, compiled_path, witness_path)
+    with recorder.stage("prove", logrows=logrows) as s:
+        ezkl.prove(witness_path, compiled_path, pk_path, proof_path, "single", srs_path=srs_path)
+        s.set(proof_bytes=file_size(proof_path))
+    with recorder.stage("verify"):
+        verified = ezkl.verify(proof_path, settings_path, vk_path, srs_path=srs_path)
+    return dict(logrows=logrows, num_rows=settings.get("num_rows"), verified=bool(verified),
+                proof_bytes=os.path.getsize(proof_path), pk_bytes=os.path.getsize(pk_path))
+
+
+async def run_query(name, cube, tensor_data, work_dir, prove):
+    recorder = StageRecorder()
+    col = {c: i for i, c in enumerate(cube.df.columns)}
+    build = QUERIES[name]
+    operations = build(cube, col, tensor_data.size(1) - 1) if name == "roll_up" else build(cube, col)
+    pipeline = QueryPipeline(operations)
+
+    os.makedirs(work_dir, exist_ok=True)
+    model_onnx_path = os.path.join(work_dir, "model.onnx")
+    with recorder.stage("onnx_export") as s:
+        pipeline.export(tensor_data, model_onnx_path)
+        onnx.checker.check_model(onnx.load(model_onnx_path))
+        s.set(onnx_nodes=onnx_node_count(model_onnx_path))
+    output = pipeline(tensor_data)
+
+    result = dict(query=name, pipeline=pipeline.describe(), input_shape=list(tensor_data.shape),
+                  output_shape=list(output.shape), stages=recorder.stages)
+    if not prove:
+        recorder.skip(*PROOF_STAGES)
+        return result
+
+    input_json_path = os.path.join(work_dir, "input.json")
+    with recorder.stage("write_input") as s:
+        write_input(input_json_path, tensor_data, output, include_output=False)
+        s.set(input_json_bytes=file_size(input_json_path))
+    try:
+        result["circuit"] = await _prove(recorder, work_dir, model_onnx_path, input_json_path)
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    return result
+
+
+async def run_size(num_rows, queries, prove_max_rows):
+    size_dir = os.path.abspath(os.path.join(BENCH_DIR, str(num_rows)))
+    os.makedirs(size_dir, exist_ok=True)
+    csv_path = os.path.join(size_dir, "GHGe1.csv")
+    if not os.path.exists(csv_path):
+        generate_CSV_1(num_rows, SEED, output_file=csv_path) # absolute path: written outside data/uploaded
+
+    recorder = StageRecorder()
+    with recorder.stage("csv_load"):
+        df = pd.read_csv(csv_path)
+        df.columns = df.columns.str.strip()
+        df = df.dropna()
+    with recorder.stage("encoding"):
+        cube = OLAPCube(df)
+    with recorder.stage("to_tensor") as s:
+        tensor_data = cube.to_tensor(bucket=ROW_BUCKET)
+        s.set(input_shape=tensor_shape(tensor_data))
+
+    prove = prove_max_rows is None or num_rows <= prove_max_rows
+    results = []
+    for name in queries:
+        print(f"[{num_rows} rows] {name}{'' if prove else ' (no proof)'}")
+        with span("benchmark_query", rows=num_rows, query=name):
+            results.append(await run_query(name, cube, tensor_data, os.path.join(size_dir, name), prove))
+    return dict(rows=num_rows, tensor_shape=list(tensor_data.shape), stages=recorder.stages, queries=results)
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run_benchmarks(sizes=DEFAULT_SIZES, queries=tuple(QUERIES), prove_max_rows=10_000, output_path=None):
+    runs = [await run_size(num_rows, queries, prove_max_rows) for num_rows in sizes]
+    report = dict(
+        commit=_git_commit(),
+        timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"),
+        python=platform.python_version(),
+        machine=platform.machine(),
+        cpu_count=os.cpu_count(),
+        seed=SEED,
+        row_bucket=ROW_BUCKET,
+        runs=runs,
+    )
+    output_path = output_path or os.path.join(BENCH_DIR, f"results_{time.strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Benchmark results saved to {output_path}")
+    print(f"Stage metrics saved to {dump_metrics(os.path.join(BENCH_DIR, 'metrics.prom'))}")
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end benchmark of the OLAP query pipeline")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="dataset sizes (rows)")
+    parser.add_argument("--queries", nargs="+", choices=list(QUERIES), default=list(QUERIES))
+    parser.add_argument("--prove-max-rows", type=int, default=10_000,
+                        help="largest dataset that goes through the ezkl stages (0 = never, -1 = always)")
+    parser.add_argument("--output", default=None, help="JSON file of the results")
+    args = parser.parse_args()
+    prove_max_rows = None if args.prove_max_rows < 0 else args.prove_max_rows
+    asyncio.run(run_benchmarks(args.sizes, args.queries, prove_max_rows, args.output))
+
+
+if __name__ == "__main__":
+    main()
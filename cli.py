@@ -0,0 +1,190 @@
+import os
+import sys
+import json
+import argparse
+
+# Non-interactive command line, for scripts, cron jobs and CI loops (main.py keeps the interactive menus).
+# Only the standard library is imported here: every subcommand imports what it needs when it runs, so the
+# cheap ones (e.g. list) start in milliseconds and only query and publish pay for torch, onnx and ezkl.
+#
+#   python cli.py list                                    -> uploaded files and published hashes
+#   python cli.py generate --generator 1 --rows 100000 [--seed 1] [--output GHGe1.csv] [--workers 4]
+#   python cli.py publish GHGe1.csv [GHGe2.csv ...] [--batch | --merkle | --append]
+#                                                         -> --merkle: root of the row chunks of every file,
+#                                                            --append: new root of Merkle-published files with new rows
+#   python cli.py verify GHGe1.csv [GHGe2.csv ...]      -> against the batch or the hash (SHA-256 or Merkle root)
+#                                                            published for every file
+#   python cli.py query GHGe1.csv [GHGe2.csv ...] [--spec query.json]
+#                                                         -> one query per file (on the scheduler if more than one),
+#                                                            spec: declarative query of models/query_spec.py
+#   python cli.py verify-proofs [output/jobs ...]
+#
+# The exit status is 0 on success and 1 on failure.
+
+UPLOADED_DIR = os.path.join('data', 'uploaded')
+PUBLISHED_HASH_PATH = os.path.join('data', 'published_hash.json')
+
+def load_published_hashes():
+    if not os.path.exists(PUBLISHED_HASH_PATH):
+        return {}
+    with open(PUBLISHED_HASH_PATH, 'r') as f:
+        return json.load(f)
+
+def uploaded_path(file_name):
+    file_path = os.path.join(UPLOADED_DIR, os.path.basename(file_name))
+    if not os.path.exists(file_path):
+        raise FileNotFoundError(f"File not found in {UPLOADED_DIR}: {file_name}")
+    return file_path
+
+def published_hash(file_name):
+    dataset_hash = load_published_hashes().get(os.path.basename(file_name))
+    if dataset_hash is None:
+        raise KeyError(f"No published hash for {file_name}")
+    return dataset_hash
+
+
+def cmd_list(args):
+    published = load_published_hashes()
+    files = sorted(os.listdir(UPLOADED_DIR)) if os.path.isdir(UPLOADED_DIR) else []
+    for file_name in sorted(set(files) | set(published)):
+        print(f"{file_name}\t{published.get(file_name, '-')}")
+    return 0
+
+def cmd_generate(args):
+    if args.generator == 1:
+        from data_generators.CSV_Generator1 import generate_CSV_1 as generate
+    else:
+        from data_generators.CSV_Generator2 import generate_CSV_2 as generate
+    output_file = args.output or f"GHGe{args.generator}.csv"
+    generate(args.rows, args.seed, output_file=output_file, chunk_rows=args.chunk_rows, workers=args.workers)
+    return 0
+
+def cmd_publish(args):
+    for file_name in args.files:
+        uploaded_path(file_name)
+    import main
+    file_names = [os.path.basename(file_name) for file_name in args.files]
+    if args.append:
+        hashes = {file_name: main.op_publish_appended_rows(file_name) for file_name in file_names}
+    elif args.merkle:
+        hashes = {file_name: main.op_publish_dataset(file_name, merkle=True) for file_name in file_names}
+    elif args.batch or len(file_names) > 1:
+        hashes = main.op_publish_datasets(file_names) # one Merkle root for all the files
+    else:
+        hashes = {file_names[0]: main.op_publish_dataset(file_names[0])}
+    for file_name, dataset_hash in hashes.items():
+        print(f"{file_name}\t{dataset_hash}")
+    return 0
+
+def cmd_verify(args):
+    from hash_utils import verify_datasets
+    failed = 0
+    file_paths = {}
+    for file_name in args.files:
+        try:
+            file_paths[file_name] = uploaded_path(file_name)
+        except FileNotFoundError as e:
+            print(f"{file_name}\tNOT verified: {e.args[0]}")
+            failed += 1
+    # one JSON-RPC batch for the hashes of all the files (the Merkle mode is the one each file was published with)
+    results = verify_datasets(list(file_paths.values())) if file_paths else {}
+    for file_name, file_path in file_paths.items():
+        error = results[file_path] # e.g. a tampered file or a missing Merkle tree
+        print(f"{file_name}\tverified" if error is None else f"{file_name}\tNOT verified: {error}")
+        failed += error is not None
+    return 1 if failed else 0
+
+async def _run_queries(file_names, spec=None):
+    import main
+    from job_scheduler import QueryScheduler, DONE
+    requests = [(uploaded_path(file_name), os.path.basename(file_name), published_hash(file_name)) for file_name in file_names]
+    if len(requests) == 1:
+        file_path, selected_file, dataset_hash = requests[0]
+        await main.op_perform_query(file_path, selected_file, dataset_hash, spec=spec)
+        return 0
+
+    scheduler = QueryScheduler(main.prepare_query, main.finish_query)
+    try:
+        for request in requests:
+            scheduler.submit(*request, spec=spec)
+        jobs = await scheduler.wait_all()
+    finally:
+        scheduler.shutdown()
+    for job in jobs:
+        outcome = f"done\t{job['result']}" if job["status"] == DONE else f"failed\t{job['error']}"
+        print(f"{job['id']}\t{job['file']}\t{outcome}")
+    return 0 if all(job["status"] == DONE for job in jobs) else 1
+
+def cmd_query(args):
+    import asyncio
+    spec = None
+    if args.spec:
+        with open(args.spec, 'r', encoding='utf-8') as f:
+            spec = json.load(f)
+    return asyncio.run(_run_queries(args.files, spec))
+
+def cmd_verify_proofs(args):
+    import asyncio
+    from ezkl_workflow.batch_verify import verify_batch, find_proofs
+    proofs = find_proofs(args.directories)
+    if not proofs:
+        # nothing verified is not a success (e.g. a mistyped directory in a CI job)
+        print(f"Error: no proofs found in {', '.join(args.directories)}", file=sys.stderr)
+        return 1
+    results = asyncio.run(verify_batch(proofs))
+    for result in results:
+        status = "verified" if result["verified"] else f"NOT verified{': ' + result['error'] if result['error'] else ''}"
+        print(f"{result['proof']}\t{status}")
+    return 0 if all(result["verified"] for result in results) else 1
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Publish, verify and query the datasets without the interactive menus")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    list_parser = subparsers.add_parser("list", help="uploaded files and their published hashes")
+    list_parser.set_defaults(handler=cmd_list)
+
+    generate_parser = subparsers.add_parser("generate", help="generate a synthetic dataset in data/uploaded")
+    generate_parser.add_argument("--generator", type=int, choices=(1, 2), default=1)
+    generate_parser.add_argument("--rows", type=int, default=1000)
+    generate_parser.add_argument("--seed", type=int, default=1)
+    generate_parser.add_argument("--output", default=None, help="file name (.csv or .parquet), default GHGe<generator>.csv")
+    generate_parser.add_argument("--chunk-rows", type=int, default=100_000)
+    generate_parser.add_argument("--workers", type=int, default=1)
+    generate_parser.set_defaults(handler=cmd_generate)
+
+    publish_parser = subparsers.add_parser("publish", help="publish the hash of datasets of data/uploaded")
+    publish_parser.add_argument("files", nargs="+")
+    publish_mode = publish_parser.add_mutually_exclusive_group()
+    publish_mode.add_argument("--batch", action="store_true", help="publish one Merkle root (implied by several files)")
+    publish_mode.add_argument("--merkle", action="store_true", help="publish the root of the row chunks of every file")
+    publish_mode.add_argument("--append", action="store_true",
+                              help="publish the new root of files published with --merkle after rows were appended")
+    publish_parser.set_defaults(handler=cmd_publish)
+
+    verify_parser = subparsers.add_parser("verify", help="verify datasets against their published hash")
+    verify_parser.add_argument("files", nargs="+")
+    verify_parser.set_defaults(handler=cmd_verify)
+
+    query_parser = subparsers.add_parser("query", help="run the query and prove it on published datasets")
+    query_parser.add_argument("files", nargs="+")
+    query_parser.add_argument("--spec", default=None, help="JSON file of the query spec (default: the query of main.py)")
+    query_parser.set_defaults(handler=cmd_query)
+
+    proofs_parser = subparsers.add_parser("verify-proofs", help="verify every proof under the directories in one batch")
+    proofs_parser.add_argument("directories", nargs="*", default=[os.path.join("output", "jobs")])
+    proofs_parser.set_defaults(handler=cmd_verify_proofs)
+    return parser
+
+def run(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        return args.handler(args)
+    except (FileNotFoundError, KeyError) as e:
+        print(f"Error: {e.args[0] if e.args else e}", file=sys.stderr)
+        return 1
+
+
+if __name__ == "__main__":
+    sys.exit(run())
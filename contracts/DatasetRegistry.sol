@@ -0,0 +1,79 @@
+// contracts/DatasetRegistry.sol
+pragma solidity ^0.8.0;
+
+// Hashes of the published files, keyed by the keccak256 of the file name: the SHA-256 of the file, or the root
+// of the Merkle tree of its row chunks ("merkle"), published again when rows are appended to the file.
+// Commitments of the published datasets, keyed by the hash of the file.
+// The commitment is the Poseidon hash of the encoded dataset tensor quantized at "scale": a proof whose
+// circuit hashes its input can be checked against it without the dataset.
+// Batches of dataset hashes are published as the root of their Merkle tree (one transaction per batch),
+// every file is then checked locally with its inclusion proof against a published root.
+// Only the owner of the registry (ORG 1, the account that deploys it) can publish file hashes and roots:
+// a root found here vouches for every hash of its batch.
+contract DatasetRegistry {
+    struct Commitment {
+        bytes32 commitment;
+        uint8 scale;
+        uint64 rows;
+        address publisher;
+    }
+
+    struct FileHash {
+        bytes32 hash;
+        bool merkle;
+    }
+
+    address public owner;
+    mapping(bytes32 => FileHash) private fileHashes;
+    mapping(bytes32 => Commitment) private commitments;
+    mapping(bytes32 => address) private rootPublishers;
+
+    event FileHashPublished(bytes32 indexed fileKey, bytes32 hash, bool merkle);
+    event CommitmentPublished(bytes32 indexed fileHash, bytes32 commitment, uint8 scale, uint64 rows);
+    event RootPublished(bytes32 indexed root, address publisher);
+
+    constructor() {
+        owner = msg.sender;
+    }
+
+    function setFileHash(bytes32 fileKey, bytes32 hash, bool merkle) public {
+        require(msg.sender == owner, "Only the owner of the registry can publish file hashes");
+        fileHashes[fileKey] = FileHash(hash, merkle);
+        emit FileHashPublished(fileKey, hash, merkle);
+    }
+
+    function getFileHash(bytes32 fileKey) public view returns (bytes32, bool) {
+        FileHash storage current = fileHashes[fileKey];
+        return (current.hash, current.merkle);
+    }
+
+    function setCommitment(bytes32 fileHash, bytes32 commitment, uint8 scale, uint64 rows) public {
+        Commitment storage current = commitments[fileHash];
+        // Only the first publisher of a dataset can update its commitment
+        require(current.publisher == address(0) || current.publisher == msg.sender, "Not the publisher of the dataset");
+        commitments[fileHash] = Commitment(commitment, scale, rows, msg.sender);
+        emit CommitmentPublished(fileHash, commitment, scale, rows);
+    }
+
+    function getCommitment(bytes32 fileHash) public view returns (bytes32, uint8, uint64) {
+        Commitment storage current = commitments[fileHash];
+        return (current.commitment, current.scale, current.rows);
+    }
+
+    function publishRoot(bytes32 root) public {
+        require(msg.sender == owner, "Only the owner of the registry can publish roots");
+        // Publishing the same batch again keeps its first publisher
+        if (rootPublishers[root] == address(0)) {
+            rootPublishers[root] = msg.sender;
+            emit RootPublished(root, msg.sender);
+        }
+    }
+
+    function isRootPublished(bytes32 root) public view returns (bool) {
+        return rootPublishers[root] != address(0);
+    }
+
+    function rootPublisher(bytes32 root) public view returns (address) {
+        return rootPublishers[root];
+    }
+}
@@ -1,82 +1,67 @@
-import csv
-import random
-from datetime import datetime, timedelta
 import os
+import numpy as np
+import pandas as pd
+from data_generators.chunked_writer import DEFAULT_CHUNK_ROWS, output_format, write_chunks
 
-def generate_CSV_1(num_rows, seed, output_file="GHGe1.csv"):
-    # Ensure the output directory exists
-    output_dir = os.path.join("data", "uploaded")
-    os.makedirs(output_dir, exist_ok=True)
-    output_file = os.path.join(output_dir, output_file)
+START_DATE = np.datetime64("2020-01-01")
+DAYS = 1825 # Random date within 5 years
+
+# Sample product data
+products = [
+    {"name": "Basic T-shirt", "category": "T-shirt", "material": "Cotton", "unit_emission": 2.1},
+    {"name": "Slim Fit Jeans", "category": "Jeans", "material": "Denim", "unit_emission": 6.5},
+    {"name": "Oversized Hoodie", "category": "Sweatshirt", "material": "Cotton", "unit_emission": 4.2},
+    {"name": "Light Jacket", "category": "Jacket", "material": "Polyester", "unit_emission": 8.9},
+    {"name": "Cargo Pants", "category": "Pants", "material": "Cotton", "unit_emission": 5.1},
+    {"name": "Denim Jacket", "category": "Jacket", "material": "Denim", "unit_emission": 7.8},
+    {"name": "Printed T-shirt", "category": "T-shirt", "material": "Organic Cotton", "unit_emission": 1.9},
+    {"name": "Chino Pants", "category": "Pants", "material": "Cotton", "unit_emission": 4.7},
+    {"name": "Running Shoes", "category": "Shoes", "material": "Synthetic", "unit_emission": 9.5},
+    {"name": "Leather Boots", "category": "Shoes", "material": "Leather", "unit_emission": 11.0},
+    {"name": "Summer Dress", "category": "Dress", "material": "Linen", "unit_emission": 3.3},
+    {"name": "Winter Coat", "category": "Jacket", "material": "Wool", "unit_emission": 10.2},
+    {"name": "Knitted Sweater", "category": "Sweater", "material": "Wool", "unit_emission": 6.0},
+    {"name": "Raincoat", "category": "Jacket", "material": "Polyester", "unit_emission": 7.4},
+    {"name": "Tank Top", "category": "T-shirt", "material": "Cotton", "unit_emission": 1.8},
+    {"name": "Formal Shirt", "category": "Shirt", "material": "Cotton", "unit_emission": 3.9},
+    {"name": "Tracksuit Pants", "category": "Pants", "material": "Polyester", "unit_emission": 6.3},
+    {"name": "Zip Hoodie", "category": "Sweatshirt", "material": "Cotton", "unit_emission": 4.5},
+    {"name": "Slip-On Sneakers", "category": "Shoes", "material": "Canvas", "unit_emission": 5.7},
+    {"name": "Shorts", "category": "Shorts", "material": "Denim", "unit_emission": 3.5}
+]
 
-    start_date = datetime(2020, 1, 1)
-    random.seed(seed)
+PRODUCT_NAMES = np.array([p["name"] for p in products])
+PRODUCT_CATEGORIES = np.array([p["category"] for p in products])
+PRODUCT_MATERIALS = np.array([p["material"] for p in products])
+UNIT_EMISSIONS = np.array([p["unit_emission"] for p in products])
 
-    # Sample product data
-    products = [
-        {"name": "Basic T-shirt", "category": "T-shirt", "material": "Cotton", "unit_emission": 2.1},
-        {"name": "Slim Fit Jeans", "category": "Jeans", "material": "Denim", "unit_emission": 6.5},
-        {"name": "Oversized Hoodie", "category": "Sweatshirt", "material": "Cotton", "unit_emission": 4.2},
-        {"name": "Light Jacket", "category": "Jacket", "material": "Polyester", "unit_emission": 8.9},
-        {"name": "Cargo Pants", "category": "Pants", "material": "Cotton", "unit_emission": 5.1},
-        {"name": "Denim Jacket", "category": "Jacket", "material": "Denim", "unit_emission": 7.8},
-        {"name": "Printed T-shirt", "category": "T-shirt", "material": "Organic Cotton", "unit_emission": 1.9},
-        {"name": "Chino Pants", "category": "Pants", "material": "Cotton", "unit_emission": 4.7},
-        {"name": "Running Shoes", "category": "Shoes", "material": "Synthetic", "unit_emission": 9.5},
-        {"name": "Leather Boots", "category": "Shoes", "material": "Leather", "unit_emission": 11.0},
-        {"name": "Summer Dress", "category": "Dress", "material": "Linen", "unit_emission": 3.3},
-        {"name": "Winter Coat", "category": "Jacket", "material": "Wool", "unit_emission": 10.2},
-        {"name": "Knitted Sweater", "category": "Sweater", "material": "Wool", "unit_emission": 6.0},
-        {"name": "Raincoat", "category": "Jacket", "material": "Polyester", "unit_emission": 7.4},
-        {"name": "Tank Top", "category": "T-shirt", "material": "Cotton", "unit_emission": 1.8},
-        {"name": "Formal Shirt", "category": "Shirt", "material": "Cotton", "unit_emission": 3.9},
-        {"name": "Tracksuit Pants", "category": "Pants", "material": "Polyester", "unit_emission": 6.3},
-        {"name": "Zip Hoodie", "category": "Sweatshirt", "material": "Cotton", "unit_emission": 4.5},
-        {"name": "Slip-On Sneakers", "category": "Shoes", "material": "Canvas", "unit_emission": 5.7},
-        {"name": "Shorts", "category": "Shorts", "material": "Denim", "unit_emission": 3.5}
-    ]
+# Generates one chunk of rows: every column is drawn at once with NumPy
+def make_chunk(num_rows, seed_seq):
+    rng = np.random.default_rng(seed_seq)
+    dates = pd.DatetimeIndex(START_DATE + rng.integers(0, DAYS + 1, num_rows).astype("timedelta64[D]"))
+    product = rng.integers(0, len(products), num_rows)
+    quantity = rng.integers(1, 101, num_rows)
+    total_emission = np.round(UNIT_EMISSIONS[product] * quantity, 2)
 
-    # Generate the data
-    data = []
-    for _ in range(num_rows):
-        random_date = start_date + timedelta(days=random.randint(0, 1825))  # Random date within 5 years
-        product = random.choice(products)
+    return pd.DataFrame({
+        "Product Name": PRODUCT_NAMES[product],
+        "Category": PRODUCT_CATEGORIES[product],
+        "Material": PRODUCT_MATERIALS[product],
+        "Year": dates.year,
+        "Month": dates.month,
+        "Day": dates.day,
+        "Total Emissions (kgCO₂e)": total_emission
+    })
 
-        quantity = random.randint(1, 100)
-        unit_emission = product["unit_emission"]
-        total_emission = round(unit_emission * quantity, 2)
+# The rows are generated and written in chunks of chunk_rows (workers > 1: chunks generated in parallel processes).
+# The same seed always gives the same file; a ".parquet" output_file (or file_format="parquet") writes Parquet
+def generate_CSV_1(num_rows, seed, output_file="GHGe1.csv", chunk_rows=DEFAULT_CHUNK_ROWS, workers=1, file_format=None):
+    # Ensure the output directory exists
+    output_dir = os.path.join("data", "uploaded")
+    os.makedirs(output_dir, exist_ok=True)
+    output_file = os.path.join(output_dir, output_file)
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
 
-        row = {
-            "Category": product["category"],
-            "Material": product["material"],
-            "Year": random_date.year,
-            "Month": random_date.month,
-            "Day": random_date.day,
-            "Product Name": product["name"],
-            "Total Emissions (kgCO₂e)": total_emission
-        }
-        data.append(row)
+    write_chunks(make_chunk, num_rows, seed, output_file, chunk_rows, workers, output_format(output_file, file_format))
 
-    with open(output_file, mode="w", newline="", encoding="utf-8") as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow([
-            "Product Name",
-            "Category",
-            "Material",
-            "Year",
-            "Month",
-            "Day",
-            "Total Emissions (kgCO₂e)"
-        ])
-        for row in data:
-            writer.writerow([
-                row["Product Name"],
-                row["Category"],
-                row["Material"],
-                row["Year"],
-                row["Month"],
-                row["Day"],
-                row["Total Emissions (kgCO₂e)"]
-            ])
-    
     print(f"CSV generated: {output_file}")
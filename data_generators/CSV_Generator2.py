@@ -1,87 +1,68 @@
-import csv
-import random
-from datetime import datetime, timedelta
 import os
+import numpy as np
+import pandas as pd
+from data_generators.chunked_writer import DEFAULT_CHUNK_ROWS, output_format, write_chunks
 
-def generate_CSV_2(num_rows, seed, output_file="GHGe2.csv"):
-    # Ensure the output directory exists
-    output_dir = os.path.join("data", "uploaded")
-    os.makedirs(output_dir, exist_ok=True)
-    output_file = os.path.join(output_dir, output_file)
+START_DATE = np.datetime64("2020-01-01")
+DAYS = 1825 # Random date within 5 years
 
-    start_date = datetime(2020, 1, 1)
-    random. seed(seed)
+cities = [
+    ("Milan", "Italy"), ("Rome", "Italy"), ("Naples", "Italy"), ("Florence", "Italy"), ("Venice", "Italy"),
+    ("Paris", "France"), ("Lyon", "France"), ("Marseille", "France"), ("Bordeaux", "France"), ("Nice", "France"),
+    ("Berlin", "Germany"), ("Munich", "Germany"), ("Hamburg", "Germany"), ("Cologne", "Germany"), ("Frankfurt", "Germany"),
+    ("Tokyo", "Japan"), ("Osaka", "Japan"), ("Kyoto", "Japan"), ("Nagoya", "Japan"), ("Fukuoka", "Japan")
+]
 
-    cities = [
-        ("Milan", "Italy"), ("Rome", "Italy"), ("Naples", "Italy"), ("Florence", "Italy"), ("Venice", "Italy"),
-        ("Paris", "France"), ("Lyon", "France"), ("Marseille", "France"), ("Bordeaux", "France"), ("Nice", "France"),
-        ("Berlin", "Germany"), ("Munich", "Germany"), ("Hamburg", "Germany"), ("Cologne", "Germany"), ("Frankfurt", "Germany"),
-        ("Tokyo", "Japan"), ("Osaka", "Japan"), ("Kyoto", "Japan"), ("Nagoya", "Japan"), ("Fukuoka", "Japan")
-    ]
+products = [
+    ("Basic T-shirt", "T-shirt"), ("Graphic T-shirt", "T-shirt"), ("Slim Fit Jeans", "Jeans"), ("Relaxed Fit Jeans", "Jeans"),
+    ("Bomber Jacket", "Jacket"), ("Light Jacket", "Jacket"), ("Running Shoes", "Shoes"), ("Leather Boots", "Shoes"),
+    ("Wool Scarf", "Accessories"), ("Baseball Cap", "Accessories"), ("Denim Jacket", "Jacket"), ("Oversized Hoodie", "T-shirt"),
+    ("Cargo Pants", "Jeans"), ("Canvas Sneakers", "Shoes"), ("Raincoat", "Jacket"), ("Beanie", "Accessories"),
+    ("Polo Shirt", "T-shirt"), ("Chino Pants", "Jeans"), ("Ankle Boots", "Shoes"), ("Leather Belt", "Accessories")
+]
 
-    products = [
-        ("Basic T-shirt", "T-shirt"), ("Graphic T-shirt", "T-shirt"), ("Slim Fit Jeans", "Jeans"), ("Relaxed Fit Jeans", "Jeans"),
-        ("Bomber Jacket", "Jacket"), ("Light Jacket", "Jacket"), ("Running Shoes", "Shoes"), ("Leather Boots", "Shoes"),
-        ("Wool Scarf", "Accessories"), ("Baseball Cap", "Accessories"), ("Denim Jacket", "Jacket"), ("Oversized Hoodie", "T-shirt"),
-        ("Cargo Pants", "Jeans"), ("Canvas Sneakers", "Shoes"), ("Raincoat", "Jacket"), ("Beanie", "Accessories"),
-        ("Polo Shirt", "T-shirt"), ("Chino Pants", "Jeans"), ("Ankle Boots", "Shoes"), ("Leather Belt", "Accessories")
-    ]
+CITY_NAMES = np.array([city for city, _ in cities])
+CITY_COUNTRIES = np.array([country for _, country in cities])
+PRODUCT_NAMES = np.array([product for product, _ in products])
+PRODUCT_CATEGORIES = np.array([category for _, category in products])
 
-    # Product base info
-    data = []
-    for _ in range(num_rows):
-        random_date = start_date + timedelta(days=random.randint(0, 1825))  # Random date within 5 years
-        city, state = random.choice(cities)
-        product, category = random.choice(products)
-        quantity = random.randint(1, 50)
+# Generates one chunk of rows: every column is drawn at once with NumPy
+def make_chunk(num_rows, seed_seq):
+    rng = np.random.default_rng(seed_seq)
+    dates = START_DATE + rng.integers(0, DAYS + 1, num_rows).astype("timedelta64[D]")
+    city = rng.integers(0, len(cities), num_rows)
+    product = rng.integers(0, len(products), num_rows)
+    quantity = rng.integers(1, 51, num_rows)
 
-        row ={
-            "Date": random_date.strftime("%Y-%m-%d"),
-            "Product Name": product,
-            "Category": category,
-            "City": city,
-            "State": state,
-            "Quantity": quantity
-        }
-        data.append(row)
+    e_rawm = np.round(rng.uniform(1.0, 5.0, num_rows), 2)  # Emissions from raw materials
+    e_man = np.round(rng.uniform(2.0, 7.0, num_rows), 2)  # Emissions from manufacturing
+    e_transp = np.round(rng.uniform(0.5, 4.0, num_rows), 2)  # Emissions from transport
+    e_tot_unit = np.round(e_rawm + e_man + e_transp, 2)  # Total emissions per unit
+    e_tot = np.round(e_tot_unit * quantity, 2)  # Total emissions for the quantity sold
 
-    # Write CSV
-    filename = "GHGe2.csv"
-    with open(output_file, mode="w", newline="", encoding="utf-8") as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow([
-            "Date",
-            "Product Name",
-            "Category",
-            "City",
-            "Country",
-            "Emissions Raw Materials per unit (kgCO₂e)",
-            "Emissions Manufacturing per unit (kgCO₂e)",
-            "Emissions Transport per unit (kgCO₂e)",
-            "Total Emissions per unit (kgCO₂e)",
-            "Quantity",
-            "Total Emissions (kgCO₂e)",
-        ])
+    return pd.DataFrame({
+        "Date": np.datetime_as_string(dates, unit="D"), # YYYY-MM-DD
+        "Product Name": PRODUCT_NAMES[product],
+        "Category": PRODUCT_CATEGORIES[product],
+        "City": CITY_NAMES[city],
+        "Country": CITY_COUNTRIES[city],
+        "Emissions Raw Materials per unit (kgCO₂e)": e_rawm,
+        "Emissions Manufacturing per unit (kgCO₂e)": e_man,
+        "Emissions Transport per unit (kgCO₂e)": e_transp,
+        "Total Emissions per unit (kgCO₂e)": e_tot_unit,
+        "Quantity": quantity,
+        "Total Emissions (kgCO₂e)": e_tot,
+    })
 
-        for row in data:
-            e_rawm = round(random.uniform(1.0, 5.0), 2)  # Emissions from raw materials
-            e_man = round(random.uniform(2.0, 7.0), 2)  # Emissions from manufacturing
-            e_transp = round(random.uniform(0.5, 4.0), 2)  # Emissions from transport
-            e_tot_unit = round(e_rawm + e_man + e_transp, 2)  # Total emissions per unit
-            e_tot = round(e_tot_unit * row["Quantity"], 2)  # Total emissions for the quantity sold
+# The rows are generated and written in chunks of chunk_rows (workers > 1: chunks generated in parallel processes).
+# The same seed always gives the same file; a ".parquet" output_file (or file_format="parquet") writes Parquet
+def generate_CSV_2(num_rows, seed, output_file="GHGe2.csv", chunk_rows=DEFAULT_CHUNK_ROWS, workers=1, file_format=None):
+    # Ensure the output directory exists
+    output_dir = os.path.join("data", "uploaded")
+    os.makedirs(output_dir, exist_ok=True)
+    output_file = os.path.join(output_dir, output_file)
+    os.makedirs(os.path.dirname(output_file), exist_ok=True)
 
-            writer.writerow([
-                row["Date"],
-                row["Product Name"],
-                row["Category"],
-                row["City"],
-                row["State"],
-                e_rawm,
-                e_man,
-                e_transp,
-                e_tot_unit,
-                row["Quantity"],
-                e_tot,
-            ])
+    write_chunks(make_chunk, num_rows, seed, output_file, chunk_rows, workers, output_format(output_file, file_format))
 
-    print(f"CSV generated: {filename}")
+    print(f"CSV generated: {output_file}")
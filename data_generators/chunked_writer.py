@@ -0,0 +1,77 @@
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+
+# Chunked output of the vectorized generators.
+#
+# The rows are generated in chunks of chunk_rows by make_chunk(num_rows, seed_sequence) -> DataFrame and
+# written one chunk at a time, so a file of millions of rows never has to fit in memory. Every chunk gets
+# its own child of np.random.SeedSequence(seed): the file only depends on the seed and the chunk size,
+# not on the number of worker processes that generate the chunks.
+# Parquet output needs pyarrow (optional dependency).
+
+DEFAULT_CHUNK_ROWS = 100_000
+
+def output_format(output_path, file_format=None):
+    if file_format is None:
+        file_format = "parquet" if output_path.endswith(".parquet") else "csv"
+    if file_format not in ("csv", "parquet"):
+        raise ValueError(f"Unsupported output format: {file_format} (expected 'csv' or 'parquet')")
+    return file_format
+
+def chunk_sizes(num_rows, chunk_rows):
+    return [min(chunk_rows, num_rows - start) for start in range(0, num_rows, chunk_rows)]
+
+def _generate(make_chunk, sizes, seeds, workers):
+    if workers <= 1:
+        for size, seed_seq in zip(sizes, seeds):
+            yield make_chunk(size, seed_seq)
+        return
+    # At most 2 chunks per worker are pending: generation never runs far ahead of the writer
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        jobs = iter(zip(sizes, seeds))
+        for size, seed_seq in jobs:
+            pending.append(pool.submit(make_chunk, size, seed_seq))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def _parquet_writer(output_path, df):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise ImportError("Parquet output requires pyarrow (pip install pyarrow)") from e
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    return pa, pq.ParquetWriter(output_path, table.schema), table
+
+def write_chunks(make_chunk, num_rows, seed, output_path, chunk_rows=DEFAULT_CHUNK_ROWS, workers=1, file_format=None):
+    """Generate num_rows rows with make_chunk and write them to output_path (CSV or Parquet), chunk by chunk."""
+    file_format = output_format(output_path, file_format)
+    sizes = chunk_sizes(num_rows, chunk_rows) or [0] # an empty dataset still gets its header
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+
+    tmp_path = output_path + ".tmp"
+    writer = None
+    try:
+        for i, df in enumerate(_generate(make_chunk, sizes, seeds, workers)):
+            if file_format == "csv":
+                df.to_csv(tmp_path, mode="w" if i == 0 else "a", header=i == 0, index=False, encoding="utf-8")
+            elif writer is None:
+                pa, writer, table = _parquet_writer(tmp_path, df)
+                writer.write_table(table)
+            else:
+                writer.write_table(pa.Table.from_pandas(df, schema=writer.schema, preserve_index=False))
+        if writer is not None:
+            writer.close()
+            writer = None
+        os.replace(tmp_path, output_path) # a reader never sees a half-written file
+    finally:
+        if writer is not None:
+            writer.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return output_path
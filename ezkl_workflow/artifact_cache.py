@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+from ezkl import ezkl
+from lock_utils import file_lock
+
+# On-disk cache of the ezkl artifacts of a circuit (settings, compiled circuit, proving and verification key).
+# An entry is identified by the hash of the ONNX model bytes, the input shape and the requested logrows
+# ("auto" when the circuit is sized by ezkl_workflow/circuit_sizing.py),
+# so a query with the same shape as a previous one skips gen_settings, calibration, compile and setup.
+#
+# output/cache/
+#   index.json            -> {key: {"last_used": ..., "size": ...}}
+#   <key>/settings.json
+#   <key>/circuit.compiled
+#   <key>/test.pk
+#   <key>/test.vk
+#   sizing.json           -> logrows and scales chosen for every model and input shape
+#   srs/kzg<logrows>.srs  -> local SRS store (one file per logrows), used offline once downloaded
+#
+# Several processes (e.g. the proving workers of job_scheduler.py) can share the cache: the index,
+# the build of an entry and the download of an SRS are serialized by file locks (*.lock).
+
+ENTRY_FILES = {
+    "settings": "settings.json",
+    "compiled": "circuit.compiled",
+    "pk": "test.pk",
+    "vk": "test.vk",
+}
+
+DEFAULT_CACHE_DIR = os.path.join("output", "cache")
+
+
+def circuit_key(model_onnx_path, input_shape, logrows, variant=None):
+    """Content hash of the model bytes, the input shape and the logrows (and of the variant of the circuit, e.g.
+    the visibility and scale of a hashed input)."""
+    hasher = hashlib.sha256()
+    with open(model_onnx_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(chunk)
+    hasher.update(json.dumps([list(input_shape), logrows] + ([variant] if variant is not None else [])).encode())
+    return hasher.hexdigest()
+
+
+class ArtifactCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_entries=8, max_bytes=4 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(cache_dir, "index.json")
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return {}
+        with open(self.index_path, "r") as f:
+            return json.load(f)
+
+    def _save_index(self, index):
+        tmp_path = self.index_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(index, f, indent=4)
+        os.replace(tmp_path, self.index_path)
+
+    def entry_dir(self, key):
+        return os.path.join(self.cache_dir, key)
+
+    def entry_paths(self, key):
+        return {name: os.path.join(self.entry_dir(key), file_name) for name, file_name in ENTRY_FILES.items()}
+
+    def lock(self, key):
+        """Lock held while the entry of key is built, so that only one process builds it."""
+        return file_lock(os.path.join(self.cache_dir, f"{key}.lock"))
+
+    def get(self, key):
+        """Paths of a complete entry (and mark it as recently used), or None on a miss."""
+        with file_lock(self.index_path + ".lock"):
+            index = self._load_index()
+            paths = self.entry_paths(key)
+            if key not in index or not all(os.path.exists(p) for p in paths.values()):
+                return None
+            index[key]["last_used"] = time.time()
+            self._save_index(index)
+            return paths
+
+    def put(self, key):
+        """Register the entry written in entry_dir(key) and evict the least recently used ones."""
+        with file_lock(self.index_path + ".lock"):
+            index = self._load_index()
+            size = sum(os.path.getsize(p) for p in self.entry_paths(key).values() if os.path.exists(p))
+            index[key] = {"last_used": time.time(), "size": size}
+            self._evict(index, keep=key)
+            self._save_index(index)
+            return self.entry_paths(key)
+
+    def _evict(self, index, keep=None):
+        # Least recently used first, until both the number of entries and the total size are within bounds
+        by_age = sorted((k for k in index if k != keep), key=lambda k: index[k]["last_used"])
+        total = sum(entry["size"] for entry in index.values())
+        while by_age and (len(index) > self.max_entries or total > self.max_bytes):
+            victim = by_age.pop(0)
+            total -= index[victim]["size"]
+            del index[victim]
+            shutil.rmtree(self.entry_dir(victim), ignore_errors=True)
+            print(f"Evicted cached circuit {victim[:12]}")
+
+
+class SRSStore:
+    def __init__(self, srs_dir=os.path.join(DEFAULT_CACHE_DIR, "srs")):
+        self.srs_dir = srs_dir
+        os.makedirs(srs_dir, exist_ok=True)
+
+    def path(self, logrows):
+        return os.path.join(self.srs_dir, f"kzg{logrows}.srs")
+
+    async def ensure(self, settings_path, logrows):
+        """Return the local SRS for logrows, downloading it only the first time."""
+        srs_path = self.path(logrows)
+        if os.path.exists(srs_path):
+            return srs_path
+        with file_lock(srs_path + ".lock"):
+            if not os.path.exists(srs_path): # not downloaded by another process in the meantime
+                print(f"Attempting to get SRS with logrows={logrows}")
+                tmp_path = srs_path + ".tmp"
+                res = await ezkl.get_srs(settings_path, logrows=logrows, srs_path=tmp_path)
+                assert res == True
+                os.replace(tmp_path, srs_path)
+        return srs_path
@@ -0,0 +1,157 @@
+import os
+import sys
+import json
+import glob
+import asyncio
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from ezkl import ezkl
+from ezkl_workflow.artifact_cache import DEFAULT_CACHE_DIR, SRSStore, file_lock
+from trace_utils import span
+
+# Batch verification of received proofs (e.g. an auditor replaying the proofs of many queries).
+#
+# The batch is a list of (proof, settings, vk) triples. The triples are grouped by circuit (digest of the
+# verification key and of the settings): what is shared by the proofs of a circuit is the hashing of its vk and
+# settings files (once per batch) and the resolution of its logrows and SRS file (once per circuit). The groups
+# are verified by the worker processes in chunks. ezkl.verify only takes file paths, so every call still reads
+# and deserializes the vk, settings and SRS of its proof: the keys are not kept in memory between proofs (the
+# files stay in the page cache). Verdicts are cached on disk by the digest of the proof together with the
+# digests of its circuit, so a proof that was already checked is never verified again.
+#
+# output/cache/verdicts.json -> {sha256(proof) + ":" + circuit digest: true | false}
+#
+# Usage: python -m ezkl_workflow.batch_verify <dir>... (every <dir>/**/*.pf next to settings.json and test.vk)
+
+VERDICTS_PATH = os.path.join(DEFAULT_CACHE_DIR, "verdicts.json")
+CHUNK_PROOFS = 16 # proofs verified by a worker in one task
+
+def file_digest(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class VerdictCache:
+    def __init__(self, path=VERDICTS_PATH):
+        self.path = path
+        self._verdicts = None
+
+    def _load(self):
+        if self._verdicts is None:
+            self._verdicts = {}
+            if os.path.exists(self.path):
+                with open(self.path, "r") as f:
+                    self._verdicts = json.load(f)
+        return self._verdicts
+
+    def get(self, key):
+        return self._load().get(key)
+
+    def update(self, verdicts):
+        """Merge new verdicts into the cache file (other processes may have added theirs in the meantime)."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with file_lock(self.path + ".lock"):
+            self._verdicts = None
+            merged = self._load()
+            merged.update(verdicts)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(merged, f)
+            os.replace(tmp_path, self.path)
+
+
+# Runs in a worker process: verifies proofs of one circuit (ezkl loads the vk, settings and SRS on every call)
+def _verify_chunk(proof_paths, settings_path, vk_path, srs_path):
+    results = []
+    for proof_path in proof_paths:
+        try:
+            results.append((bool(ezkl.verify(proof_path, settings_path, vk_path, srs_path=srs_path)), None))
+        except Exception as e:
+            results.append((False, f"{type(e).__name__}: {e}"))
+    return results
+
+def _settings_logrows(settings_path):
+    with open(settings_path, "r") as f:
+        return json.load(f)["run_args"]["logrows"]
+
+async def verify_batch(triples, max_workers=None, srs_store=None, verdicts=None):
+    """Verify (proof, settings, vk) triples in parallel. Returns one
+    {"proof", "verified", "cached", "error"} per triple, in the same order."""
+    triples = [tuple(t) for t in triples]
+    srs_store = srs_store if srs_store is not None else SRSStore()
+    verdicts = verdicts if verdicts is not None else VerdictCache()
+
+    with span("batch_verify", proofs=len(triples)) as s:
+        digests = {} # every vk and settings file is hashed once
+        def digest(path):
+            if path not in digests:
+                digests[path] = file_digest(path)
+            return digests[path]
+
+        results = [None] * len(triples)
+        groups = {} # circuit digest -> {"settings", "vk", "items": [(index, proof, key)]}
+        for i, (proof_path, settings_path, vk_path) in enumerate(triples):
+            if not all(os.path.exists(p) for p in (proof_path, settings_path, vk_path)):
+                results[i] = dict(proof=proof_path, verified=False, cached=False, error="Missing proof, settings or vk")
+                continue
+            circuit = hashlib.sha256((digest(vk_path) + digest(settings_path)).encode()).hexdigest()
+            key = f"{file_digest(proof_path)}:{circuit}"
+            verdict = verdicts.get(key)
+            if verdict is not None:
+                results[i] = dict(proof=proof_path, verified=verdict, cached=True, error=None)
+                continue
+            group = groups.setdefault(circuit, dict(settings=settings_path, vk=vk_path, items=[]))
+            group["items"].append((i, proof_path, key))
+
+        new_verdicts = {}
+        if groups:
+            tasks = []
+            for group in groups.values():
+                srs_path = await srs_store.ensure(group["settings"], _settings_logrows(group["settings"]))
+                items = group["items"]
+                for start in range(0, len(items), CHUNK_PROOFS):
+                    tasks.append((items[start:start + CHUNK_PROOFS], group["settings"], group["vk"], srs_path))
+
+            max_workers = max_workers or min(len(tasks), os.cpu_count() or 1)
+            loop = asyncio.get_running_loop()
+            with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+                chunk_results = await asyncio.gather(*(
+                    loop.run_in_executor(pool, _verify_chunk, [proof for _, proof, _ in items], settings_path, vk_path, srs_path)
+                    for items, settings_path, vk_path, srs_path in tasks))
+
+            for (items, _, _, _), chunk in zip(tasks, chunk_results):
+                for (i, proof_path, key), (verified, error) in zip(items, chunk):
+                    results[i] = dict(proof=proof_path, verified=verified, cached=False, error=error)
+                    if error is None: # errors (e.g. unreadable files) are not verdicts on the proof
+                        new_verdicts[key] = verified
+            verdicts.update(new_verdicts)
+
+        s.set(circuits=len(groups), verified=len(new_verdicts),
+              cached=sum(1 for r in results if r["cached"]), failed=sum(1 for r in results if not r["verified"]))
+    return results
+
+def find_proofs(directories):
+    """(proof, settings, vk) triples of every proof (*.pf, e.g. test.pf or shard_<i>.pf) under the directories,
+    verified with the settings.json and test.vk of its directory."""
+    triples = []
+    for directory in directories:
+        for proof_path in sorted(glob.glob(os.path.join(directory, "**", "*.pf"), recursive=True)):
+            proof_dir = os.path.dirname(proof_path)
+            triples.append((proof_path, os.path.join(proof_dir, "settings.json"), os.path.join(proof_dir, "test.vk")))
+    return triples
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python -m ezkl_workflow.batch_verify <dir>...")
+        sys.exit(1)
+    results = asyncio.run(verify_batch(find_proofs(sys.argv[1:])))
+    for result in results:
+        status = "OK" if result["verified"] else "FAILED"
+        print(f"{status:6} {'(cached) ' if result['cached'] else ''}{result['proof']}{' ' + result['error'] if result['error'] else ''}")
+    print(f"{sum(r['verified'] for r in results)}/{len(results)} proofs verified")
+    sys.exit(0 if all(r["verified"] for r in results) else 1)
@@ -0,0 +1,156 @@
+import os
+import json
+import math
+import tempfile
+import numpy as np
+import onnx
+from onnx import shape_inference
+from ezkl_workflow.artifact_cache import DEFAULT_CACHE_DIR, circuit_key, file_lock
+
+# Circuit sizing: the logrows and the input/param scales of a query model, chosen from its ONNX graph and
+# the input shape instead of being tuned by hand.
+#
+# The number of rows is estimated from the nodes of the graph (layout-only nodes are free, element-wise
+# arithmetic costs one row per element, comparisons and rescaling use range checks, MatMul is a dot product
+# per output element). logrows is the smallest power of two above the estimate; the scale is the largest one
+# (up to DEFAULT_SCALE) that keeps the biggest input/output value inside the range checks.
+# After calibration the real logrows and number of rows are recorded, so the next query with the same
+# model and input shape starts directly from them.
+#
+# output/cache/sizing.json -> {model + shape key: {"logrows", "input_scale", "param_scale", "estimated_rows", ...}}
+
+SIZING_PATH = os.path.join(DEFAULT_CACHE_DIR, "sizing.json")
+
+MIN_LOGROWS = 15      # the range-check tables (decomp_base = 2^14) need at least 2^15 rows
+MAX_LOGROWS = 24
+RESERVED_ROWS = 1024  # blinding factors and table padding
+NUM_INNER_COLS = 2    # default run_args.num_inner_cols: products accumulated per row
+DEFAULT_SCALE = 7
+RANGE_BITS = 27       # decomp_base^decomp_legs = 2^28, signed
+
+# Rows per output element of every operator
+FREE_OPS = {"Constant", "Identity", "Reshape", "Unsqueeze", "Squeeze", "Flatten", "Transpose", "Shape",
+            "Gather", "Slice", "Concat", "Expand", "Cast", "ConstantOfShape", "Split"}
+LINEAR_OPS = {"Add", "Sub", "Neg", "Sum", "ReduceSum", "Where"}
+RESCALED_OPS = {"Mul", "Div", "Pow", "ReduceMean"}
+COMPARISON_OPS = {"Equal", "Less", "Greater", "LessOrEqual", "GreaterOrEqual", "Not", "And", "Or",
+                  "Clip", "Max", "Min", "Relu", "Abs", "ReduceMax", "ReduceMin", "Sign"}
+COMPARISON_ROWS = 3   # decomposition into decomp_legs range-checked limbs + sign
+
+
+def _shapes(model):
+    """Static shape of every tensor of the graph (inputs, initializers, intermediate values, outputs)."""
+    model = shape_inference.infer_shapes(model)
+    shapes = {}
+    graph = model.graph
+    for value in list(graph.input) + list(graph.value_info) + list(graph.output):
+        dims = value.type.tensor_type.shape.dim
+        shapes[value.name] = [d.dim_value if d.HasField("dim_value") else 1 for d in dims]
+    for initializer in graph.initializer:
+        shapes[initializer.name] = list(initializer.dims)
+    return shapes
+
+def _elements(shape):
+    return int(np.prod(shape)) if shape else 1
+
+def estimate_rows(model_onnx_path, input_shape):
+    """Estimated number of circuit rows of the model for an input of the given shape."""
+    model = onnx.load(model_onnx_path)
+    graph_input = model.graph.input[0]
+    for dim, size in zip(graph_input.type.tensor_type.shape.dim, input_shape):
+        dim.dim_value = int(size) # the exported models have fixed shapes, this only fills symbolic dims
+    shapes = _shapes(model)
+
+    rows = 0
+    for node in model.graph.node:
+        if node.op_type in FREE_OPS:
+            continue
+        out_elements = _elements(shapes.get(node.output[0], []))
+        in_elements = max((_elements(shapes.get(name, [])) for name in node.input if name), default=out_elements)
+        if node.op_type in ("MatMul", "Gemm"):
+            inner = shapes.get(node.input[0], [1])[-1]
+            if node.op_type == "Gemm" and any(a.name == "transA" and a.i for a in node.attribute):
+                inner = shapes.get(node.input[0], [1])[0]
+            rows += out_elements * math.ceil(inner / NUM_INNER_COLS) + out_elements # dot products + rescale
+        elif node.op_type in LINEAR_OPS:
+            rows += max(in_elements, out_elements)
+        elif node.op_type in RESCALED_OPS:
+            rows += 2 * out_elements
+        elif node.op_type in COMPARISON_OPS:
+            rows += COMPARISON_ROWS * max(in_elements, out_elements)
+        else:
+            rows += 2 * max(in_elements, out_elements)
+    return rows
+
+def choose_logrows(estimated_rows):
+    logrows = math.ceil(math.log2(estimated_rows + RESERVED_ROWS))
+    return min(max(logrows, MIN_LOGROWS), MAX_LOGROWS)
+
+def choose_scale(max_abs_value):
+    """Largest scale (<= DEFAULT_SCALE) at which max_abs_value * 2^scale stays inside the range checks."""
+    if max_abs_value <= 0:
+        return DEFAULT_SCALE
+    headroom = RANGE_BITS - math.ceil(math.log2(max_abs_value + 1))
+    return max(0, min(DEFAULT_SCALE, headroom))
+
+
+class CircuitSizing:
+    """Persisted sizing of the circuits, one entry per model and input shape."""
+    def __init__(self, path=SIZING_PATH):
+        self.path = path
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return {}
+        with open(self.path, "r") as f:
+            return json.load(f)
+
+    def _save(self, sizes):
+        # unique temporary file, the caller holds the lock of sizing.json
+        with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(self.path) or ".", suffix=".tmp", delete=False) as f:
+            json.dump(sizes, f, indent=4)
+        os.replace(f.name, self.path)
+
+    def _update(self, key, update):
+        """Read-modify-write of one entry under the lock of the file (the proving workers size circuits concurrently).
+        update receives the stored entry (None if there is none) and returns the new one."""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with file_lock(self.path + ".lock"):
+            sizes = self._load()
+            sizing = update(sizes.get(key))
+            if sizes.get(key) != sizing:
+                sizes[key] = sizing
+                self._save(sizes)
+            return sizing
+
+    def size(self, model_onnx_path, input_shape, max_abs_value):
+        """Sizing of the circuit (logrows, input_scale, param_scale), estimated the first time."""
+        key = circuit_key(model_onnx_path, input_shape, "auto")
+        sizes = self._load()
+        if key in sizes:
+            return sizes[key]
+        estimated_rows = estimate_rows(model_onnx_path, input_shape)
+        scale = choose_scale(max_abs_value)
+        sizing = dict(
+            logrows=choose_logrows(estimated_rows),
+            input_scale=scale,
+            param_scale=scale,
+            estimated_rows=estimated_rows,
+        )
+        print(f"Circuit sizing: ~{estimated_rows} rows -> logrows={sizing['logrows']}, scale={scale}")
+        # another process may have sized (or calibrated) the same circuit in the meantime: its entry is kept
+        return self._update(key, lambda stored: stored if stored is not None else sizing)
+
+    def record(self, model_onnx_path, input_shape, settings_path):
+        """Store the logrows, scales and number of rows chosen by the calibration of the circuit."""
+        with open(settings_path, "r") as f:
+            settings = json.load(f)
+        key = circuit_key(model_onnx_path, input_shape, "auto")
+        run_args = settings["run_args"]
+        calibrated = dict(
+            logrows=run_args["logrows"],
+            input_scale=run_args["input_scale"],
+            param_scale=run_args["param_scale"],
+            num_rows=settings.get("num_rows"),
+        )
+        return self._update(key, lambda stored: dict(stored or {}, **calibrated))
@@ -0,0 +1,91 @@
+import json
+import numpy as np
+from ezkl import ezkl
+from ezkl_workflow.artifact_cache import SRSStore
+from ezkl_workflow.circuit_sizing import choose_scale
+from trace_utils import span
+
+# Hashed input mode: the proofs are bound to the commitment of the published dataset.
+#
+# The circuit takes as input the whole encoded dataset tensor (every column of the fact table and the validity
+# column, rows padded to the bucket) with input_visibility "hashed": the proof exposes the Poseidon hash of the
+# quantized input as its first public instance, and the input itself stays private. ORG 1 computes the same
+# hash when it publishes the dataset and stores it in the DatasetRegistry contract next to the file hash, so
+# a query result is checked with one proof and one on-chain value, without downloading or re-hashing the dataset.
+#
+# The hash depends on the scale of the quantization: it is chosen at publication (large enough for the sum of
+# any column over all the rows, so every aggregate stays inside the range checks) and published with the
+# commitment. The circuits of the queries are built with the same input scale.
+#
+# The commitment only says which dataset the circuit read, not which query it computed: the customer also
+# checks that the public outputs of the proof are the result it received (expected_output).
+
+PRIVATE = "private"
+HASHED = "hashed"
+
+def commitment_scale(tensor):
+    """Input scale of a committed tensor: the sum of any column over every row stays inside the range checks."""
+    values = np.abs(np.asarray(tensor, dtype=np.float64))
+    return choose_scale(float(values.sum(axis=0).max()) if values.size else 0.0)
+
+def normalize_felt(felt):
+    """Field element as 64 lowercase hex digits (the encoding of the proof instances)."""
+    return felt.lower().removeprefix("0x")
+
+def input_commitment(tensor, scale):
+    """Poseidon hash of the tensor quantized at scale, the value exposed by a circuit with hashed input."""
+    values = np.asarray(tensor, dtype=np.float32).reshape(-1)
+    with span("input_commitment", values=int(values.size), scale=scale):
+        felts = [ezkl.float_to_felt(float(v), scale) for v in values]
+        return normalize_felt(ezkl.poseidon_hash(felts)[0])
+
+def proof_input_commitment(proof_path):
+    """Hash of the input exposed by a proof (first public instance of a circuit with hashed input)."""
+    with open(proof_path, "r") as f:
+        return normalize_felt(json.load(f)["instances"][0][0])
+
+def proof_outputs(proof_path, settings_path):
+    """Public outputs of a proof as floats, flattened in the order of the output tensor of the model."""
+    with open(proof_path, "r") as f:
+        proof = json.load(f)
+    rescaled = (proof.get("pretty_public_inputs") or {}).get("rescaled_outputs")
+    if rescaled:
+        return [float(value) for output in rescaled for value in output]
+    # older proofs: the outputs follow the hash of the input in the instances, as field elements
+    with open(settings_path, "r") as f:
+        scale = json.load(f)["model_output_scales"][0]
+    return [float(ezkl.felt_to_float(felt, scale)) for felt in proof["instances"][0][1:]]
+
+def has_hashed_input(settings_path):
+    with open(settings_path, "r") as f:
+        visibility = json.load(f)["run_args"]["input_visibility"]
+    # "Hashed" or {"Hashed": {...}} depending on the ezkl version
+    return HASHED in json.dumps(visibility).lower()
+
+async def verify_committed_proof(proof_path, settings_path, vk_path, commitment, srs_store=None, expected_output=None):
+    """Verify a proof and check that its input is the dataset of the published commitment, and that its outputs
+    are expected_output (the result tensor received from the prover, any shape) when it is given.
+    Raises ValueError when the circuit does not hash its input, the input is not the committed one or the
+    outputs are not the expected ones."""
+    # With a private input the first instance is an output, which the prover could choose
+    if not has_hashed_input(settings_path):
+        raise ValueError("The circuit of the proof does not expose a hashed input.")
+    if proof_input_commitment(proof_path) != normalize_felt(commitment):
+        raise ValueError("The proof was not computed on the published dataset.")
+    if expected_output is not None:
+        with open(settings_path, "r") as f:
+            quantum = 2.0 ** -json.load(f)["model_output_scales"][0]
+        outputs = np.asarray(proof_outputs(proof_path, settings_path), dtype=np.float64)
+        expected = np.asarray(expected_output, dtype=np.float64).reshape(-1)
+        # the outputs of the circuit are quantized: they match the float result up to the rounding of the inputs
+        if outputs.shape != expected.shape or not np.allclose(outputs, expected, rtol=1e-3, atol=2 * quantum):
+            raise ValueError("The outputs of the proof are not the result received.")
+
+    srs_store = srs_store if srs_store is not None else SRSStore()
+    with open(settings_path, "r") as f:
+        logrows = json.load(f)["run_args"]["logrows"]
+    srs_path = await srs_store.ensure(settings_path, logrows)
+    with span("verify_committed") as s:
+        verified = bool(ezkl.verify(proof_path, settings_path, vk_path, srs_path=srs_path))
+        s.set(verified=verified)
+    return verified
@@ -1,48 +1,181 @@
 import os
-os.environ["RUST_LOG"] = "trace" # !RUST_LOG=trace
 import json
+import shutil
 from ezkl import ezkl
 import asyncio
+from ezkl_workflow.artifact_cache import ArtifactCache, SRSStore, circuit_key
+from ezkl_workflow.circuit_sizing import CircuitSizing, MAX_LOGROWS
+from ezkl_workflow.dataset_commitment import PRIVATE
+from trace_utils import span, file_size, onnx_node_count
 
-async def generate_proof(output_dir, model_onnx_path, input_json_path, logrows):
-    # Generazione delle impostazioni usando ezkl
-    settings_filename = os.path.join(output_dir, 'settings.json')
-    compiled_filename = os.path.join(output_dir, 'circuit.compiled')
-    
-    res = ezkl.gen_settings(model_onnx_path, settings_filename)
-    assert res == True
+# Every stage runs in a span (see trace_utils.py). The ezkl logs are not forced on anymore:
+# run with RUST_LOG=trace (or debug, info, ...) in the environment to see them.
 
-    try:
-        print(f"Attempting to get SRS with logrows={logrows}")
-        srs_path = await ezkl.get_srs(settings_filename, logrows=logrows)
-        print(f"SRS path: {srs_path}")
-        assert srs_path == True
-    except Exception as e:
-        print(f"Error during SRS generation: {e}")
-        raise
+# Builds the circuit artifacts (settings, compiled circuit, pk, vk) of a model inside entry_paths.
+# sizing: logrows and scales chosen by CircuitSizing (None = fixed logrows, default scales)
+# input_visibility: "private", or "hashed" to expose the Poseidon hash of the input (see dataset_commitment.py)
+async def build_circuit(model_onnx_path, input_json_path, entry_paths, srs_store, logrows, sizing=None,
+                        input_visibility=PRIVATE):
+    settings_filename = entry_paths["settings"]
+    compiled_filename = entry_paths["compiled"]
+    os.makedirs(os.path.dirname(settings_filename), exist_ok=True)
+
+    if sizing is not None:
+        run_args = ezkl.PyRunArgs()
+        run_args.logrows = sizing["logrows"]
+        run_args.input_scale = sizing["input_scale"]
+        run_args.param_scale = sizing["param_scale"]
+        run_args.input_visibility = input_visibility
+        with span("gen_settings", logrows=sizing["logrows"], input_scale=sizing["input_scale"]):
+            res = ezkl.gen_settings(model_onnx_path, settings_filename, py_run_args=run_args)
+        assert res == True
+        # The calibration starts from the estimated size and scale, the SRS is fetched once its final size is known
+        with span("calibrate_settings") as s:
+            res = await ezkl.calibrate_settings(input_json_path, model_onnx_path, settings_filename, "resources",
+                                                scales=[sizing["input_scale"]], max_logrows=MAX_LOGROWS)
+            s.set(logrows=settings_logrows(settings_filename))
+    else:
+        with span("gen_settings", logrows=logrows):
+            res = ezkl.gen_settings(model_onnx_path, settings_filename)
+        assert res == True
 
-    res = await ezkl.calibrate_settings(input_json_path, model_onnx_path, settings_filename, "resources")
+        try:
+            with span("get_srs", logrows=logrows):
+                srs_path = await srs_store.ensure(settings_filename, logrows)
+            print(f"SRS path: {srs_path}")
+        except Exception as e:
+            print(f"Error during SRS generation: {e}")
+            raise
+
+        with span("calibrate_settings") as s:
+            res = await ezkl.calibrate_settings(input_json_path, model_onnx_path, settings_filename, "resources")
+            s.set(logrows=settings_logrows(settings_filename))
     assert res == True
     print(f"calibrate_settings: {res}")
 
-    ezkl.compile_circuit(model_onnx_path, compiled_filename, settings_filename)
+    with span("compile_circuit") as s:
+        ezkl.compile_circuit(model_onnx_path, compiled_filename, settings_filename)
+        s.set(compiled_bytes=file_size(compiled_filename))
+
+    # The calibration may have changed logrows: make sure the SRS of the final size is available
+    final_logrows = settings_logrows(settings_filename)
+    with span("get_srs", logrows=final_logrows):
+        srs_path = await srs_store.ensure(settings_filename, final_logrows)
+
+    # Setup della prova con ezkl
+    with span("setup", logrows=final_logrows) as s:
+        res = ezkl.setup(compiled_filename, entry_paths["vk"], entry_paths["pk"], srs_path=srs_path)
+        s.set(pk_bytes=file_size(entry_paths["pk"]), vk_bytes=file_size(entry_paths["vk"]))
+    assert res == True
+    print(f"setup: {res}")
+
+def settings_logrows(settings_filename):
+    with open(settings_filename, 'r') as f:
+        return json.load(f)["run_args"]["logrows"]
+
+def read_input_shape(input_json_path):
+    with open(input_json_path, 'r') as f:
+        return json.load(f)["input_shapes"][0]
+
+# Shape of the input and largest absolute value of the input and output data (used to choose the scale).
+# Only needed when the caller has no input_stats (as returned by witness_input.write_input): it parses the whole file
+def read_input_stats(input_json_path):
+    with open(input_json_path, 'r') as f:
+        data = json.load(f)
+    values = [abs(v) for key in ("input_data", "output_data") for tensor in data.get(key, []) for v in tensor]
+    return data["input_shapes"][0], max(values, default=0)
 
+# Returns the cached circuit artifacts of a model (building them on a miss) and the SRS path to use with them.
+# logrows=None: logrows and scales are chosen by CircuitSizing from the model and the input shape
+# input_stats: (input shape, largest absolute value) of the input file, read from the file when None
+# input_visibility, input_scale: "hashed" and the scale of the published commitment for the hashed input mode
+async def prepare_circuit(model_onnx_path, input_json_path, logrows=None, cache=None, srs_store=None, sizing_store=None,
+                          input_stats=None, input_visibility=PRIVATE, input_scale=None):
+    with span("prepare_circuit", onnx_nodes=onnx_node_count(model_onnx_path), input_visibility=input_visibility) as s:
+        entry_paths, srs_path = await _prepare_circuit(model_onnx_path, input_json_path, logrows, cache, srs_store, sizing_store,
+                                                       input_stats, input_visibility, input_scale, s)
+        s.set(logrows=settings_logrows(entry_paths["settings"]))
+    return entry_paths, srs_path
+
+async def _prepare_circuit(model_onnx_path, input_json_path, logrows, cache, srs_store, sizing_store, input_stats,
+                           input_visibility, input_scale, prepare_span):
+    cache = cache if cache is not None else ArtifactCache()
+    srs_store = srs_store if srs_store is not None else SRSStore()
+    if (input_visibility != PRIVATE or input_scale is not None) and logrows is not None:
+        raise ValueError("The input visibility and scale can only be set with the automatic sizing (logrows=None)")
+
+    sizing = None
+    if logrows is None:
+        sizing_store = sizing_store if sizing_store is not None else CircuitSizing()
+        input_shape, max_abs_value = input_stats if input_stats is not None else read_input_stats(input_json_path)
+        sizing = sizing_store.size(model_onnx_path, input_shape, max_abs_value)
+        if input_scale is not None:
+            sizing = dict(sizing, input_scale=input_scale) # the scale of the commitment, whatever the data
+    else:
+        input_shape = input_stats[0] if input_stats is not None else read_input_shape(input_json_path)
+    prepare_span.set(input_shape=list(input_shape), auto_sized=sizing is not None)
+
+    # Circuit artifacts are shared by every query with the same model, input shape and logrows ("auto" when sized)
+    variant = [input_visibility, input_scale] if input_visibility != PRIVATE or input_scale is not None else None
+    key = circuit_key(model_onnx_path, input_shape, logrows if logrows is not None else "auto", variant)
+    entry_paths = cache.get(key)
+    prepare_span.set(cache_hit=entry_paths is not None, circuit_key=key[:12])
+    if entry_paths is not None:
+        print(f"Using cached circuit {key[:12]} (skipping settings, calibration, compile and setup)")
+    else:
+        with cache.lock(key):
+            # Another process may have built the same circuit while this one was waiting for the lock
+            entry_paths = cache.get(key)
+            if entry_paths is None:
+                print(f"No cached circuit for {key[:12]}, building it")
+                entry_paths = cache.entry_paths(key)
+                try:
+                    await build_circuit(model_onnx_path, input_json_path, entry_paths, srs_store, logrows, sizing,
+                                        input_visibility)
+                except Exception:
+                    shutil.rmtree(cache.entry_dir(key), ignore_errors=True) # never leave a half-built entry behind
+                    raise
+                entry_paths = cache.put(key)
+                if sizing is not None and input_scale is None: # a forced scale is not the calibrated one
+                    sizing = sizing_store.record(model_onnx_path, input_shape, entry_paths["settings"])
+                    print(f"Calibrated circuit: logrows={sizing['logrows']}, scale={sizing['input_scale']}, rows={sizing['num_rows']}")
+
+    srs_path = await srs_store.ensure(entry_paths["settings"], settings_logrows(entry_paths["settings"]))
+    return entry_paths, srs_path
+
+# Returns the paths of the proof, verification key and settings, and whether the proof was verified
+# circuit_options: input_stats, input_visibility and input_scale of prepare_circuit
+async def generate_proof(output_dir, model_onnx_path, input_json_path, logrows=None, cache=None, srs_store=None,
+                         **circuit_options):
+    with span("generate_proof", input_json_bytes=file_size(input_json_path)):
+        return await _generate_proof(output_dir, model_onnx_path, input_json_path, logrows, cache, srs_store, circuit_options)
+
+# Synchronous entry point of generate_proof, used by the worker processes of the query scheduler
+def prove_sync(output_dir, model_onnx_path, input_json_path, logrows=None, **circuit_options):
+    return asyncio.run(generate_proof(output_dir, model_onnx_path, input_json_path, logrows, **circuit_options))
+
+async def _generate_proof(output_dir, model_onnx_path, input_json_path, logrows, cache, srs_store, circuit_options):
     # Verifica dell'esistenza dei file necessari
-    assert os.path.exists(settings_filename)
     assert os.path.exists(input_json_path)
     assert os.path.exists(model_onnx_path)
 
-    # Setup della prova con ezkl
+    entry_paths, srs_path = await prepare_circuit(model_onnx_path, input_json_path, logrows, cache, srs_store,
+                                                  **circuit_options)
+    settings_filename = entry_paths["settings"]
+    compiled_filename = entry_paths["compiled"]
+    pk_path = entry_paths["pk"]
+
+    # Settings and verification key are shared with the verifier next to the proof
     vk_path = os.path.join(output_dir, 'test.vk')
-    pk_path = os.path.join(output_dir, 'test.pk')
-    res = ezkl.setup(compiled_filename, vk_path, pk_path)
-    assert res == True
-    print(f"setup: {res}")
+    shutil.copyfile(entry_paths["vk"], vk_path)
+    shutil.copyfile(settings_filename, os.path.join(output_dir, 'settings.json'))
 
     witness_path = os.path.join(output_dir, "witness.json")
     try:
         # Generazione del testimone
-        res = await ezkl.gen_witness(input_json_path, compiled_filename, witness_path)
+        with span("gen_witness") as s:
+            res = await ezkl.gen_witness(input_json_path, compiled_filename, witness_path)
+            s.set(witness_bytes=file_size(witness_path))
         if res:
             print("Witness file was successfully generated")
     except Exception as e:
@@ -51,28 +184,41 @@ async def generate_proof(output_dir, model_onnx_path, input_json_path, logrows):
     proof_path = os.path.join(output_dir, 'test.pf')
     try:
         # Generazione della prova
-        proof = ezkl.prove(witness_path, compiled_filename, pk_path, proof_path, "single")
+        with span("prove", logrows=settings_logrows(settings_filename)) as s:
+            proof = ezkl.prove(witness_path, compiled_filename, pk_path, proof_path, "single", srs_path=srs_path)
+            s.set(proof_bytes=file_size(proof_path))
         if proof:
             print("Proof file was successfully generated")
     except Exception as e:
         print(f"An error occurred: {e}")
 
+    verified = False
     try:
         # Verifica della prova
-        res = ezkl.verify(proof_path, settings_filename, vk_path)
+        with span("verify") as s:
+            res = ezkl.verify(proof_path, settings_filename, vk_path, srs_path=srs_path)
+            s.set(verified=bool(res))
         if res:
+            verified = True
             print("The proof was successfully verified")
     except Exception as e:
         print(f"An error occurred: {e}")
 
+    return dict(
+        proof_path=proof_path,
+        vk_path=vk_path,
+        settings_path=os.path.join(output_dir, 'settings.json'),
+        verified=verified,
+    )
+
 if __name__ == "__main__":
     import sys
-    if len(sys.argv) != 5:
-        print("Usage: python generate_proof.py <output_dir> <model_onnx_path> <input_json_path> <logrows>")
+    if len(sys.argv) not in (4, 5):
+        print("Usage: python generate_proof.py <output_dir> <model_onnx_path> <input_json_path> [<logrows>|auto]")
         sys.exit(1)
 
     output_dir = sys.argv[1]
     model_onnx_path = sys.argv[2]
     input_json_path = sys.argv[3]
-    logrows = int(sys.argv[4])
+    logrows = int(sys.argv[4]) if len(sys.argv) == 5 and sys.argv[4] != "auto" else None
     asyncio.run(generate_proof(output_dir, model_onnx_path, input_json_path, logrows))
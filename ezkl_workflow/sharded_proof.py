@@ -0,0 +1,147 @@
+import os
+import json
+import asyncio
+import shutil
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import torch
+from ezkl import ezkl
+from ezkl_workflow.generate_proof import prepare_circuit
+from ezkl_workflow.witness_input import write_input
+from operations.roll_up_model import RollUpModel
+from operations.compact_model import CompactModel
+
+# Sharded proving: the query tensor is split into shards with the same number of rows, every shard
+# is proven with the same circuit and key pair (built once, see prepare_circuit) and the proofs are
+# generated in parallel by a pool of processes. The shard proofs are bound together by a manifest
+# that commits to the ordered list of their digests.
+#
+# output/shards/
+#   model.onnx                 -> the query exported with the shape of one shard
+#   shard_<i>.json             -> input of shard i
+#   shard_<i>.witness.json
+#   shard_<i>.pf               -> proof of shard i
+#   calibration.json           -> input the shared circuit is calibrated on (extremes of every shard)
+#   settings.json, test.vk     -> shared by all the shard proofs
+#   manifest.json              -> digests of the shard proofs and their commitment
+
+# Splits the tensor in shards of shard_rows rows, the last one is padded with zero rows
+# (the tensor should carry a validity column, so the padding rows are ignored by the query)
+def split_shards(tensor_data, shard_rows):
+    shards = list(torch.split(tensor_data, shard_rows, dim=0))
+    last = shards[-1]
+    if last.size(0) < shard_rows:
+        padding = torch.zeros((shard_rows - last.size(0), tensor_data.size(1)), dtype=tensor_data.dtype)
+        shards[-1] = torch.cat([last, padding], dim=0)
+    return shards
+
+# A compaction after a roll-up cannot be sharded: every shard would keep its own first groups, not the final ones
+def check_shardable(pipeline):
+    steps = list(pipeline.steps)
+    if len(steps) > 1 and isinstance(steps[-1], CompactModel) and isinstance(steps[-2], RollUpModel):
+        raise ValueError("A roll-up with a limit cannot be proven in shards")
+
+# Input the shared circuit is calibrated on: at every position, the value of largest magnitude among the shards.
+# Calibrating on one shard only would size the lookup ranges for its values, which the other shards can exceed
+def calibration_input(shards):
+    extremes = shards[0].clone()
+    for shard in shards[1:]:
+        extremes = torch.where(shard.abs() > extremes.abs(), shard, extremes)
+    return extremes
+
+# Combines the outputs of the shards: roll-ups are merged group by group, compacted rows are compacted again,
+# row-level results are concatenated
+def merge_shard_outputs(pipeline, outputs):
+    last_step = pipeline.steps[-1] if len(pipeline.steps) > 0 else None
+    if isinstance(last_step, (RollUpModel, CompactModel)):
+        return last_step.merge_partials(outputs)
+    return torch.cat(outputs, dim=0)
+
+def file_digest(path):
+    hasher = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+# Commitment to the ordered list of shard proofs
+def commit_proofs(proof_digests):
+    hasher = hashlib.sha256()
+    for digest in proof_digests:
+        hasher.update(bytes.fromhex(digest))
+    return hasher.hexdigest()
+
+# Runs in a worker process: witness and proof of one shard
+def _prove_shard(input_json_path, compiled_path, pk_path, settings_path, vk_path, srs_path, witness_path, proof_path):
+    asyncio.run(ezkl.gen_witness(input_json_path, compiled_path, witness_path))
+    ezkl.prove(witness_path, compiled_path, pk_path, proof_path, "single", srs_path=srs_path)
+    verified = ezkl.verify(proof_path, settings_path, vk_path, srs_path=srs_path)
+    return proof_path, bool(verified)
+
+async def generate_sharded_proof(output_dir, pipeline, tensor_data, shard_rows, logrows=None, max_workers=None,
+                                 cache=None, srs_store=None):
+    check_shardable(pipeline)
+    shards_dir = os.path.join(output_dir, "shards")
+    os.makedirs(shards_dir, exist_ok=True)
+
+    shards = split_shards(tensor_data, shard_rows)
+    print(f"Proving {len(shards)} shards of {shard_rows} rows")
+
+    # One model for every shard: all the shards have the same shape
+    model_onnx_path = os.path.join(shards_dir, "model.onnx")
+    pipeline.export(shards[0], model_onnx_path)
+
+    outputs = []
+    input_paths = []
+    input_shape, max_abs_value = None, 0.0
+    for i, shard in enumerate(shards):
+        shard_output = pipeline(shard)
+        outputs.append(shard_output)
+        input_json_path = os.path.join(shards_dir, f"shard_{i}.json")
+        input_shape, shard_max_abs = write_input(input_json_path, shard, shard_output, include_output=False)
+        max_abs_value = max(max_abs_value, shard_max_abs)
+        input_paths.append(input_json_path)
+
+    # Settings, calibration, compile and setup only once, shared by all the shards. The scale is chosen from the
+    # largest value of every shard and the calibration runs on the extremes of every shard, not only on the first one
+    calibration_path = os.path.join(shards_dir, "calibration.json")
+    write_input(calibration_path, calibration_input(shards), include_output=False)
+    entry_paths, srs_path = await prepare_circuit(model_onnx_path, calibration_path, logrows, cache, srs_store,
+                                                  input_stats=(input_shape, max_abs_value))
+
+    # The verifier needs only the settings and the verification key next to the proofs
+    shutil.copyfile(entry_paths["vk"], os.path.join(shards_dir, "test.vk"))
+    shutil.copyfile(entry_paths["settings"], os.path.join(shards_dir, "settings.json"))
+
+    max_workers = max_workers or min(len(shards), os.cpu_count() or 1)
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        futures = []
+        for i, input_json_path in enumerate(input_paths):
+            futures.append(loop.run_in_executor(
+                pool, _prove_shard, input_json_path, entry_paths["compiled"], entry_paths["pk"],
+                entry_paths["settings"], entry_paths["vk"], srs_path,
+                os.path.join(shards_dir, f"shard_{i}.witness.json"), os.path.join(shards_dir, f"shard_{i}.pf")))
+        results = await asyncio.gather(*futures)
+
+    failed = [proof_path for proof_path, verified in results if not verified]
+    if failed:
+        raise RuntimeError(f"Shard proofs failed verification: {failed}")
+
+    proof_digests = [file_digest(proof_path) for proof_path, _ in results]
+    manifest = dict(
+        shard_rows=shard_rows,
+        num_shards=len(shards),
+        model_digest=file_digest(model_onnx_path),
+        vk_digest=file_digest(entry_paths["vk"]),
+        proofs=[os.path.basename(proof_path) for proof_path, _ in results],
+        proof_digests=proof_digests,
+        commitment=commit_proofs(proof_digests)
+    )
+    manifest_path = os.path.join(shards_dir, "manifest.json")
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    print(f"All shard proofs verified, commitment {manifest['commitment']}")
+
+    return merge_shard_outputs(pipeline, outputs), manifest_path
@@ -0,0 +1,54 @@
+import json
+import numpy as np
+
+# Input files of the circuits (the input.json read by ezkl calibrate_settings and gen_witness):
+#
+# {"input_shapes": [[rows, columns]], "input_data": [[...]], "output_data": [[...]]}
+#
+# ezkl reads only this JSON format, so the file stays JSON, but it is written without tolist() + json.dump
+# (one Python float object per value): the flattened tensors are formatted by NumPy and streamed to the file
+# in chunks of WRITE_CHUNK values. Numbers are written with "%.9g" (exact for float32), so the encoded
+# categories and the validity flags take one or two characters instead of "3.0" / "1.0".
+# The output data is optional: gen_witness recomputes the outputs of the model from the input.
+
+WRITE_CHUNK = 1 << 16 # values formatted at once
+VALUE_FORMAT = "%.9g"
+
+def _as_array(tensor):
+    if hasattr(tensor, "detach"): # torch tensor
+        tensor = tensor.detach().cpu().numpy()
+    return np.asarray(tensor, dtype=np.float32)
+
+def _write_values(f, values):
+    f.write("[")
+    for start in range(0, values.size, WRITE_CHUNK):
+        if start:
+            f.write(",")
+        np.savetxt(f, values[start:start + WRITE_CHUNK][None], fmt=VALUE_FORMAT, delimiter=",", newline="")
+    f.write("]")
+
+def _max_abs(values):
+    return float(np.abs(values).max()) if values.size else 0.0
+
+def write_input(input_json_path, input_tensor, output_tensor=None, include_output=True):
+    """Write the input file of a circuit. The output tensor is written only with include_output
+    (it still counts for the stats). Returns (input shape, largest absolute value of the input and output),
+    the stats prepare_circuit would otherwise read back from the file."""
+    data = _as_array(input_tensor)
+    values = data.reshape(-1)
+    output = _as_array(output_tensor).reshape(-1) if output_tensor is not None else None
+
+    with open(input_json_path, "w") as f:
+        f.write('{"input_shapes":' + json.dumps([list(data.shape)]) + ',"input_data":[')
+        _write_values(f, values)
+        f.write("]")
+        if output is not None and include_output:
+            f.write(',"output_data":[')
+            _write_values(f, output)
+            f.write("]")
+        f.write("}")
+
+    max_abs = _max_abs(values)
+    if output is not None:
+        max_abs = max(max_abs, _max_abs(output))
+    return list(data.shape), max_abs
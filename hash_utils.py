@@ -2,148 +2,357 @@ import os
 import json
 import hashlib
 import logging
+import threading
 from web3 import Web3
+from web3_client import get_client
+from merkle_utils import (leaf_hash, build_levels, merkle_root, append_leaf, replace_last_leaf,
+                          inclusion_proof, verify_inclusion, levels_to_hex, levels_from_hex)
 
 logging.basicConfig(level=logging.INFO)
 
-# Load contract addresses from configuration file
-CONFIG_PATH = os.path.join(os.path.dirname(__file__), 'config', 'contract_addresses.json')
-with open(CONFIG_PATH, 'r') as f:
-    contract_addresses = json.load(f)
-
-CONTRACT_ADDRESS = contract_addresses.get("HashStorage")
-DATA_FACT_MODEL_ADDRESS = contract_addresses.get("DataFactModel")
-
-# ABI (Application Binary Interface) is a JSON description of the contract's functions and events
-# It allows us to interact with the contract using web3.py
-CONTRACT_ABI_SET_HASH = json.loads('''
-[
-    {
-        "constant": false,
-        "inputs": [
-            {
-                "name": "newHash",
-                "type": "bytes32"
-            }
-        ],
-        "name": "setHash",
-        "outputs": [],
-        "payable": false,
-        "stateMutability": "nonpayable",
-        "type": "function"
-    }
-]
-''')
-CONTRACT_ABI_GET_HASH = json.loads('''
-[
-    {
-        "constant": true,
-        "inputs": [],
-        "name": "getHash",
-        "outputs": [
-            {
-                "name": "",
-                "type": "bytes32"
-            }
-        ],
-        "payable": false,
-        "stateMutability": "view",
-        "type": "function"
-    }
-]
-''')
-CONTRACT_ABI_QUERY_ALLOWED = json.loads('''
-[
-    {
-        "constant": true,
-        "inputs": [
-            {
-                "name": "queryDimensions",
-                "type": "string[]"
-            }
-        ],
-        "name": "isQueryAllowed",
-        "outputs": [
-            {
-                "name": "",
-                "type": "bool"
-            }
-        ],
-        "payable": false,
-        "stateMutability": "view",
-        "type": "function"
-    }
-]
-''')
+# Contract instances come from the process-wide client (web3_client.py): one provider with a keep-alive
+# session and one contract object per address, built from the full ABI in build/contracts
 
-def setup_web3():
-    web3 = Web3(Web3.HTTPProvider("http://127.0.0.1:8545"))
-    if not web3.is_connected():
-        logging.error("Failed to connect to the blockchain.")
-        raise ConnectionError("Failed to connect to the blockchain.")
-    return web3
-
-def get_contract(web3, address, abi):
-    # It retrieves the contract instance using the address and ABI
-    # If the contract is not deployed at the given address, it will be deployed
-    return web3.eth.contract(address=address, abi=abi)
+# Files are hashed in blocks of this size, so memory does not grow with the file
+HASH_BUFFER_SIZE = 1024 * 1024
+# Number of rows of every chunk (leaf) of the Merkle mode
+MERKLE_CHUNK_ROWS = 1024
+# The Merkle trees are stored here, next to the published hashes (not in data/uploaded, which lists the datasets)
+MERKLE_DIR = os.path.join('data', 'merkle')
+# Batches published as one Merkle root (DatasetRegistry.publishRoot):
+#   data/batches/<root>.json          -> entries and levels of the tree of the batch
+#   data/batches/proofs/<file>.json   -> inclusion proofs of a dataset (and of its cuboids), handed to the customer
+BATCH_DIR = os.path.join('data', 'batches')
 
 def calculate_file_hash(file_path):
     """Calculate the SHA-256 hash of a file."""
     hasher = hashlib.sha256()
     try:
         with open(file_path, 'rb') as f:
-            buf = f.read()
-            hasher.update(buf)
+            for buf in iter(lambda: f.read(HASH_BUFFER_SIZE), b""):
+                hasher.update(buf)
     except FileNotFoundError:
         logging.error(f"File not found: {file_path}")
         raise
     return hasher.hexdigest()
 
-def get_stored_hash(web3, contract):
-    return contract.functions.getHash().call()
+def iter_row_chunks(file_path, chunk_rows=MERKLE_CHUNK_ROWS, start_offset=0):
+    """Yield (offset, bytes) for consecutive chunks of chunk_rows lines of the file."""
+    with open(file_path, 'rb') as f:
+        f.seek(start_offset)
+        offset = start_offset
+        while True:
+            lines = []
+            for _ in range(chunk_rows):
+                line = f.readline()
+                if not line:
+                    break
+                lines.append(line)
+            if not lines:
+                return
+            chunk = b"".join(lines)
+            yield offset, chunk
+            offset += len(chunk)
+
+def merkle_tree_path(file_path):
+    return os.path.join(MERKLE_DIR, os.path.basename(file_path) + '.json')
+
+def save_merkle_tree(file_path, tree):
+    os.makedirs(MERKLE_DIR, exist_ok=True)
+    with open(merkle_tree_path(file_path), 'w') as f:
+        json.dump(tree, f)
+
+def load_merkle_tree(file_path):
+    with open(merkle_tree_path(file_path), 'r') as f:
+        return json.load(f)
+
+def calculate_merkle_tree(file_path, chunk_rows=MERKLE_CHUNK_ROWS):
+    """Merkle tree over row-aligned chunks of a file: root, chunk offsets/lengths and the levels of the tree."""
+    chunks = []
+    leaves = []
+    for offset, chunk in iter_row_chunks(file_path, chunk_rows):
+        chunks.append({"offset": offset, "length": len(chunk)})
+        leaves.append(leaf_hash(chunk))
+    levels = build_levels(leaves)
+    return {
+        "root": merkle_root(levels).hex(),
+        "chunk_rows": chunk_rows,
+        "chunks": chunks,
+        "levels": levels_to_hex(levels),
+    }
+
+def append_merkle_tree(file_path):
+    """Update the stored tree of a file after rows were appended to it: only the last chunk and the new ones are hashed."""
+    tree = load_merkle_tree(file_path)
+    levels = levels_from_hex(tree["levels"])
+    chunks = tree["chunks"]
+    chunk_rows = tree["chunk_rows"]
+    if not chunks:
+        tree = calculate_merkle_tree(file_path, chunk_rows)
+        save_merkle_tree(file_path, tree)
+        return tree
+
+    # The last chunk may have been partial: it is re-hashed from its offset together with the new rows
+    new_chunks = iter_row_chunks(file_path, chunk_rows, start_offset=chunks[-1]["offset"])
+    offset, chunk = next(new_chunks)
+    chunks[-1] = {"offset": offset, "length": len(chunk)}
+    replace_last_leaf(levels, leaf_hash(chunk))
+    for offset, chunk in new_chunks:
+        chunks.append({"offset": offset, "length": len(chunk)})
+        append_leaf(levels, leaf_hash(chunk))
 
-def publish_hash(file_path):
-    calculated_hash = calculate_file_hash(file_path) # hash_utils.py
-    bytes32_hash = Web3.to_bytes(hexstr=calculated_hash)
+    tree["root"] = merkle_root(levels).hex()
+    tree["levels"] = levels_to_hex(levels)
+    save_merkle_tree(file_path, tree)
+    return tree
 
-    web3 = setup_web3()
-    # call to get (create) the contract instance
-    contract = get_contract(web3, CONTRACT_ADDRESS, CONTRACT_ABI_SET_HASH) # hash_utils.py
+def find_changed_chunks(file_path, tree, root, chunks=None):
+    """Indices of the chunks that are not part of the tree with the given root (only the requested ones if given).
+    Every chunk is checked with its inclusion proof, so the stored tree does not need to be trusted."""
+    levels = levels_from_hex(tree["levels"])
+    indices = range(len(tree["chunks"])) if chunks is None else chunks
+    changed = []
+    with open(file_path, 'rb') as f:
+        for i in indices:
+            if i >= len(tree["chunks"]):
+                changed.append(i)
+                continue
+            f.seek(tree["chunks"][i]["offset"])
+            chunk = f.read(tree["chunks"][i]["length"])
+            if not verify_inclusion(leaf_hash(chunk), inclusion_proof(levels, i), root):
+                changed.append(i)
+    if chunks is None and os.path.getsize(file_path) != sum(c["length"] for c in tree["chunks"]):
+        changed.append(len(tree["chunks"])) # rows added or removed at the end of the file
+    return changed
 
-    account = web3.eth.accounts[0]
+def file_key(file_path):
+    """Key of a file in the DatasetRegistry: keccak256 of its name."""
+    return Web3.keccak(text=os.path.basename(file_path))
 
+def _set_file_hash(file_path, calculated_hash, merkle):
+    client = get_client()
+    # cached contract instance (DatasetRegistry address from config/contract_addresses.json)
+    contract = client.contract("DatasetRegistry") # web3_client.py
     try:
-        # setHash() from HashStorage.sol Solidity contract
-        tx_hash = contract.functions.setHash(bytes32_hash).transact({'from': account})
-        web3.eth.wait_for_transaction_receipt(tx_hash)
-        logging.info(f"Hash {calculated_hash} has been published to the blockchain.")
+        # setFileHash() from DatasetRegistry.sol Solidity contract: one record per file
+        tx_hash = contract.functions.setFileHash(file_key(file_path), Web3.to_bytes(hexstr=calculated_hash),
+                                                 merkle).transact({'from': client.default_account})
+        client.web3.eth.wait_for_transaction_receipt(tx_hash)
+        logging.info(f"Hash {calculated_hash} of {os.path.basename(file_path)} has been published to the blockchain.")
         return calculated_hash
     except Exception as e:
         logging.error(f"Failed to publish hash: {e}")
         raise
 
-def verify_dataset_hash(file_path):
-    calculated_hash = calculate_file_hash(file_path)
-    bytes32_hash = Web3.to_bytes(hexstr=calculated_hash)
+def publish_hash(file_path, merkle=False):
+    """Publish the hash of a file: its SHA-256, or with merkle=True the root of the Merkle tree of its
+    row chunks (the tree is kept in data/merkle, rows appended later are published with publish_appended_rows)."""
+    if merkle:
+        tree = calculate_merkle_tree(file_path)
+        save_merkle_tree(file_path, tree)
+        calculated_hash = tree["root"]
+    else:
+        calculated_hash = calculate_file_hash(file_path) # hash_utils.py
+    return _set_file_hash(file_path, calculated_hash, merkle)
 
-    web3 = setup_web3()
-    contract = get_contract(web3, CONTRACT_ADDRESS, CONTRACT_ABI_GET_HASH)
+def publish_appended_rows(file_path):
+    """Publish the new root of a file published with merkle=True after rows were appended to it:
+    only the last chunk and the new ones are hashed. Returns the new root."""
+    if not os.path.exists(merkle_tree_path(file_path)):
+        raise FileNotFoundError(f"No Merkle tree of {os.path.basename(file_path)}: publish it in Merkle mode first")
+    tree = append_merkle_tree(file_path)
+    return _set_file_hash(file_path, tree["root"], True)
 
-    stored_hash = get_stored_hash(web3, contract)
+def _file_hash_record(record):
+    stored_hash, merkle = record
+    if bytes(stored_hash) == bytes(32):
+        return None
+    return bytes(stored_hash).hex(), merkle
 
-    #logging.info(f"Calculated hash: {bytes32_hash}")
-    #logging.info(f"Stored hash: {stored_hash}")
+def get_file_hash(file_path):
+    """Published hash of a file: (hash, merkle), or None if it was never published."""
+    return _file_hash_record(get_client().contract("DatasetRegistry").functions.getFileHash(file_key(file_path)).call())
 
-    if bytes32_hash == stored_hash:
-        logging.info("Hash verification successful. The dataset is authentic.")
-    else:
+def check_file_hash(file_path, published, chunks=None):
+    """Check a file against its published (hash, merkle) record. Raises ValueError if it does not match."""
+    if published is None:
+        raise ValueError(f"Hash verification failed. No hash published for {os.path.basename(file_path)}.")
+    stored_hash, merkle = published
+    if merkle:
+        if not os.path.exists(merkle_tree_path(file_path)):
+            raise ValueError(f"Hash verification failed. The Merkle tree of {os.path.basename(file_path)} is missing.")
+        # Only the requested chunks are re-hashed (all of them if chunks is None),
+        # each one is checked against the published root with its inclusion proof
+        changed = find_changed_chunks(file_path, load_merkle_tree(file_path), bytes.fromhex(stored_hash), chunks)
+        if changed:
+            logging.error(f"Hash verification failed. Chunks changed: {changed}")
+            raise ValueError(f"Hash verification failed. The dataset has been tampered with (chunks {changed}).")
+    elif calculate_file_hash(file_path) != stored_hash:
+        logging.error("Hash verification failed. The dataset has been tampered with.")
+        raise ValueError("Hash verification failed. The dataset has been tampered with.")
+    logging.info("Hash verification successful. The dataset is authentic.")
+
+def verify_dataset_hash(file_path, chunks=None):
+    """Verify a file against the hash published for it (Merkle root or SHA-256, as it was published)."""
+    check_file_hash(file_path, get_file_hash(file_path), chunks)
+
+def publish_commitment(file_hash, commitment, scale, rows):
+    """Publish the commitment of the encoded dataset (see ezkl_workflow/dataset_commitment.py) next to its file hash."""
+    client = get_client()
+    # setCommitment() from DatasetRegistry.sol Solidity contract
+    contract = client.contract("DatasetRegistry")
+    try:
+        tx_hash = contract.functions.setCommitment(Web3.to_bytes(hexstr=file_hash), Web3.to_bytes(hexstr=commitment),
+                                                   scale, rows).transact({'from': client.default_account})
+        client.web3.eth.wait_for_transaction_receipt(tx_hash)
+        logging.info(f"Commitment {commitment} (scale {scale}) of dataset {file_hash} has been published to the blockchain.")
+    except Exception as e:
+        logging.error(f"Failed to publish commitment: {e}")
+        raise
+
+def get_commitment(file_hash):
+    """Published commitment of a dataset: {"commitment", "scale", "rows"}, or None if there is none."""
+    contract = get_client().contract("DatasetRegistry")
+    commitment, scale, rows = contract.functions.getCommitment(Web3.to_bytes(hexstr=file_hash)).call()
+    if commitment == bytes(32):
+        return None
+    return dict(commitment=bytes(commitment).hex(), scale=scale, rows=rows)
+
+def batch_leaf(entry):
+    """Leaf of a batch entry, e.g. {"file", "hash"} of a dataset or {"dataset", "cuboid", "commitment"} of a cuboid."""
+    return leaf_hash(json.dumps(entry, sort_keys=True).encode())
+
+def inclusion_proof_path(file_name):
+    return os.path.join(BATCH_DIR, 'proofs', os.path.basename(file_name) + '.json')
+
+def load_inclusion_proof(file_name):
+    with open(inclusion_proof_path(file_name), 'r') as f:
+        return json.load(f)
+
+def remove_inclusion_proof(file_name):
+    """Drop the batch receipt of a file (its hash was published again on its own, the receipt is stale)."""
+    try:
+        os.remove(inclusion_proof_path(file_name))
+    except FileNotFoundError:
+        pass
+
+def publish_hash_batch(entries):
+    """Publish the Merkle root of a batch of entries in one transaction. The tree is saved in data/batches and
+    every dataset ({"file", "hash"} entry) gets its inclusion proofs, together with the ones of its cuboids.
+    Returns the root."""
+    levels = build_levels([batch_leaf(entry) for entry in entries])
+    root = merkle_root(levels)
+
+    client = get_client()
+    # publishRoot() from DatasetRegistry.sol Solidity contract
+    contract = client.contract("DatasetRegistry")
+    try:
+        tx_hash = contract.functions.publishRoot(root).transact({'from': client.default_account})
+        client.web3.eth.wait_for_transaction_receipt(tx_hash)
+    except Exception as e:
+        logging.error(f"Failed to publish batch root: {e}")
+        raise
+    _published_roots.add(root.hex())
+    logging.info(f"Root {root.hex()} of {len(entries)} entries has been published to the blockchain.")
+
+    os.makedirs(os.path.join(BATCH_DIR, 'proofs'), exist_ok=True)
+    with open(os.path.join(BATCH_DIR, root.hex() + '.json'), 'w') as f:
+        json.dump(dict(root=root.hex(), entries=entries, levels=levels_to_hex(levels)), f)
+
+    def receipt(index):
+        proof = [[sibling.hex(), sibling_is_left] for sibling, sibling_is_left in inclusion_proof(levels, index)]
+        return dict(entry=entries[index], index=index, proof=proof)
+
+    for i, entry in enumerate(entries):
+        if "file" not in entry:
+            continue
+        cuboids = {other["cuboid"]: receipt(j) for j, other in enumerate(entries) if other.get("dataset") == entry["hash"]}
+        with open(inclusion_proof_path(entry["file"]), 'w') as f:
+            json.dump(dict(root=root.hex(), dataset=receipt(i), cuboids=cuboids), f, indent=4)
+    return root.hex()
+
+# Roots already found on chain: a published root never changes, so it is checked once per process
+_published_roots = set()
+_published_roots_lock = threading.Lock()
+
+def is_root_published(root):
+    """True if the root was published by the owner of the DatasetRegistry (ORG 1), not just by any account."""
+    with _published_roots_lock:
+        if root in _published_roots:
+            return True
+    contract = get_client().contract("DatasetRegistry")
+    publisher = contract.functions.rootPublisher(Web3.to_bytes(hexstr=root)).call()
+    published = int(publisher, 16) != 0 and publisher.lower() == contract.functions.owner().call().lower()
+    if published:
+        with _published_roots_lock:
+            _published_roots.add(root)
+    return published
+
+def verify_batch_entry(receipt, root):
+    """True if the entry of the receipt is a leaf of the tree with the given (published) root."""
+    proof = [(bytes.fromhex(sibling), sibling_is_left) for sibling, sibling_is_left in receipt["proof"]]
+    return verify_inclusion(batch_leaf(receipt["entry"]), proof, bytes.fromhex(root)) and is_root_published(root)
+
+def published_cuboid_commitments(file_name, dataset_hash):
+    """{cuboid name: commitment} of the cuboids of a dataset that were published in its batch, every entry
+    checked against the published root. Empty if the dataset was not published in a batch."""
+    if not os.path.exists(inclusion_proof_path(file_name)):
+        return {}
+    inclusion = load_inclusion_proof(file_name)
+    if inclusion["dataset"]["entry"]["hash"] != dataset_hash:
+        return {} # receipt of another version of the file
+    return {name: receipt["entry"]["commitment"] for name, receipt in inclusion["cuboids"].items()
+            if receipt["entry"]["dataset"] == dataset_hash and verify_batch_entry(receipt, inclusion["root"])}
+
+def verify_dataset_in_batch(file_path):
+    """Check a file against the root of its batch: a local hash and Merkle check, the root is looked up
+    on chain once per process."""
+    inclusion = load_inclusion_proof(file_path)
+    receipt = inclusion["dataset"]
+    if receipt["entry"]["hash"] != calculate_file_hash(file_path):
         logging.error("Hash verification failed. The dataset has been tampered with.")
         raise ValueError("Hash verification failed. The dataset has been tampered with.")
+    if not verify_batch_entry(receipt, inclusion["root"]):
+        logging.error(f"Hash verification failed. The hash is not part of the published batch {inclusion['root']}.")
+        raise ValueError("Hash verification failed. The hash is not part of a published batch.")
+    logging.info("Hash verification successful. The dataset is authentic.")
+
+def verify_dataset(file_path):
+    """Verify a file with its batch inclusion proof if it was published in a batch, against its own hash otherwise."""
+    if os.path.exists(inclusion_proof_path(file_path)):
+        verify_dataset_in_batch(file_path)
+    else:
+        verify_dataset_hash(file_path)
+
+def verify_datasets(file_paths):
+    """Verify many files like verify_dataset, with one round trip to the node: the hashes of the files published
+    on their own are read in a single JSON-RPC batch (the roots of the batches are looked up once per process).
+    Returns {file_path: None if verified, the error message otherwise}."""
+    results = {}
+    own_hash = []
+    for file_path in file_paths:
+        if os.path.exists(inclusion_proof_path(file_path)):
+            try:
+                verify_dataset_in_batch(file_path)
+                results[file_path] = None
+            except (ValueError, FileNotFoundError) as e:
+                results[file_path] = str(e)
+        else:
+            own_hash.append(file_path)
+
+    client = get_client()
+    contract = client.contract("DatasetRegistry")
+    records = client.batch_call([contract.functions.getFileHash(file_key(file_path)) for file_path in own_hash])
+    for file_path, record in zip(own_hash, records):
+        try:
+            check_file_hash(file_path, _file_hash_record(record))
+            results[file_path] = None
+        except (ValueError, FileNotFoundError) as e:
+            results[file_path] = str(e)
+    return {file_path: results[file_path] for file_path in file_paths}
 
-def verify_query_allowed(query_dimensions, contract_address):
-    web3 = setup_web3()
-    contract = get_contract(web3, contract_address, CONTRACT_ABI_QUERY_ALLOWED)
+def verify_query_allowed(query_dimensions, contract_address=None):
+    contract = get_client().contract("DataFactModel", contract_address)
 
     try:
         # .call() is used to call a function that does not modify the state of the blockchain
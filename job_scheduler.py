@@ -0,0 +1,153 @@
+import os
+import time
+import uuid
+import asyncio
+import functools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from ezkl_workflow.generate_proof import prove_sync
+from trace_utils import span, dump_metrics
+
+# Scheduler of query jobs: many queries run at the same time, every one in three stages.
+# - prepare (load the cube, plan, run the pipeline, export the model, write the input): in threads,
+#   at most max_prepare jobs at a time
+# - proof (settings, setup, witness, prove, verify): in a pool of worker processes, so the heavy ezkl calls
+#   never block the event loop and the proofs of different queries run on different cores. The pool is sized
+#   to the cores and to the memory available (proof_memory_bytes per proof)
+# - finish (decode and save the result): in threads
+# Every job has its own directory (output/jobs/<job id>/) with its model, input, proof and keys.
+#
+# The stages are given by the caller: prepare(file_path, selected_file, dataset_hash, query_dir, spec=spec) -> prepared
+# query (dict with model_onnx_path, input_json_path and optionally proof_options for generate_proof), finish(prepared) -> path of the result.
+
+JOBS_DIR = os.path.join("output", "jobs")
+DEFAULT_PROOF_MEMORY = 4 * 1024 ** 3 # memory reserved for every proof in the pool
+
+QUEUED, PREPARING, PROVING, FINISHING, DONE, FAILED = "queued", "preparing", "proving", "finishing", "done", "failed"
+
+def available_memory():
+    """MemAvailable of /proc/meminfo in bytes (None when unknown)."""
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+def _warm_worker():
+    # Runs in a new worker process: unpickling this function has already imported this module (ezkl, onnx) there
+    return os.getpid()
+
+def default_prove_workers(proof_memory_bytes=DEFAULT_PROOF_MEMORY):
+    workers = os.cpu_count() or 1
+    memory = available_memory()
+    if memory is not None:
+        workers = min(workers, memory // proof_memory_bytes)
+    return max(1, workers)
+
+
+class QueryJob:
+    def __init__(self, file_path, selected_file, dataset_hash=None, spec=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.file_path = file_path
+        self.selected_file = selected_file
+        self.dataset_hash = dataset_hash
+        self.spec = spec # query spec (None = the default query of prepare)
+        self.status = QUEUED
+        self.result = None
+        self.proof = None
+        self.error = None
+        self.submitted = time.time()
+        self.stage_times = {}
+        self.task = None
+
+    def to_dict(self):
+        return dict(
+            id=self.id,
+            file=self.selected_file,
+            dataset_hash=self.dataset_hash,
+            spec=self.spec,
+            status=self.status,
+            result=self.result,
+            proof=self.proof,
+            error=self.error,
+            stage_times=self.stage_times,
+        )
+
+
+class QueryScheduler:
+    def __init__(self, prepare, finish, max_prepare=4, max_prove_workers=None,
+                 proof_memory_bytes=DEFAULT_PROOF_MEMORY, jobs_dir=JOBS_DIR):
+        self.prepare = prepare
+        self.finish = finish
+        self.jobs_dir = jobs_dir
+        self.max_prove_workers = max_prove_workers or default_prove_workers(proof_memory_bytes)
+        self._prepare_slots = asyncio.Semaphore(max_prepare)
+        # spawn: the workers do not inherit the threads (RSS sampler, event loop) of this process
+        self._pool = ProcessPoolExecutor(max_workers=self.max_prove_workers,
+                                         mp_context=multiprocessing.get_context("spawn"))
+        self._jobs = {}
+
+    def submit(self, file_path, selected_file, dataset_hash=None, spec=None):
+        """Queue a query and return its job id (must be called from the running event loop)."""
+        job = QueryJob(file_path, selected_file, dataset_hash, spec)
+        self._jobs[job.id] = job
+        job.task = asyncio.get_running_loop().create_task(self._run(job))
+        return job.id
+
+    def status(self, job_id):
+        return self._jobs[job_id].to_dict()
+
+    def jobs(self):
+        return [job.to_dict() for job in self._jobs.values()]
+
+    async def wait(self, job_id):
+        job = self._jobs[job_id]
+        await asyncio.gather(job.task, return_exceptions=True)
+        return job.to_dict()
+
+    async def wait_all(self):
+        await asyncio.gather(*(job.task for job in self._jobs.values()), return_exceptions=True)
+        return self.jobs()
+
+    async def warm_up(self):
+        """Start the proving workers now (imports included) instead of on the first proof."""
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(*(loop.run_in_executor(self._pool, _warm_worker) for _ in range(self.max_prove_workers)))
+        return sorted(set(pids))
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
+        dump_metrics()
+
+    def _stage(self, job, status):
+        job.status = status
+        job.stage_times[status] = time.time()
+
+    async def _run(self, job):
+        loop = asyncio.get_running_loop()
+        query_dir = os.path.join(self.jobs_dir, job.id)
+        try:
+            with span("job", job_id=job.id, file=job.selected_file):
+                async with self._prepare_slots:
+                    self._stage(job, PREPARING)
+                    prepared = await asyncio.to_thread(self.prepare, job.file_path, job.selected_file,
+                                                       job.dataset_hash, query_dir, spec=job.spec)
+
+                self._stage(job, PROVING)
+                with span("job_proof", job_id=job.id):
+                    job.proof = await loop.run_in_executor(self._pool, functools.partial(
+                        prove_sync, query_dir, prepared["model_onnx_path"], prepared["input_json_path"],
+                        **prepared.get("proof_options", {})))
+                if not job.proof["verified"]:
+                    raise RuntimeError(f"The proof of job {job.id} was not verified")
+
+                self._stage(job, FINISHING)
+                job.result = await asyncio.to_thread(self.finish, prepared)
+            self._stage(job, DONE)
+        except Exception as e:
+            job.error = f"{type(e).__name__}: {e}"
+            self._stage(job, FAILED)
+            raise
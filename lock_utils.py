@@ -0,0 +1,16 @@
+import fcntl
+from contextlib import contextmanager
+
+# File locks shared by the threads and processes of the application (e.g. the proving workers of job_scheduler.py).
+# Kept apart from ezkl_workflow/artifact_cache.py so the modules that only need a lock (cube snapshots, category
+# mappings) do not import ezkl.
+
+@contextmanager
+def file_lock(lock_path):
+    """Exclusive lock shared by the threads and processes that use the same lock file."""
+    with open(lock_path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
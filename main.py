@@ -1,39 +1,43 @@
 import os
 import json
 import pandas as pd
-import torch
-import onnx
-from ezkl import ezkl
-import time
-import sys
-from models.olap_cube import OLAPCube
-from operations.filter_model import FilteringModel
-from operations.dicing_model import DicingModel
-from operations.roll_up_model import RollUpModel
-from operations.slice_model import SliceModel
+import shutil
+import threading
 import asyncio
-from ezkl_workflow.generate_proof import generate_proof
-from hash_utils import verify_dataset_hash, verify_query_allowed, publish_hash
-from data_generators.CSV_Generator1 import generate_CSV_1
-from data_generators.CSV_Generator2 import generate_CSV_2
+from models.olap_cube import OLAPCube, VALIDITY_COLUMN
+from models.cube_store import load_snapshot, save_snapshot, CubeCache
+from models.cuboid_lattice import materialize_lattice, load_lattice, published_lattice, load_cuboid
+from models.dataset_schema import DatasetSchema, DEFAULT_HIERARCHY_PATH, load_hierarchy
+from trace_utils import span, dump_metrics, tensor_shape, file_size
+from lock_utils import file_lock
+from hash_utils import (verify_dataset, verify_query_allowed, publish_hash, publish_appended_rows, publish_hash_batch,
+                        remove_inclusion_proof, published_cuboid_commitments, publish_commitment, get_commitment,
+                        calculate_file_hash, merkle_tree_path)
+
+# torch, onnx and ezkl (query planning, export and proofs) and the data generators are imported by the functions
+# that use them: publishing a dataset (cli.py publish) loads none of them
 
 output_dir = './output'
 os.makedirs(output_dir, exist_ok=True)
 
-def load_contract_address(contract_name):
-    """Load the contract address from the configuration file."""
-    config_path = os.path.join(os.path.dirname(__file__), 'config', 'contract_addresses.json')
-    with open(config_path, 'r') as f:
-        contract_addresses = json.load(f)
-    return contract_addresses.get(contract_name)
+# Rows of the query tensor are padded to this bucket ("pow2" or a fixed step, e.g. 512),
+# so datasets with a similar number of rows share the same compiled circuit and keys
+ROW_BUCKET = "pow2"
 
-# Load the DataFactModel contract address dynamically
-data_fact_model_address = load_contract_address("DataFactModel")
-if not data_fact_model_address:
-    print("DataFactModel address not found in configuration.")
-    sys.exit(1)
+# Number of rows of each shard when proving large tensors in parallel (None = a single proof of the whole tensor)
+PROOF_SHARD_ROWS = None
+
+# Write the expected output in input.json too (not needed: gen_witness computes the output of the model)
+WRITE_OUTPUT_DATA = False
+
+# Hashed input mode: ORG 1 publishes the commitment of the encoded dataset and the proofs expose the hash of their
+# input, so a result is checked against the chain without the dataset (see ezkl_workflow/dataset_commitment.py).
+# The circuit then reads the whole dataset tensor: no column pruning, no cuboids, no sharding
+HASHED_INPUT = False
 
 def op_generate_file():
+    from data_generators.CSV_Generator1 import generate_CSV_1
+    from data_generators.CSV_Generator2 import generate_CSV_2
     print("\nSelect a generator to use:")
     print("[1] Generator 1")
     print("[2] Generator 2")
@@ -63,10 +67,109 @@ def CLI_publish_hash():
     if file_index < 0 or file_index >= len(files):
         print("Invalid index selected.")
         return
-    file_path = os.path.join(uploaded_files_dir, files[file_index])
+    # Merkle mode: the root of the row chunks is published, so rows appended later are published cheaply
+    merkle = input("Publish the Merkle root of the row chunks? (y/N): ").strip().lower() == "y"
+    op_publish_dataset(files[file_index], merkle=merkle) # MAIN.py
 
-    hash = op_publish_hash(file_path) # MAIN.py
+# Make the user select a file published in Merkle mode whose rows were appended: its new root is published
+def CLI_publish_appended_rows():
+    uploaded_files_dir = os.path.join('data', 'uploaded')
+    files = [file for file in os.listdir(uploaded_files_dir) if os.path.exists(merkle_tree_path(file))]
+    if not files:
+        print("No files published in Merkle mode.")
+        return
+    print("Files published in Merkle mode:")
+    for idx, file in enumerate(files):
+        print(f"[{idx + 1}] {file}")
+    file_index = int(input("Select the file with appended rows by index: ")) - 1
+    if file_index < 0 or file_index >= len(files):
+        print("Invalid index selected.")
+        return
+    op_publish_appended_rows(files[file_index]) # MAIN.py
 
+# Make the user select several files with CLI: their hashes are published together as one Merkle root
+def CLI_publish_hashes():
+    uploaded_files_dir = os.path.join('data', 'uploaded')
+    files = os.listdir(uploaded_files_dir)
+    if not files:
+        print("No files available in the uploaded directory.")
+        return
+    print("Available files:")
+    for idx, file in enumerate(files):
+        print(f"[{idx + 1}] {file}")
+    selection = input("Select the files to publish by index (comma separated, e.g. 1,3): ")
+    try:
+        file_indices = list(dict.fromkeys(int(idx) - 1 for idx in selection.split(",") if idx.strip()))
+    except ValueError:
+        print("Invalid index selected.")
+        return
+    if not file_indices or any(idx < 0 or idx >= len(files) for idx in file_indices):
+        print("Invalid index selected.")
+        return
+    op_publish_datasets([files[idx] for idx in file_indices]) # MAIN.py
+
+# This function publishes the hash of an uploaded file, saves its encoded snapshot and cuboids and
+# records the hash in "published_hash.json" to share it with the customer. Returns the hash
+# (the commitments of the cuboids are not published: the queries of the dataset run on the fact table)
+# merkle: publish the root of the Merkle tree of the row chunks instead of the SHA-256 of the file
+def op_publish_dataset(file_name, merkle=False):
+    file_path = os.path.join('data', 'uploaded', file_name)
+    hash = op_publish_hash(file_path, merkle) # MAIN.py
+    op_store_dataset(file_path, hash) # MAIN.py
+    # A receipt of an earlier batch would be checked instead of the hash just published
+    remove_inclusion_proof(file_name) # HASH_UTILS.py
+    save_published_hash(file_name, hash) # MAIN.py
+    print(f"Hash for {file_name} published successfully.")
+    return hash
+
+# This function publishes the new Merkle root of a file published in Merkle mode after rows were appended to it
+# (only the last chunk and the new ones are hashed), and stores the dataset under its new hash. Returns the root
+def op_publish_appended_rows(file_name):
+    file_path = os.path.join('data', 'uploaded', file_name)
+    hash = publish_appended_rows(file_path) # HASH_UTILS.py
+    op_store_dataset(file_path, hash) # MAIN.py
+    remove_inclusion_proof(file_name) # HASH_UTILS.py
+    save_published_hash(file_name, hash) # MAIN.py
+    print(f"New root for {file_name} published successfully.")
+    return hash
+
+# This function publishes the hashes of many uploaded files in one transaction: the Merkle root of the
+# dataset hashes and of the commitments of their cuboids (HASH_UTILS.py). Every file gets its inclusion proofs
+# in data/batches/proofs, to share with the customer next to "published_hash.json". Returns {file: hash}
+def op_publish_datasets(file_names):
+    entries = []
+    hashes = {}
+    for file_name in file_names:
+        file_path = os.path.join('data', 'uploaded', file_name)
+        hash = calculate_file_hash(file_path) # HASH_UTILS.py
+        lattice = op_store_dataset(file_path, hash) # MAIN.py
+        entries.append(dict(file=file_name, hash=hash))
+        for cuboid in (lattice["cuboids"] if lattice is not None else []):
+            entries.append(dict(dataset=hash, cuboid=cuboid["name"], commitment=cuboid["commitment"]))
+        hashes[file_name] = hash
+
+    root = publish_hash_batch(entries) # HASH_UTILS.py
+    for file_name, hash in hashes.items():
+        save_published_hash(file_name, hash) # MAIN.py
+    print(f"Hashes of {len(hashes)} files published successfully (root {root}).")
+    return hashes
+
+# Encode the dataset once (the queries on it will load the snapshot instead of the CSV), publish its commitment
+# in the hashed input mode and precompute its cuboids. Returns the lattice of the cuboids (None if there are none)
+def op_store_dataset(file_path, hash):
+    cube = load_cube_from_csv(file_path)
+    save_snapshot(cube, hash) # CUBE_STORE.py
+
+    if HASHED_INPUT:
+        op_publish_commitment(cube, hash) # MAIN.py
+
+    # Precompute the aggregated cuboids of the dataset, if it follows the DFM dimension hierarchy
+    hierarchy_data = load_dimension_hierarchy()
+    if set(hierarchy_data["dim_index"]) == set(cube.df.columns):
+        return materialize_lattice(cube, hash, hierarchy_data) # CUBOID_LATTICE.py
+    return None
+
+def save_published_hash(file_name, hash):
     # Save the hash in "published_hash.json" to share it with the customer
     published_hash_path = os.path.join('data', 'published_hash.json')
     os.makedirs(os.path.dirname(published_hash_path), exist_ok=True)  # Ensure the directory exists
@@ -80,15 +183,22 @@ def CLI_publish_hash():
     with open(published_hash_path, 'r') as f:
         published_hashes = json.load(f)
     # Add or update the hash for the selected file
-    published_hashes[files[file_index]] = hash
+    published_hashes[file_name] = hash
     # Write the updated hashes back to the file
     with open(published_hash_path, 'w') as f:
         json.dump(published_hashes, f, indent=4)
 
-    print(f"Hash for {files[file_index]} published successfully.")
+def op_publish_hash(file_path, merkle=False):
+    return publish_hash(file_path, merkle) # HASH_UTILS.py
 
-def op_publish_hash(file_path):
-    return publish_hash(file_path) # HASH_UTILS.py
+# This function publishes the commitment of the encoded dataset: the hash of the tensor the query circuits receive
+def op_publish_commitment(cube, dataset_hash):
+    from ezkl_workflow.dataset_commitment import commitment_scale, input_commitment
+    tensor_data = cube.to_tensor(bucket=ROW_BUCKET)
+    scale = commitment_scale(tensor_data) # DATASET_COMMITMENT.py
+    commitment = input_commitment(tensor_data, scale) # DATASET_COMMITMENT.py
+    publish_commitment(dataset_hash, commitment, scale, tensor_data.shape[0]) # HASH_UTILS.py
+    return commitment
 
 # ??
 def op_verify_dataset_hash():
@@ -119,7 +229,7 @@ def op_verify_dataset_hash():
 
         file_path = os.path.join('data', 'uploaded', selected_file)
 
-        verify_dataset_hash(file_path)
+        verify_dataset(file_path) # batch inclusion proof if there is one, the hash published for the file otherwise
         print(f"Hash for {selected_file} verified successfully ({selected_hash}).")
     except Exception as e:
         print(f"Failed to verify hash: {e}")
@@ -134,152 +244,231 @@ def apply_olap_operations(cube, tensor_data, operations):
         result_tensor = cube.execute_model(operation, result_tensor)
     return result_tensor
 
-# This function gives the indices of the columns to be sliced based on the hierarchies name
-def get_dimension_indices_slice(hierarchies_to_slice):
-    with open("DFM/dim_hierarchy_GHGe1.json", "r") as f:
-        hierarchy_data = json.load(f)
-    
-    dimension_hierarchy = hierarchy_data["dim_hierarchy"]
-    dimension_index = hierarchy_data["dim_index"]
-
-    columns_to_remove = []
-    for dim in hierarchies_to_slice:
-        columns_to_remove.extend(dimension_hierarchy[dim])
-
-    indices_to_remove = [dimension_index[col] for col in columns_to_remove]
-    print(f"Indices to remove: {indices_to_remove}")
-    return indices_to_remove
-
-# This function gives the indices of the dimensions to be rolled up based on the hierarchies name
-# Example: if hierarchies_to_roll_up = [["Date", "Year"], ["Clothes Type", "Category"]], it will return the indices of "Month", "Day" and "Product Name"
-def get_dimension_indices_roll_up(hierarchies_to_roll_up):
-    with open("DFM/dim_hierarchy_GHGe1.json", "r") as f:
-        hierarchy_data = json.load(f)
-    
-    dimension_hierarchy = hierarchy_data["dim_hierarchy"]
-    dimension_index = hierarchy_data["dim_index"]
-
-    dim_to_remove = []
-
-    for dim in hierarchies_to_roll_up:
-        hierarchy_name = dim[0] # "Date" or "Clothes Type"
-        dim_of_hierarchy = dimension_hierarchy[hierarchy_name] # ["Year", "Month", "Day"] or ["Category", "Product Name"]
-        # Get the index of dim[1] (dimension we want to do the rollup) in the hierarchy list
-        if dim[1] in dim_of_hierarchy:
-            idx = dim_of_hierarchy.index(dim[1])
-        else:
-            print(f"Dimension {dim[1]} not found in hierarchy {hierarchy_name}.")
-        for i in range(idx + 1, len(dim_of_hierarchy)):
-            dim_to_remove.append(dim_of_hierarchy[i]) 
-
-    print(f"Dimensions to remove for roll-up: {dim_to_remove}")
-
-    # Convert the dimension names to their corresponding indices
-    indices_to_remove = [dimension_index[dim] for dim in dim_to_remove]       
-
-    print(f"Indices to remove for roll-up: {indices_to_remove}")
-    return indices_to_remove
-
-
-async def op_perform_query(file_path, selected_file):
+# This function loads the DFM dimension hierarchy (hierarchies of levels and column index of every level),
+# read once per process (MODELS/DATASET_SCHEMA.py)
+def load_dimension_hierarchy():
+    return load_hierarchy(DEFAULT_HIERARCHY_PATH)
+
+# The query of the menus, with the names of the DFM and the category labels (MODELS/QUERY_SPEC.py):
+# Material = "Canvas", Clothes Type sliced away, Date rolled up to Year -> one row per (Material, Year)
+DEFAULT_QUERY_SPEC = {
+    "filter": {"Material": "Canvas"},
+    "slice": ["Clothes Type"],
+    "roll_up": {"Date": "Year"},
+}
+
+# Schemas, compiled plans and exported models of the published datasets, keyed by the dataset hash
+# (plans and models also by the hash of the query spec). The in-memory caches are LRUs like CUBE_CACHE
+SCHEMA_CACHE = CubeCache(max_entries=32)
+PLAN_CACHE = CubeCache(max_entries=128)
+MODEL_CACHE_DIR = os.path.join(output_dir, 'cache', 'models')
+
+def query_key(dataset_hash, spec):
+    """Key of a query: the dataset, the spec and the settings that change its plan and model."""
+    from models.query_spec import spec_hash
+    return spec_hash(dict(dataset=dataset_hash, spec=spec, bucket=ROW_BUCKET, hashed_input=HASHED_INPUT))
+
+def get_schema(cube, selected_file, dataset_hash=None):
+    if dataset_hash is None:
+        return DatasetSchema.from_cube(cube, selected_file)
+    return SCHEMA_CACHE.get_or_load(dataset_hash, lambda: DatasetSchema.from_cube(cube, selected_file))
+
+# This function compiles a query spec against the schema of the dataset and gives its cheapest plan
+def op_plan_query(spec, cube, selected_file, dataset_hash=None):
+    from models.query_planner import plan_query
+    from models.query_spec import compile_spec
+    query = compile_spec(spec, get_schema(cube, selected_file, dataset_hash)) # QUERY_SPEC.py
+    lattice = None
+    if dataset_hash and not HASHED_INPUT:
+        # only the cuboids whose commitment was published (and matches the stored snapshot) can be proven on
+        lattice = published_lattice(load_lattice(dataset_hash), published_cuboid_commitments(selected_file, dataset_hash),
+                                    dataset_hash) # CUBOID_LATTICE.py, HASH_UTILS.py
+    return plan_query(query, cube, lattice, bucket=ROW_BUCKET, all_columns=HASHED_INPUT) # QUERY_PLANNER.py
+
+
+# Dictionaries (categorical value -> code) of every dataset, append-only: the codes of a dataset stay the same
+# across its versions, so cached circuits and the filter constants of the queries remain valid
+DICTIONARY_DIR = os.path.join('data', 'dictionaries')
+
+def dictionary_path(file_path):
+    return os.path.join(DICTIONARY_DIR, os.path.basename(file_path) + '.json')
+
+# This function builds the encoded OLAP cube of a dataset from its CSV file
+def load_cube_from_csv(file_path):
     df = pd.read_csv(file_path)
     df.columns = df.columns.str.strip() # Remove leading and trailing whitespace from column names
     df = df.dropna() # Drop rows with NaN values
 
+    mappings_path = dictionary_path(file_path)
+    os.makedirs(DICTIONARY_DIR, exist_ok=True)
+    # load, extend and save under the lock of the dictionary: concurrent loads of the same file
+    # would otherwise give the same code to different values or lose the values added by the other one
+    with file_lock(mappings_path + '.lock'):
+        category_mappings = OLAPCube.load_category_mappings(mappings_path) if os.path.exists(mappings_path) else None
+        cube = OLAPCube(df, category_mappings=category_mappings)
+        cube.save_category_mappings(mappings_path) # save the mappings (categorical values - indexes) of the dataset
+    return cube
+
+# This function gives the cube of a published dataset: the memory-mapped snapshot stored under its hash
+# if it exists, otherwise the cube is built from the CSV and the snapshot is saved for the next queries
+# The loaded cubes stay in memory: a long-running process (query_service.py) loads every snapshot only once
+CUBE_CACHE = CubeCache()
+
+def load_cube(file_path, dataset_hash=None):
+    if dataset_hash is not None:
+        cube = CUBE_CACHE.get_or_load(dataset_hash, lambda: load_snapshot(dataset_hash)) # CUBE_STORE.py
+        if cube is not None:
+            print(f"Loaded encoded snapshot of {dataset_hash[:12]}")
+            return cube
+    cube = load_cube_from_csv(file_path)
+    if dataset_hash is not None:
+        save_snapshot(cube, dataset_hash)
+    return cube
+
+# Every stage of the query runs in a span (see trace_utils.py): the spans are appended to output/traces/spans.jsonl
+# and the per-stage metrics are dumped to output/traces/metrics.prom after every query
+async def op_perform_query(file_path, selected_file, dataset_hash=None, spec=None):
+    from ezkl_workflow.generate_proof import generate_proof
+    from ezkl_workflow.sharded_proof import generate_sharded_proof
+    if HASHED_INPUT and PROOF_SHARD_ROWS:
+        raise ValueError("The hashed input mode proves the whole dataset tensor: it cannot be sharded")
+    try:
+        with span("query", file=selected_file, dataset_hash=dataset_hash):
+            prepared = prepare_query(file_path, selected_file, dataset_hash, export=not PROOF_SHARD_ROWS, spec=spec)
+            if PROOF_SHARD_ROWS:
+                # Shards proven in parallel with one shared key pair, the shard outputs are merged into the final result
+                with span("sharded_proof", shard_rows=PROOF_SHARD_ROWS):
+                    prepared["final_tensor"], manifest_path = await generate_sharded_proof(
+                        prepared["query_dir"], prepared["pipeline"], prepared["tensor_data"], PROOF_SHARD_ROWS)
+                print(f"Shard proofs manifest saved to {manifest_path}")
+            else:
+                # logrows and scales are chosen from the model and the input shape (see ezkl_workflow/circuit_sizing.py)
+                await generate_proof(prepared["query_dir"], prepared["model_onnx_path"], prepared["input_json_path"],
+                                     **prepared["proof_options"])
+            finish_query(prepared)
+    finally:
+        dump_metrics()
+
+# The query runs in three stages, so that the scheduler (see job_scheduler.py) can run many queries at once:
+# - prepare_query: load the cube, plan, run the pipeline, export the ONNX model and write the input (cheap)
+# - proof: generate_proof on the exported model (CPU and memory heavy, done in a process pool by the scheduler)
+# - finish_query: decode the result and save it as CSV
+# query_dir: directory of the model, input and proof files of the query
+# spec: declarative query (see models/query_spec.py), DEFAULT_QUERY_SPEC if None
+def prepare_query(file_path, selected_file, dataset_hash=None, query_dir=output_dir, export=True, spec=None):
+    import onnx
+    from ezkl_workflow.witness_input import write_input
+    from ezkl_workflow.dataset_commitment import HASHED
+    os.makedirs(query_dir, exist_ok=True)
+    spec = spec if spec is not None else DEFAULT_QUERY_SPEC
+
     # Initialize the OLAP cube and transform the data into a tensor
-    cube = OLAPCube(df)
-    cube.save_category_mappings("cat_map.json") # save the mappings (categorical values - indexes) to a JSON file
-    tensor_data = cube.to_tensor()
+    with span("load_cube") as s:
+        cube = load_cube(file_path, dataset_hash)
+        s.set(rows=len(cube.df), columns=len(cube.df.columns), snapshot=cube.columnar is not None)
 
-    print(f"DataFrame after dropping NaN values: \n {df}") # categorical columns are already encoded as integers
+    print(f"DataFrame after dropping NaN values: \n {cube.df}") # categorical columns are already encoded as integers
     print(f"OLAP cube: {cube}")
-    
-    """
-    # Define the list of OLAP operations to apply
-    operations = [
-        # SlicingModel and DicingModel are subclasses of OLAPOperation
-        # {14: 1, 21: 12, 27: 0} is a dictionary where the keys are column indices and the values are the values to filter by
-        SlicingModel({14: 1, 21: 12, 27: 0}),  # Slicing operation: select rows where column 14 is ==1, ...
-        DicingModel({2: 2, 21: [3, 4], 27: 4})  # Dicing operation
-    ]
-    """
-    columns_to_slice = get_dimension_indices_slice(["Clothes Type"]) # using dimensions hierarchy from "DFM/dimensions_hierarchy_GHGe1.json"
-    columns_to_roll_up = get_dimension_indices_roll_up([["Date", "Year"]]) # using dimensions hierarchy from "DFM/dimensions_hierarchy_GHGe1.json"
-
-    columns_to_remove = list(dict.fromkeys(columns_to_slice + columns_to_roll_up)) # columns to remove from the tensor (no duplicates)
 
-    operations = [
-        FilteringModel({2:0}), # Material = "Canvas"
-        #SliceModel(columns_to_slice)
-        SliceModel(columns_to_remove)
-    ]
+    # The planner picks the source (fact table or a materialized cuboid with the levels the query needs),
+    # the order of the operations and the columns that enter the circuit, with the lowest estimated cost.
+    # The plans of a published dataset are memoized by the hash of the spec: a recurring query is compiled once
+    key = query_key(dataset_hash, spec)
+    with span("plan", spec_hash=key[:12]) as s:
+        plan = PLAN_CACHE.get_or_load(key, lambda: op_plan_query(spec, cube, selected_file, dataset_hash)) \
+            if dataset_hash is not None else op_plan_query(spec, cube, selected_file)
+        s.set(source=plan.source["name"] if plan.source is not None else "fact", estimated_cost=plan.cost, rows=plan.rows)
+    if plan.source is not None:
+        with span("load_cuboid", cuboid=plan.source["name"]):
+            cube = CUBE_CACHE.get_or_load((dataset_hash, plan.source["name"]), lambda: load_cuboid(dataset_hash, plan.source))
+
+    with span("to_tensor") as s:
+        tensor_data, pipeline = plan.build(cube, bucket=ROW_BUCKET)
+        s.set(input_shape=tensor_shape(tensor_data))
+    print(f"Query pipeline:\n{pipeline.describe()}")
 
     # Apply the operations to the tensor data 
-    final_tensor = apply_olap_operations(cube, tensor_data, operations)
+    with span("execute") as s:
+        final_tensor = cube.execute_model(pipeline, tensor_data)
+        s.set(output_shape=tensor_shape(final_tensor))
 
     print(f"Inital tensor:\n{tensor_data}")
     print(f"Final tensor:\n{final_tensor}")
 
-    # Export the model in ONNX format
-    # Selects the last operation in your OLAP pipeline. This is the model you want to export
-    final_operation = operations[-1]  
-    # ONNX export requires the model and the input tensor to be on the same device (usually CPU for interoperability), we move the model to CPU
-    final_operation.to(torch.device("cpu"))
-    # Sets the model to evaluation mode
-    final_operation.eval()
-
-    model_onnx_path = os.path.join(output_dir, 'model.onnx')
-    torch.onnx.export(final_operation,               # model being run
-                      tensor_data,                   # model input (or a tuple for multiple inputs)
-                      model_onnx_path,               # where to save the model (can be a file or file-like object)
-                      export_params=True,            # store the trained parameter weights inside the model file
-                      opset_version=11,              # the ONNX version to export the model to
-                      do_constant_folding=True,      # whether to execute constant folding for optimization
-                      input_names=['input'],         # the model's input names
-                      output_names=['output'])       # the model's output names
-
-    onnx_model = onnx.load(model_onnx_path)
-    onnx.checker.check_model(onnx_model)
-    # print(onnx.helper.printable_graph(onnx_model.graph))
-
-    # Take PyTorch tensor - detach it from any computation graph - convert it to a NumPy array - flatten it to 1D 
-    d = ((tensor_data).detach().numpy()).reshape([-1])
-    # Create a dictionary "data"
-    data = dict(
-        input_shapes=[tensor_data.shape], # shape = how many elements along each axis
-        input_data=[d.tolist()],
-        output_data=[final_tensor.detach().numpy().reshape([-1]).tolist()]
+    prepared = dict(
+        selected_file=selected_file,
+        query_dir=query_dir,
+        cube=cube,
+        plan=plan,
+        pipeline=pipeline,
+        tensor_data=tensor_data,
+        final_tensor=final_tensor,
     )
-    input_json_path = os.path.join(output_dir, 'input.json')
-    with open(input_json_path, 'w') as f:
-        json.dump(data, f) # serialize the data dictionary to a JSON file
-
-    #await generate_proof(output_dir, model_onnx_path, input_json_path, logrows=17)
-    await generate_proof(output_dir, model_onnx_path, input_json_path, logrows=15)
+    if export:
+        # Export the whole query in ONNX format. The model of a spec on a published dataset is exported once
+        # and kept in output/cache/models: the next runs of the query use it as it is
+        cached_model_path = os.path.join(MODEL_CACHE_DIR, key + '.onnx') if dataset_hash is not None else None
+        if cached_model_path is not None and os.path.exists(cached_model_path):
+            model_onnx_path = cached_model_path
+            print(f"Using cached model {key[:12]} (skipping ONNX export)")
+        else:
+            model_onnx_path = os.path.join(query_dir, 'model.onnx')
+            with span("onnx_export") as s:
+                pipeline.export(tensor_data, model_onnx_path)
+
+                onnx_model = onnx.load(model_onnx_path)
+                onnx.checker.check_model(onnx_model)
+                s.set(onnx_nodes=len(onnx_model.graph.node), model_bytes=file_size(model_onnx_path))
+            # print(onnx.helper.printable_graph(onnx_model.graph))
+            if cached_model_path is not None:
+                os.makedirs(MODEL_CACHE_DIR, exist_ok=True)
+                tmp_path = f"{cached_model_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                shutil.copyfile(model_onnx_path, tmp_path)
+                os.replace(tmp_path, cached_model_path) # the cached model appears only once it is complete
+
+        # Input of the circuit: the flattened tensor streamed to input.json (see ezkl_workflow/witness_input.py).
+        # The shape and the largest value are kept, so the proof does not parse the file again to size the circuit
+        input_json_path = os.path.join(query_dir, 'input.json')
+        with span("write_input") as s:
+            input_stats = write_input(input_json_path, tensor_data, final_tensor, include_output=WRITE_OUTPUT_DATA)
+            s.set(input_json_bytes=file_size(input_json_path))
+        # Options of generate_proof: with hashed input, the circuit quantizes the input as the published commitment
+        proof_options = dict(input_stats=input_stats)
+        if HASHED_INPUT:
+            # the scale published with the commitment: the circuit hashes the input quantized exactly as it was
+            published = get_commitment(dataset_hash) if dataset_hash is not None else None # HASH_UTILS.py
+            if published is None:
+                raise ValueError("The hashed input mode needs a dataset with a published commitment")
+            proof_options.update(input_visibility=HASHED, input_scale=published["scale"])
+        prepared.update(model_onnx_path=model_onnx_path, input_json_path=input_json_path, proof_options=proof_options)
+    return prepared
+
+# Returns the path of the CSV file of the query result
+def finish_query(prepared):
+    from operations.compact_model import MATCH_COUNT_COLUMN
+    cube, plan, pipeline = prepared["cube"], prepared["plan"], prepared["pipeline"]
+    final_tensor = prepared["final_tensor"]
+    selected_file = prepared["selected_file"]
 
     # Print and save the final tensor after applying the OLAP operations in human-readable format
-    # Remove rows from final_tensor that are all zeros
-    non_zero_rows = ~torch.all(final_tensor == 0, dim=1)
-    final_tensor = final_tensor[non_zero_rows] # after filtering
-
-
-    # Save the final tensor as a CSV file after the query
-    final_df = pd.DataFrame(final_tensor.detach().numpy())
-
-    # Assign the original column names (from your input DataFrame) to the filtered DataFrame
-    # filtered_columns = cube.df.columns[:final_df.shape[1]]
-    
-    # Remove columns of the slice
-    all_indices = list(range(len(cube.df.columns)))
-    kept_indices = [i for i in all_indices if i not in columns_to_remove]
-    kept_columns = [cube.df.columns[i] for i in kept_indices]
-
-    # final_df.columns = [i for i in filtered_columns if i in kept_columns]
-    final_df.columns = kept_columns 
+    # The output has a fixed number of rows: keep only the valid ones (non-empty groups, no padding)
+    final_columns = pipeline.output_columns(plan.input_columns + [VALIDITY_COLUMN])
+    # The result tensor as proven (the public outputs of the circuit), shared with the proof: the customer checks
+    # that the proof outputs are this result (see verify_committed_proof)
+    with open(os.path.join(prepared["query_dir"], 'output.json'), 'w') as f:
+        json.dump(dict(columns=final_columns, shape=list(final_tensor.shape),
+                       data=final_tensor.detach().reshape(-1).tolist()), f)
+    final_df = pd.DataFrame(final_tensor.detach().numpy(), columns=final_columns)
+    final_df = final_df[final_df[VALIDITY_COLUMN] > 0].drop(columns=[VALIDITY_COLUMN]).reset_index(drop=True)
+    if MATCH_COUNT_COLUMN in final_df.columns:
+        # Compacted output (query with a limit): the first rows are the result, the count tells if it was truncated
+        matches = int(final_df[MATCH_COUNT_COLUMN].iloc[0]) if len(final_df) else 0
+        if matches > plan.query.limit:
+            print(f"Warning: {matches} rows match the query, only the first {plan.query.limit} are in the result")
+        final_df = final_df.drop(columns=[MATCH_COUNT_COLUMN])
     print(f"Final DataFrame:\n{final_df}")
     
-    cat_map = OLAPCube.load_category_mappings("cat_map.json")
-        #print("Category mappings loaded")
+    cat_map = cube.category_mappings
     filtered_cat_map = {col: mapping for col, mapping in cat_map.items() if col in final_df.columns}
     final_cube = OLAPCube(final_df, category_mappings=filtered_cat_map)
         #print("Final cube created")
@@ -287,10 +476,14 @@ async def op_perform_query(file_path, selected_file):
     print(f"Final Decoded Cube:\n{final_decoded_cube}")
 
     mod_selected_file = "mod_" + selected_file # mod = modified
-    csv_output_path = os.path.join('data', 'modified', mod_selected_file)
+    # The jobs of the scheduler write their result in their own directory: two jobs on the same file
+    # (or different specs on it) would otherwise overwrite each other's result
+    result_dir = os.path.join('data', 'modified') if prepared["query_dir"] == output_dir else prepared["query_dir"]
+    csv_output_path = os.path.join(result_dir, mod_selected_file)
     os.makedirs(os.path.dirname(csv_output_path), exist_ok=True)
     final_df.to_csv(csv_output_path, index=False)
     print(f"Query result saved to {csv_output_path}")
+    return csv_output_path
 
 # This function makes the user select a file to query with CLI
 async def CLI_perform_query():
@@ -317,13 +510,125 @@ async def CLI_perform_query():
     selected_file = list(published_hashes.keys())[file_index]
     file_path = os.path.join('data', 'uploaded', selected_file)
 
-    await op_prepare_query(file_path, selected_file) # MAIN.py
+    await op_prepare_query(file_path, selected_file, published_hashes[selected_file]) # MAIN.py
+
+# This function makes the user select several files to query with CLI: the queries run at the same time
+# on the query scheduler (JOB_SCHEDULER.py) and their status is printed until they are all finished
+async def CLI_perform_queries():
+    from job_scheduler import QueryScheduler, DONE, FAILED
+    published_hash_path = os.path.join('data', 'published_hash.json')
+    if not os.path.exists(published_hash_path):
+        print("\nNo published hashes file found.")
+        return
+    with open(published_hash_path, 'r') as f:
+        published_hashes = json.load(f)
+    if not published_hashes:
+        print("\nNo hashes available in the published file.")
+        return
+
+    print("\nAvailable published hashes:")
+    for idx, (file_name, hash_value) in enumerate(published_hashes.items()):
+        print(f"[{idx + 1}] File: {file_name} - Hash: {hash_value}")
+    selection = input("Select the files to query by index (comma separated, e.g. 1,2,2): ")
+    try:
+        file_indices = [int(idx) - 1 for idx in selection.split(",") if idx.strip()]
+    except ValueError:
+        print("Invalid index selected.")
+        return
+    if not file_indices or any(idx < 0 or idx >= len(published_hashes) for idx in file_indices):
+        print("Invalid index selected.")
+        return
 
-async def op_prepare_query(file_path, selected_file): 
+    scheduler = QueryScheduler(prepare_query, finish_query)
+    print(f"Proving with up to {scheduler.max_prove_workers} worker processes")
+    try:
+        for idx in file_indices:
+            selected_file = list(published_hashes.keys())[idx]
+            file_path = os.path.join('data', 'uploaded', selected_file)
+            job_id = scheduler.submit(file_path, selected_file, published_hashes[selected_file])
+            print(f"Job {job_id} queued for {selected_file}")
+
+        last_status = {}
+        while any(job["status"] not in (DONE, FAILED) for job in scheduler.jobs()):
+            for job in scheduler.jobs():
+                if last_status.get(job["id"]) != job["status"]:
+                    print(f"Job {job['id']} ({job['file']}): {job['status']}")
+                    last_status[job["id"]] = job["status"]
+            await asyncio.sleep(1)
+
+        for job in await scheduler.wait_all():
+            if job["status"] == DONE:
+                print(f"Job {job['id']} ({job['file']}): done, result saved to {job['result']}")
+            else:
+                print(f"Job {job['id']} ({job['file']}): failed, {job['error']}")
+    finally:
+        scheduler.shutdown()
+
+# This function verifies all the proofs received in a directory (default: the query jobs) in one batch
+async def CLI_verify_proofs():
+    from job_scheduler import JOBS_DIR
+    from ezkl_workflow.batch_verify import verify_batch, find_proofs
+    proofs_dir = input(f"Directory of the proofs [{JOBS_DIR}]: ").strip() or JOBS_DIR
+    triples = find_proofs([proofs_dir])
+    if not triples:
+        print(f"No proofs found in {proofs_dir}.")
+        return
+    results = await verify_batch(triples) # BATCH_VERIFY.py
+    for result in results:
+        status = "verified" if result["verified"] else f"NOT verified{' (' + result['error'] + ')' if result['error'] else ''}"
+        print(f"{result['proof']}: {status}{' (cached verdict)' if result['cached'] else ''}")
+    print(f"{sum(r['verified'] for r in results)}/{len(results)} proofs verified")
+
+# This function checks a proof of a query against the commitment published for the dataset (hashed input mode):
+# the dataset is neither downloaded nor hashed again
+async def CLI_verify_committed_proof():
+    from ezkl_workflow.dataset_commitment import verify_committed_proof
+    published_hash_path = os.path.join('data', 'published_hash.json')
+    if not os.path.exists(published_hash_path):
+        print("\nNo published hashes file found.")
+        return
+    with open(published_hash_path, 'r') as f:
+        published_hashes = json.load(f)
+    if not published_hashes:
+        print("\nNo hashes available in the published file.")
+        return
+
+    print("\nAvailable published hashes:")
+    for idx, (file_name, hash_value) in enumerate(published_hashes.items()):
+        print(f"[{idx + 1}] File: {file_name} - Hash: {hash_value}")
+    file_index = int(input("Select the dataset of the proof by index: ")) - 1
+    if file_index < 0 or file_index >= len(published_hashes):
+        print("Invalid index selected.")
+        return
+    dataset_hash = list(published_hashes.values())[file_index]
+
+    published = get_commitment(dataset_hash) # HASH_UTILS.py
+    if published is None:
+        print(f"No commitment published for {dataset_hash}.")
+        return
+    proof_dir = input(f"Directory of the proof [{output_dir}]: ").strip() or output_dir
+    # The result received with the proof: the proof must output it, otherwise it proves some other computation
+    output_path = os.path.join(proof_dir, 'output.json')
+    if not os.path.exists(output_path):
+        print(f"No result found in {output_path}.")
+        return
+    with open(output_path, 'r') as f:
+        expected_output = json.load(f)["data"]
+    try:
+        verified = await verify_committed_proof(os.path.join(proof_dir, 'test.pf'), os.path.join(proof_dir, 'settings.json'),
+                                                os.path.join(proof_dir, 'test.vk'), published["commitment"],
+                                                expected_output=expected_output) # DATASET_COMMITMENT.py
+    except ValueError as e:
+        print(f"Proof rejected: {e}")
+        return
+    print("The proof is valid, was computed on the published dataset and outputs the result received."
+          if verified else "The proof is not valid.")
+
+async def op_prepare_query(file_path, selected_file, dataset_hash=None): 
     """
     query_dimensions = ["Category", "Production Cost", "City", "Product Name"]
 
-    is_query_allowed = verify_query_allowed(query_dimensions, data_fact_model_address) # HASH_UTILS.py
+    is_query_allowed = verify_query_allowed(query_dimensions) # HASH_UTILS.py (DataFactModel address from config/contract_addresses.json)
 
     if not is_query_allowed:
         print("Query contains disallowed dimensions.")
@@ -332,7 +637,7 @@ async def op_prepare_query(file_path, selected_file):
     """
     
     try:
-        await op_perform_query(file_path, selected_file) # MAIN.py
+        await op_perform_query(file_path, selected_file, dataset_hash) # MAIN.py
         print("Query executed successfully.")
     except Exception as e:
         print(f"Failed to perform query: {e}")
@@ -352,7 +657,9 @@ async def main():
             print("\nSelect an option:")
             print("[1] Upload File")
             print("[2] Publish Hash")
-            sub_choice = input("Enter your choice (1, 2, or 3): ")
+            print("[3] Publish Hashes in Batch")
+            print("[4] Publish Appended Rows")
+            sub_choice = input("Enter your choice (1, 2, 3 or 4): ")
 
             if sub_choice == "1":  # UPLOAD FILE
                 op_generate_file()
@@ -360,6 +667,18 @@ async def main():
             elif sub_choice == "2":  # PUBLISH HASH
                 CLI_publish_hash()
 
+            elif sub_choice == "3":  # PUBLISH HASHES IN BATCH
+                try:
+                    CLI_publish_hashes()
+                except Exception as e:
+                    print(f"Failed to publish hashes: {e}")
+
+            elif sub_choice == "4":  # PUBLISH APPENDED ROWS
+                try:
+                    CLI_publish_appended_rows()
+                except Exception as e:
+                    print(f"Failed to publish appended rows: {e}")
+
             else:
                 print("Invalid choice. Returning to main menu.")
 
@@ -367,7 +686,10 @@ async def main():
             print("You selected: Login as ORG 2")
             print("\nSelect an option:")
             print("[1] Perform Query")
-            sub_choice = input("Enter your choice (1 or 2): ")
+            print("[2] Perform Multiple Queries")
+            print("[3] Verify Received Proofs")
+            print("[4] Verify Proof Against Published Dataset")
+            sub_choice = input("Enter your choice (1, 2, 3 or 4): ")
 
             if sub_choice == "1":  # PERFORM QUERY
                 try:
@@ -375,6 +697,24 @@ async def main():
                 except Exception as e:
                     print(f"Failed to perform query: {e}")
 
+            elif sub_choice == "2":  # PERFORM MULTIPLE QUERIES
+                try:
+                    await CLI_perform_queries()
+                except Exception as e:
+                    print(f"Failed to perform queries: {e}")
+
+            elif sub_choice == "3":  # VERIFY RECEIVED PROOFS
+                try:
+                    await CLI_verify_proofs()
+                except Exception as e:
+                    print(f"Failed to verify proofs: {e}")
+
+            elif sub_choice == "4":  # VERIFY PROOF AGAINST PUBLISHED DATASET
+                try:
+                    await CLI_verify_committed_proof()
+                except Exception as e:
+                    print(f"Failed to verify proof: {e}")
+
             else:
                 print("Invalid choice. Returning to main menu.")
 
@@ -0,0 +1,85 @@
+import hashlib
+
+# Binary Merkle tree over SHA-256, stored as the list of its levels (levels[0] = leaves, levels[-1] = [root]).
+# Leaves and inner nodes use different prefixes, so a leaf can never be confused with an inner node.
+# When a level has an odd number of nodes the last one is promoted to the next level unchanged:
+# appending a leaf (or changing the last one) only touches the rightmost path, O(log n) hashes.
+
+LEAF_PREFIX = b"\x00"
+NODE_PREFIX = b"\x01"
+
+def leaf_hash(data):
+    return hashlib.sha256(LEAF_PREFIX + data).digest()
+
+def node_hash(left, right):
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+def _parent(level, index):
+    left = level[2 * index]
+    if 2 * index + 1 < len(level):
+        return node_hash(left, level[2 * index + 1])
+    return left # odd node: promoted
+
+def build_levels(leaves):
+    """All the levels of the tree built over the given leaf hashes."""
+    levels = [list(leaves)]
+    while len(levels[-1]) > 1:
+        level = levels[-1]
+        levels.append([_parent(level, i) for i in range((len(level) + 1) // 2)])
+    return levels
+
+def merkle_root(levels):
+    if not levels or not levels[0]:
+        return hashlib.sha256(b"").digest() # root of an empty tree
+    return levels[-1][0]
+
+def _update_rightmost(levels):
+    # Recompute the last node of every level above the leaves
+    h = 0
+    while len(levels[h]) > 1:
+        if h + 1 == len(levels):
+            levels.append([])
+        index = (len(levels[h]) - 1) // 2
+        parent = _parent(levels[h], index)
+        if index < len(levels[h + 1]):
+            levels[h + 1][index] = parent
+        else:
+            levels[h + 1].append(parent)
+        h += 1
+    del levels[h + 1:]
+    return levels
+
+def append_leaf(levels, leaf):
+    """Append a leaf hash to the tree, O(log n)."""
+    if not levels:
+        levels.append([])
+    levels[0].append(leaf)
+    return _update_rightmost(levels)
+
+def replace_last_leaf(levels, leaf):
+    """Replace the last leaf hash of the tree, O(log n)."""
+    levels[0][-1] = leaf
+    return _update_rightmost(levels)
+
+def inclusion_proof(levels, index):
+    """Sibling hashes from the leaf at index up to the root, as (sibling, sibling_is_left) pairs."""
+    proof = []
+    for level in levels[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append((level[sibling], sibling < index))
+        index //= 2
+    return proof
+
+def verify_inclusion(leaf, proof, root):
+    node = leaf
+    for sibling, sibling_is_left in proof:
+        node = node_hash(sibling, node) if sibling_is_left else node_hash(node, sibling)
+    return node == root
+
+# Hex (de)serialization of the levels, used by the JSON files that store the trees
+def levels_to_hex(levels):
+    return [[node.hex() for node in level] for level in levels]
+
+def levels_from_hex(levels):
+    return [[bytes.fromhex(node) for node in level] for level in levels]
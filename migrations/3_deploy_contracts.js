@@ -0,0 +1,16 @@
+const fs = require('fs');
+const path = require('path');
+const DatasetRegistry = artifacts.require("DatasetRegistry");
+
+module.exports = async function (deployer) {
+  await deployer.deploy(DatasetRegistry);
+  const datasetRegistry = await DatasetRegistry.deployed();
+
+  // Add the address to the ones saved by the previous migration
+  const filePath = path.join(__dirname, '../config/contract_addresses.json');
+  const addresses = fs.existsSync(filePath) ? JSON.parse(fs.readFileSync(filePath, 'utf8')) : {};
+  addresses.DatasetRegistry = datasetRegistry.address;
+  fs.writeFileSync(filePath, JSON.stringify(addresses, null, 2));
+
+  console.log("DatasetRegistry address saved to contract_addresses.json");
+};
@@ -0,0 +1,96 @@
+import os
+import json
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+from models.olap_cube import OLAPCube
+from lock_utils import file_lock
+
+# Encoded snapshots of the published datasets, keyed by the dataset hash:
+#
+# data/snapshots/<hash>/
+#   columns.npy   -> float32 matrix [columns, rows] of the encoded cube (one contiguous block per column)
+#   meta.json     -> column names, number of rows and category mappings
+#
+# A query loads the snapshot with a memory map instead of parsing and encoding the CSV again,
+# and OLAPCube.to_tensor() builds the tensor as a view of the mapped columns.
+# A long-running process (e.g. query_service.py) also keeps the loaded cubes in a CubeCache.
+
+SNAPSHOT_DIR = os.path.join('data', 'snapshots')
+
+def snapshot_dir(dataset_hash, snapshot_root=SNAPSHOT_DIR):
+    return os.path.join(snapshot_root, dataset_hash)
+
+def has_snapshot(dataset_hash, snapshot_root=SNAPSHOT_DIR):
+    return os.path.exists(os.path.join(snapshot_dir(dataset_hash, snapshot_root), 'meta.json'))
+
+def save_snapshot(cube, dataset_hash, snapshot_root=SNAPSHOT_DIR):
+    """Persist the encoded cube (categorical columns already encoded) under its dataset hash.
+    An existing snapshot is kept: the same hash has the same content, and it may be mapped by a running query."""
+    target_dir = snapshot_dir(dataset_hash, snapshot_root)
+    os.makedirs(snapshot_root, exist_ok=True)
+    # one writer per hash, across threads and processes (e.g. two queries loading the same cold dataset)
+    with file_lock(target_dir + '.lock'):
+        if has_snapshot(dataset_hash, snapshot_root):
+            return target_dir
+        tmp_dir = tempfile.mkdtemp(dir=snapshot_root, prefix=f".{dataset_hash}.")
+        try:
+            columnar = np.ascontiguousarray(cube.df.values.astype(np.float32).T)
+            np.save(os.path.join(tmp_dir, 'columns.npy'), columnar)
+            meta = dict(
+                columns=list(cube.df.columns),
+                num_rows=int(columnar.shape[1]),
+                category_mappings=cube.category_mappings
+            )
+            with open(os.path.join(tmp_dir, 'meta.json'), 'w') as f:
+                json.dump(meta, f)
+
+            # The snapshot appears only once it is complete (a leftover without meta.json is replaced)
+            shutil.rmtree(target_dir, ignore_errors=True)
+            os.replace(tmp_dir, target_dir)
+        except BaseException:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+    return target_dir
+
+def load_snapshot(dataset_hash, snapshot_root=SNAPSHOT_DIR):
+    """OLAPCube backed by the memory-mapped snapshot of the dataset, or None if there is no snapshot."""
+    if not has_snapshot(dataset_hash, snapshot_root):
+        return None
+    target_dir = snapshot_dir(dataset_hash, snapshot_root)
+    with open(os.path.join(target_dir, 'meta.json'), 'r') as f:
+        meta = json.load(f)
+    # copy-on-write map: pages are read lazily from disk and the file is never modified
+    columnar = np.load(os.path.join(target_dir, 'columns.npy'), mmap_mode='c')
+    df = pd.DataFrame(columnar.T, columns=meta['columns'], copy=False)
+    return OLAPCube.from_encoded(df, meta['category_mappings'], columnar=columnar)
+
+
+class CubeCache:
+    """In-memory LRU of the loaded cubes (keyed by dataset hash, or by (hash, cuboid name)), shared by threads."""
+    def __init__(self, max_entries=8):
+        self.max_entries = max_entries
+        self._cubes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_load(self, key, loader):
+        with self._lock:
+            if key in self._cubes:
+                self._cubes.move_to_end(key)
+                return self._cubes[key]
+        cube = loader() # outside the lock: loading a cube does not block the other keys
+        if cube is None:
+            return None
+        with self._lock:
+            self._cubes[key] = cube
+            self._cubes.move_to_end(key)
+            while len(self._cubes) > self.max_entries:
+                self._cubes.popitem(last=False)
+        return cube
+
+    def clear(self):
+        with self._lock:
+            self._cubes.clear()
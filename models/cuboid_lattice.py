@@ -0,0 +1,137 @@
+import os
+import re
+import json
+import hashlib
+import itertools
+import pandas as pd
+from models.olap_cube import OLAPCube
+from models.cube_store import SNAPSHOT_DIR, snapshot_dir, save_snapshot, load_snapshot
+
+# Materialized aggregates (cuboids) of a published dataset, built from its DFM dimension hierarchies.
+#
+# A cuboid keeps, for every hierarchy, a prefix of its levels (e.g. Clothes Type -> [Category],
+# Date -> [Year], Material -> []) and contains one row per combination of those levels, with the sum of
+# every measure and the number of fact rows ("Count"). A roll-up that only needs the levels of a cuboid
+# (group-by and filter columns) can run on the cuboid instead of the fact table.
+#
+# The cuboids are only used by the queries once their commitments are published in a batch with the dataset
+# hash (see hash_utils.publish_hash_batch): published_lattice keeps the ones whose snapshot matches them.
+#
+# data/snapshots/<hash>/
+#   lattice.json           -> cuboids with their levels, number of rows and hash commitment
+#   cuboids/<name>/        -> encoded snapshot of every cuboid (see models/cube_store.py)
+
+COUNT_COLUMN = "Count"
+
+def lattice_path(dataset_hash, snapshot_root=SNAPSHOT_DIR):
+    return os.path.join(snapshot_dir(dataset_hash, snapshot_root), 'lattice.json')
+
+def cuboids_root(dataset_hash, snapshot_root=SNAPSHOT_DIR):
+    return os.path.join(snapshot_dir(dataset_hash, snapshot_root), 'cuboids')
+
+def cuboid_name(levels):
+    if not levels:
+        return "ALL"
+    return "__".join(re.sub(r"[^0-9A-Za-z]+", "_", level).strip("_") for level in levels)
+
+# This function gives the names of the measures: the columns of dim_index that are not part of any hierarchy
+def measure_names(hierarchy_data):
+    dimensions = {dim for levels in hierarchy_data["dim_hierarchy"].values() for dim in levels}
+    return [col for col in hierarchy_data["dim_index"] if col not in dimensions]
+
+# Level sets of the lattice: every combination of one prefix per hierarchy, except the fact table itself.
+# A "materialize" list in the hierarchy file (e.g. [["Category", "Year"], ["Material", "Month"]]) restricts
+# the lattice to those cuboids (a level implies the levels above it in its hierarchy, Month -> Year, Month)
+def lattice_levels(hierarchy_data):
+    hierarchies = hierarchy_data["dim_hierarchy"]
+    if "materialize" in hierarchy_data:
+        level_sets = []
+        for requested in hierarchy_data["materialize"]:
+            levels = []
+            for levels_of_hierarchy in hierarchies.values():
+                depth = max((levels_of_hierarchy.index(level) + 1 for level in requested if level in levels_of_hierarchy), default=0)
+                levels.extend(levels_of_hierarchy[:depth])
+            level_sets.append(levels)
+        return level_sets
+    prefixes = [[levels[:depth] for depth in range(len(levels) + 1)] for levels in hierarchies.values()]
+    full = [level for levels in hierarchies.values() for level in levels]
+    level_sets = [[level for prefix in combination for level in prefix] for combination in itertools.product(*prefixes)]
+    return [levels for levels in level_sets if levels != full]
+
+def aggregate(df, levels, measures):
+    """Cuboid of the encoded fact table: one row per combination of the levels, sum of the measures and count."""
+    if levels:
+        grouped = df.groupby(levels, sort=True)
+        cuboid = grouped[measures].sum()
+        cuboid[COUNT_COLUMN] = grouped.size()
+        return cuboid.reset_index()
+    row = {measure: df[measure].sum() for measure in measures}
+    row[COUNT_COLUMN] = len(df)
+    return pd.DataFrame([row])
+
+def cuboid_commitment(cuboid_dir):
+    """SHA-256 of the encoded cuboid (data and metadata of its snapshot)."""
+    hasher = hashlib.sha256()
+    for file_name in ('meta.json', 'columns.npy'):
+        with open(os.path.join(cuboid_dir, file_name), 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                hasher.update(chunk)
+    return hasher.hexdigest()
+
+def materialize_lattice(cube, dataset_hash, hierarchy_data, max_ratio=0.5, snapshot_root=SNAPSHOT_DIR):
+    """Build and store the cuboids of a dataset. Cuboids with more than max_ratio * fact rows are not kept
+    (they would not make the queries much cheaper). Returns the lattice description."""
+    measures = measure_names(hierarchy_data)
+    num_rows = len(cube.df)
+    root = cuboids_root(dataset_hash, snapshot_root)
+    cuboids = []
+    for levels in lattice_levels(hierarchy_data):
+        cuboid_df = aggregate(cube.df, levels, measures)
+        if len(cuboid_df) > max_ratio * num_rows:
+            continue
+        name = cuboid_name(levels)
+        mappings = {col: mapping for col, mapping in cube.category_mappings.items() if col in levels}
+        cuboid_dir = save_snapshot(OLAPCube.from_encoded(cuboid_df, mappings), name, root)
+        cuboids.append(dict(
+            name=name,
+            levels=levels,
+            measures=measures,
+            rows=len(cuboid_df),
+            commitment=cuboid_commitment(cuboid_dir)
+        ))
+    lattice = dict(fact_rows=num_rows, cuboids=sorted(cuboids, key=lambda c: c["rows"]))
+    with open(lattice_path(dataset_hash, snapshot_root), 'w') as f:
+        json.dump(lattice, f, indent=4)
+    print(f"Materialized {len(cuboids)} cuboids for {dataset_hash[:12]}")
+    return lattice
+
+def load_lattice(dataset_hash, snapshot_root=SNAPSHOT_DIR):
+    path = lattice_path(dataset_hash, snapshot_root)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+def published_lattice(lattice, commitments, dataset_hash, snapshot_root=SNAPSHOT_DIR):
+    """Lattice restricted to the cuboids with a published commitment ({name: commitment}) that is the hash of
+    their stored snapshot: a query proven on any other cuboid would not be bound to the published dataset."""
+    if lattice is None:
+        return None
+    root = cuboids_root(dataset_hash, snapshot_root)
+    cuboids = [cuboid for cuboid in lattice["cuboids"]
+               if commitments.get(cuboid["name"]) == cuboid["commitment"]
+               and cuboid_commitment(snapshot_dir(cuboid["name"], root)) == cuboid["commitment"]]
+    return dict(lattice, cuboids=cuboids)
+
+def route(lattice, required_levels):
+    """Smallest cuboid that contains all the required levels (group-by and filter columns), or None."""
+    if lattice is None:
+        return None
+    for cuboid in lattice["cuboids"]: # sorted by number of rows
+        if set(required_levels) <= set(cuboid["levels"]):
+            return cuboid
+    return None
+
+def load_cuboid(dataset_hash, cuboid, snapshot_root=SNAPSHOT_DIR):
+    """OLAPCube of a cuboid (memory-mapped), with the Count column next to the summed measures."""
+    return load_snapshot(cuboid["name"], cuboids_root(dataset_hash, snapshot_root))
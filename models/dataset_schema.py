@@ -0,0 +1,80 @@
+import os
+import json
+import functools
+
+# Schema of a dataset: the names the queries use, resolved once per dataset.
+# - column name -> index in the encoded cube
+# - dimension -> its levels, from the top of the hierarchy down (e.g. Date -> [Year, Month, Day]), level -> dimension
+# - measures: the columns that are not a level of any dimension
+# - category labels -> codes of the encoded categorical columns
+#
+# The hierarchies come from the DFM file of the dataset (DFM/dim_hierarchy_<dataset>.json), otherwise from the
+# default one (GHGe1) when its columns are the ones of the dataset. A dataset without a matching DFM gets one
+# single-level dimension per categorical column.
+
+DFM_DIR = "DFM"
+DEFAULT_HIERARCHY_PATH = os.path.join(DFM_DIR, "dim_hierarchy_GHGe1.json")
+
+def hierarchy_path(file_name):
+    return os.path.join(DFM_DIR, f"dim_hierarchy_{os.path.splitext(os.path.basename(file_name))[0]}.json")
+
+@functools.lru_cache(maxsize=None)
+def load_hierarchy(path):
+    """DFM hierarchy file (dim_hierarchy, dim_index), read once per process. None if it does not exist."""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+class DatasetSchema:
+    def __init__(self, columns, hierarchies, category_mappings):
+        self.columns = list(columns)
+        self.index = {col: i for i, col in enumerate(self.columns)}
+        # only the levels present in the dataset, dimensions without levels are dropped
+        self.hierarchies = {}
+        for dimension, levels in hierarchies.items():
+            present = [level for level in levels if level in self.index]
+            if present:
+                self.hierarchies[dimension] = present
+        self.level_dimension = {level: dimension for dimension, levels in self.hierarchies.items() for level in levels}
+        self.measures = [col for col in self.columns if col not in self.level_dimension]
+        self.category_mappings = category_mappings
+
+    @classmethod
+    def from_cube(cls, cube, file_name=None):
+        columns = list(cube.df.columns)
+        for path in ([hierarchy_path(file_name)] if file_name else []) + [DEFAULT_HIERARCHY_PATH]:
+            hierarchy_data = load_hierarchy(path)
+            if hierarchy_data is not None and set(hierarchy_data["dim_index"]) == set(columns):
+                return cls(columns, hierarchy_data["dim_hierarchy"], cube.category_mappings)
+        return cls(columns, {col: [col] for col in columns if col in cube.category_mappings}, cube.category_mappings)
+
+    def column(self, name):
+        if name not in self.index:
+            raise KeyError(f"Unknown column: {name} (columns: {self.columns})")
+        return name
+
+    def levels(self, dimension):
+        if dimension not in self.hierarchies:
+            raise KeyError(f"Unknown dimension: {dimension} (dimensions: {list(self.hierarchies)})")
+        return self.hierarchies[dimension]
+
+    def levels_above(self, dimension, level):
+        """Levels of the dimension kept by a roll-up to level (level included)."""
+        levels = self.levels(dimension)
+        if level not in levels:
+            raise KeyError(f"Level {level} not found in dimension {dimension} (levels: {levels})")
+        return levels[:levels.index(level) + 1]
+
+    def is_categorical(self, column):
+        return column in self.category_mappings
+
+    def code(self, column, label):
+        """Code of a category label (values of the numeric columns are returned unchanged)."""
+        if not self.is_categorical(column):
+            return label
+        mapping = self.category_mappings[column]
+        if label not in mapping:
+            raise KeyError(f"Unknown value of {column}: {label}")
+        return mapping[label]
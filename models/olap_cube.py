@@ -1,64 +1,84 @@
-import torch
-from torch import nn
-from sklearn.preprocessing import LabelEncoder # to convert categorical string data into numeric labels
+import os
 import json
+import tempfile
+import numpy as np
+import pandas as pd
+
+# torch is imported by the methods that build tensors: publishing a dataset (encoding, snapshot, cuboids)
+# does not need it
+
+# Name of the validity column appended by to_tensor() when the rows are padded to a bucket size:
+# 1 for the rows of the dataset, 0 for the padding rows
+VALIDITY_COLUMN = "__valid__"
+
+# This function gives the number of rows of the padded tensor:
+# - "pow2": the next power of two (1000 rows -> 1024)
+# - an integer step: the next multiple of the step (1000 rows with step 256 -> 1024)
+def bucket_rows(num_rows, bucket):
+    if bucket == "pow2":
+        rows = 1
+        while rows < num_rows:
+            rows *= 2
+        return rows
+    if isinstance(bucket, int) and bucket > 0:
+        return max(1, -(-num_rows // bucket)) * bucket
+    raise ValueError(f"Invalid bucket size: {bucket} (expected 'pow2' or a positive integer)")
+
+# This function pads the rows of a [rows, columns] tensor to the bucket and appends the validity column
+# (the only copy of the data: the rows of data can be a view of a memory-mapped snapshot)
+def pad_to_bucket(data, bucket):
+    import torch
+    num_rows = data.size(0)
+    padded = torch.zeros((bucket_rows(num_rows, bucket), data.size(1) + 1), dtype=torch.float32)
+    padded[:num_rows, :-1] = data
+    padded[:num_rows, -1] = 1.0
+    return padded
 
 class OLAPCube:
     def __init__(self, df, category_mappings=None): # The constructor receives as input a >..
         self.df = df                                #  ..< pandas DataFrame (df) 
-        self.label_encoder = LabelEncoder() # Initialize an instance of LabelEncoder, which is then assigned to the attribute label_encoder
-        if category_mappings is not None:
-            self.category_mappings = category_mappings
-            # Encode columns using the provided mapping
-            for col, mapping in self.category_mappings.items():
-                #? inv_mapping = {v: k for k, v in mapping.items()}
-                self.df[col] = self.df[col].map(lambda x: mapping.get(str(x), x))
-        else:
-            self.category_mappings = self.encode_categorical_columns()
+        # category_mappings: existing dictionaries {column: {value: code}} (e.g. the ones persisted for the dataset),
+        # they are extended with the new values and the codes they already contain never change
+        self.category_mappings = self.encode_categorical_columns(category_mappings)
+        self.columnar = None
 
-    def encode_categorical_columns(self):
-        categorical_columns = self.df.select_dtypes(include=['object']).columns
-        category_mappings = {}
-        for col in categorical_columns:
-            self.df[col] = self.label_encoder.fit_transform(self.df[col].astype(str))
-            # Convert mapping values to native int
-            mapping = dict(zip(
-                self.label_encoder.classes_,
-                [int(x) for x in self.label_encoder.transform(self.label_encoder.classes_)]
-            ))
-            category_mappings[col] = mapping
-        return category_mappings
-    
-    def save_category_mappings(self, path):
-        with open(path, "w") as f:
-            json.dump(self.category_mappings, f) 
-    
-    """
-    def encode_categorical_columns(self): # called in the construction
-        # Select all columns with object data type (typically strings), categorical_columns is the list of column names that are categorical
+    # This method builds a cube from data that is already encoded (e.g. a snapshot of models/cube_store.py),
+    # without encoding it again. columnar is the optional [columns, rows] float32 matrix behind df:
+    # to_tensor() then returns a view of it instead of a copy
+    @classmethod
+    def from_encoded(cls, df, category_mappings, columnar=None):
+        cube = cls.__new__(cls)
+        cube.df = df
+        cube.category_mappings = category_mappings
+        cube.columnar = columnar
+        return cube
+
+    # Append-only dictionary encoding of the categorical (string) columns:
+    # values already in the dictionary keep their code, new values get the next codes (in sorted order)
+    def encode_categorical_columns(self, category_mappings=None):
+        category_mappings = {col: dict(mapping) for col, mapping in (category_mappings or {}).items()}
         categorical_columns = self.df.select_dtypes(include=['object']).columns
-        category_mappings = {} # Initialize an empty dictionary to store the mappings
         for col in categorical_columns:
-            # Transform the categorical column into numeric labels using LabelEncoder
-            self.df[col] = self.label_encoder.fit_transform(self.df[col].astype(str))
-            category_mappings[col] = dict(zip(self.label_encoder.classes_, self.label_encoder.transform(self.label_encoder.classes_)))
+            values = self.df[col].astype(str)
+            mapping = category_mappings.setdefault(col, {})
+            next_code = max(mapping.values(), default=-1) + 1
+            for offset, value in enumerate(sorted(set(values.unique()) - mapping.keys())):
+                mapping[value] = next_code + offset
+            # One vectorized hash lookup for the whole column
+            labels = pd.Index(list(mapping.keys()))
+            codes = np.fromiter(mapping.values(), dtype=np.int64, count=len(mapping))
+            self.df[col] = codes[labels.get_indexer(values)]
         return category_mappings
     
     def save_category_mappings(self, path):
-        def convert(obj): # This function is used to convert the values of the DataFrame to a format that can be serialized to JSON
-            if isinstance(obj, dict):
-                return {k: convert(v) for k, v in obj.items()}
-            elif isinstance(obj, list):
-                return [convert(v) for v in obj]
-            elif hasattr(obj, "item"):
-                return int(obj)
-            else:
-                return int(obj) if isinstance(obj, float) and obj.is_integer() else obj
-        
-        with open(path, "w") as f:
-            json.dump(convert(self.category_mappings), f)    
-    """
+        # written to a temporary file first (unique per call), so a concurrent reader never sees a partial file.
+        # The writers of the same dictionary must hold its lock from the load to the save (see main.load_cube_from_csv)
+        with tempfile.NamedTemporaryFile("w", dir=os.path.dirname(path) or ".", prefix=os.path.basename(path) + ".",
+                                         suffix=".tmp", delete=False) as f:
+            json.dump(self.category_mappings, f)
+        os.replace(f.name, path)
 
+    @staticmethod
     def load_category_mappings(path):
         with open(path, "r") as f:
             return json.load(f)
@@ -66,13 +86,43 @@ class OLAPCube:
     def decode_categorical_columns(self):
         decoded_df = self.df.copy()
         for col, mapping in self.category_mappings.items():
-            inv_mapping = {v: k for k, v in mapping.items()}
-            decoded_df[col] = decoded_df[col].map(inv_mapping)
+            if col not in decoded_df.columns:
+                continue
+            # labels[code] = value, then one take over the whole column (unknown codes are decoded as None)
+            labels = np.full(max(mapping.values(), default=-1) + 1, None, dtype=object)
+            labels[np.fromiter(mapping.values(), dtype=np.int64, count=len(mapping))] = list(mapping.keys())
+            codes = np.rint(decoded_df[col].to_numpy(dtype=np.float64))
+            valid = (codes >= 0) & (codes < len(labels))
+            decoded = np.full(len(codes), None, dtype=object)
+            decoded[valid] = np.take(labels, codes[valid].astype(np.int64))
+            decoded_df[col] = decoded
         return decoded_df
 
+    # This method returns, for each column index, the sorted list of values that column can take
+    # (codes 0..n-1 for the categorical columns, the distinct values for the numerical ones).
+    # The roll-up uses them as the fixed set of groups of the exported model.
+    def get_group_values(self, columns):
+        group_values = {}
+        for col in columns:
+            name = self.df.columns[col]
+            if name in self.category_mappings:
+                group_values[col] = sorted(int(code) for code in self.category_mappings[name].values())
+            else:
+                group_values[col] = sorted(self.df[name].unique().tolist())
+        return group_values
+
     # This method is used to convert the values of the DataFrame to a torch tensor of type float32
-    def to_tensor(self):    
-        return torch.tensor(self.df.values, dtype=torch.float32)
+    # With a bucket size the rows are padded with zeros (see bucket_rows) and a validity column is appended,
+    # so every dataset with a row count in the same bucket gives a tensor of the same shape (and the same circuit)
+    def to_tensor(self, bucket=None):
+        import torch
+        if self.columnar is not None:
+            data = torch.from_numpy(self.columnar).t() # zero-copy view of the (memory-mapped) columns
+        else:
+            data = torch.tensor(self.df.values, dtype=torch.float32)
+        if bucket is None:
+            return data
+        return pad_to_bucket(data, bucket)
 
     # This method applies a specified operation (model) to the tensor data
     def execute_model(self, model, tensor_data):
@@ -8,3 +8,6 @@ class OLAPOperation(nn.Module): # inherits from nn.Module, making it compatible
 
     def forward(self, x): # This method is meant to be overridden by subclasses
         raise NotImplementedError("Subclasses should implement this method")
+
+    def output_columns(self, column_names): # Names of the output columns, by default the operation keeps all of them
+        return list(column_names)
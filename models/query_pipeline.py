@@ -0,0 +1,131 @@
+import threading
+import torch
+from torch import nn
+from operations.filter_model import FilteringModel
+from operations.predicates import remap_columns
+from operations.slice_model import SliceModel
+from operations.roll_up_model import RollUpModel
+from operations.compact_model import CompactModel
+
+# QueryPipeline composes a list of OLAP operations into a single nn.Module, so the whole query
+# (filters, slices and roll-up) is exported to ONNX as one graph and covered by one proof.
+# Before building the graph the operations go through a fusion pass:
+# - adjacent masks (FilteringModel / DicingModel) are merged into one compiled predicate
+# - masks that follow a slice are moved before it (their columns are remapped)
+# - consecutive slices are folded into a single column gather
+# - a slice right before a roll-up is folded into the roll-up (it only reads its own columns)
+# A compaction (CompactModel) is left at the end of the query: it only changes the rows of the output.
+
+_EXPORT_LOCK = threading.Lock()
+
+def _is_mask(operation):
+    # DicingModel is a FilteringModel too; validity-only masks are left where they are
+    return isinstance(operation, FilteringModel) and operation.validity_column is None
+
+def _merge_masks(first, second):
+    # AND of the two predicates: the compiler intersects the IN-lists and ranges on the same column
+    return FilteringModel(("and", first.predicate, second.predicate))
+
+def _original_index(remove_columns, index):
+    # index of a column after the slice -> index of the same column before the slice
+    col = 0
+    for _ in range(index + 1):
+        while col in remove_columns:
+            col += 1
+        col += 1
+    return col - 1
+
+def _fold_slices(first, second):
+    removed = set(first.remove_columns)
+    removed.update(_original_index(first.remove_columns, col) for col in second.remove_columns)
+    return SliceModel(sorted(removed))
+
+def _mask_before_slice(mask, slice_op):
+    return FilteringModel(remap_columns(mask.predicate, lambda col: _original_index(slice_op.remove_columns, col)))
+
+def _roll_up_before_slice(roll_up, slice_op):
+    group_values = {_original_index(slice_op.remove_columns, col): values for col, values in roll_up.group_values.items()}
+    measure_columns = [_original_index(slice_op.remove_columns, col) for col in roll_up.measure_columns]
+    validity_column, count_column = roll_up.validity_column, roll_up.count_column
+    if validity_column is not None:
+        validity_column = _original_index(slice_op.remove_columns, validity_column)
+    if count_column is not None:
+        count_column = _original_index(slice_op.remove_columns, count_column)
+    return RollUpModel(group_values, measure_columns, roll_up.aggregations, validity_column, count_column)
+
+def fuse_operations(operations):
+    fused = []
+    for operation in operations:
+        if _is_mask(operation):
+            pending_slices = []
+            while fused and isinstance(fused[-1], SliceModel):
+                slice_op = fused.pop()
+                operation = _mask_before_slice(operation, slice_op)
+                pending_slices.insert(0, slice_op)
+            if fused and _is_mask(fused[-1]):
+                operation = _merge_masks(fused.pop(), operation)
+            fused.append(operation)
+            fused.extend(pending_slices)
+        elif isinstance(operation, SliceModel):
+            if not operation.remove_columns:
+                continue
+            if fused and isinstance(fused[-1], SliceModel):
+                operation = _fold_slices(fused.pop(), operation)
+            fused.append(operation)
+        elif isinstance(operation, RollUpModel):
+            if fused and isinstance(fused[-1], SliceModel):
+                operation = _roll_up_before_slice(operation, fused.pop())
+            fused.append(operation)
+        else:
+            fused.append(operation)
+    return fused
+
+
+class QueryPipeline(nn.Module):
+    def __init__(self, operations, fuse=True):
+        super(QueryPipeline, self).__init__()
+        self.steps = nn.ModuleList(fuse_operations(operations) if fuse else list(operations))
+
+    def forward(self, x):
+        for step in self.steps:
+            x = step(x)
+        return x
+
+    def output_columns(self, column_names):
+        for step in self.steps:
+            column_names = step.output_columns(column_names)
+        return column_names
+
+    def describe(self):
+        lines = []
+        for i, step in enumerate(self.steps):
+            if isinstance(step, FilteringModel):
+                lines.append(f"[{i}] mask {step.describe()}")
+            elif isinstance(step, SliceModel):
+                lines.append(f"[{i}] gather (remove columns {step.remove_columns})")
+            elif isinstance(step, RollUpModel):
+                lines.append(f"[{i}] roll-up by {step.group_columns} ({step.num_groups()} groups), "
+                             f"measures {step.measure_columns}, {step.aggregations}")
+            elif isinstance(step, CompactModel):
+                lines.append(f"[{i}] compact valid rows (column {step.validity_column}) into {step.top_k} rows")
+            else:
+                lines.append(f"[{i}] {step.__class__.__name__}")
+        return "\n".join(lines)
+
+    # Exports the fused query to ONNX with the given example input
+    # (one export at a time: the ONNX exporter of torch keeps global state and is not thread-safe)
+    def export(self, example_input, model_onnx_path):
+        self.to(torch.device("cpu"))
+        self.eval()
+        with _EXPORT_LOCK:
+            self._export(example_input, model_onnx_path)
+
+    def _export(self, example_input, model_onnx_path):
+        torch.onnx.export(self,
+                          example_input,
+                          model_onnx_path,
+                          export_params=True,
+                          opset_version=11,
+                          do_constant_folding=True,
+                          input_names=['input'],
+                          output_names=['output'])
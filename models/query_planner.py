@@ -0,0 +1,200 @@
+import torch
+from models.olap_cube import bucket_rows, pad_to_bucket
+from models.cuboid_lattice import COUNT_COLUMN
+from models.query_pipeline import QueryPipeline
+from operations.filter_model import FilteringModel
+from operations.slice_model import SliceModel
+from operations.roll_up_model import RollUpModel
+from operations.compact_model import CompactModel
+from operations.predicates import normalize, simplify, remap_columns, columns, count_comparisons, describe
+
+# Cost-based planner of the OLAP queries.
+#
+# A LogicalQuery says what the query computes, with column names: a filter (condition tree of
+# operations/predicates.py whose columns are names), the levels to group by with the measures to aggregate
+# (roll-up), or the columns to return (row-level query). The planner enumerates the physical plans
+# (source table: fact table or a materialized cuboid; order of mask and projection; full-row or validity-only
+# mask) and keeps the one with the fewest estimated circuit constraints. Dead columns are dropped before the
+# tensor enters the circuit, so the circuit only sees the columns the query reads.
+# A query with a limit ends with a compaction (operations/compact_model.py): its valid result rows are moved
+# to the front of an output of limit rows, so the output does not grow with the rows of the table.
+
+class LogicalQuery:
+    def __init__(self, filters=None, group_by=None, measures=None, output_columns=None, aggregations=("sum", "count"),
+                 limit=None):
+        self.filters = simplify(normalize(filters)) if filters is not None else None
+        self.group_by = list(group_by) if group_by is not None else None # None = row-level query
+        self.measures = list(measures or [])
+        self.output_columns = list(output_columns) if output_columns is not None else None
+        self.aggregations = list(aggregations)
+        self.limit = limit # rows of the output (None = as many as the input: invalid rows are left as zeros)
+
+    def is_roll_up(self):
+        return self.group_by is not None
+
+    def filter_columns(self):
+        return columns(self.filters) if self.filters is not None else []
+
+    def result_columns(self):
+        if self.is_roll_up():
+            return self.group_by + self.measures
+        return self.output_columns
+
+    def required_columns(self):
+        return list(dict.fromkeys(self.filter_columns() + self.result_columns()))
+
+
+class QueryPlan:
+    def __init__(self, query, source, rows, input_columns, steps, cost):
+        self.query = query
+        self.source = source                # None = fact table, otherwise the cuboid (entry of lattice.json)
+        self.rows = rows                    # rows of the (padded) input tensor
+        self.input_columns = input_columns  # columns fed to the circuit (the validity column is added after them)
+        self.steps = steps                  # ("mask", "rows" | "validity"), ("gather", [columns]), ("roll_up",),
+                                            # ("compact", limit)
+        self.cost = cost
+
+    def describe(self):
+        source = "fact table" if self.source is None else f"cuboid {self.source['name']}"
+        lines = [f"Plan on {source}: {self.rows} rows x {len(self.input_columns) + 1} columns, estimated cost {self.cost}",
+                 f"  input columns: {self.input_columns}"]
+        for step in self.steps:
+            if step[0] == "mask":
+                lines.append(f"  mask ({step[1]}): {describe(self.query.filters)}")
+            elif step[0] == "gather":
+                lines.append(f"  gather: {step[1]}")
+            elif step[0] == "compact":
+                lines.append(f"  compact valid rows: first {step[1]}")
+            else:
+                lines.append(f"  roll-up by {self.query.group_by}: {self.query.aggregations} of {self.query.measures}")
+        return "\n".join(lines)
+
+    def build(self, cube, bucket=None):
+        """(input tensor, QueryPipeline) of the plan, from the cube of its source (fact table or cuboid)."""
+        data = cube.to_tensor() # view of the snapshot columns when the cube is memory-mapped
+        all_columns = list(cube.df.columns)
+        indices = [all_columns.index(col) for col in self.input_columns]
+        if indices != list(range(len(all_columns))):
+            # only the columns of the plan are copied (every column is kept e.g. in the hashed input mode)
+            data = torch.index_select(data, 1, torch.tensor(indices, dtype=torch.long))
+        tensor_data = pad_to_bucket(data, bucket if bucket is not None else 1)
+
+        current = list(self.input_columns) + [None] # None = validity column
+        operations = []
+        for step in self.steps:
+            if step[0] == "mask":
+                predicate = remap_columns(self.query.filters, current.index)
+                validity_column = len(current) - 1 if step[1] == "validity" else None
+                operations.append(FilteringModel(predicate, validity_column=validity_column))
+            elif step[0] == "gather":
+                kept = list(step[1]) + [None]
+                operations.append(SliceModel([i for i, col in enumerate(current) if col not in kept]))
+                current = [col for col in current if col in kept]
+            elif step[0] == "compact":
+                operations.append(CompactModel(step[1], validity_column=len(current) - 1))
+            else:
+                count_column = current.index(COUNT_COLUMN) if self.source is not None else None
+                values = cube.get_group_values([all_columns.index(col) for col in self.query.group_by]).values()
+                group_values = {current.index(col): col_values for col, col_values in zip(self.query.group_by, values)}
+                roll_up = RollUpModel(group_values, [current.index(col) for col in self.query.measures],
+                                      self.query.aggregations, validity_column=len(current) - 1, count_column=count_column)
+                operations.append(roll_up)
+                current = roll_up.output_columns(current) # one row per group, the validity column stays last
+        return tensor_data, QueryPipeline(operations, fuse=False)
+
+
+# Estimated number of circuit constraints of every operation (rows of the input tensor x its columns)
+def _mask_cost(rows, width, comparisons):
+    return rows * comparisons + rows * width
+
+def _roll_up_cost(rows, cardinalities, num_measures):
+    groups = 1
+    for cardinality in cardinalities:
+        groups *= cardinality
+    # one-hot comparisons + outer products + scatter-add (matmul) of the measures and the count
+    return rows * sum(cardinalities) + rows * groups + rows * groups * (num_measures + 1)
+
+def _compact_cost(rows, width, limit):
+    # cumulative sum + one-hot positions + gather of the valid rows (matmul)
+    return rows + rows * limit + rows * limit * width
+
+def _candidate_steps(query, input_columns):
+    """Possible orders of the operations of a query, given the columns that enter the circuit."""
+    has_filter = query.filters is not None
+    if query.is_roll_up():
+        if not has_filter:
+            return [[("roll_up",)]]
+        # the roll-up ignores invalid rows: masking only the validity column is enough
+        return [[("mask", "rows"), ("roll_up",)], [("mask", "validity"), ("roll_up",)]]
+    output = query.output_columns
+    needs_gather = list(input_columns) != list(output)
+    # the compaction only keeps valid rows too: masking the validity column is enough
+    mask = ("mask", "validity" if query.limit is not None else "rows")
+    candidates = []
+    if has_filter:
+        candidates.append([mask] + ([("gather", output)] if needs_gather else []))
+        if needs_gather and set(query.filter_columns()) <= set(output):
+            candidates.append([("gather", output), mask])
+    else:
+        candidates.append([("gather", output)] if needs_gather else [])
+    return candidates
+
+def _estimate(query, rows, input_columns, steps, cardinalities, count_column):
+    width = len(input_columns) + 1
+    cost = rows * width # input cells
+    comparisons = count_comparisons(query.filters) if query.filters is not None else 0
+    for step in steps:
+        if step[0] == "mask":
+            cost += _mask_cost(rows, 1 if step[1] == "validity" else width, comparisons)
+        elif step[0] == "gather":
+            width = len(step[1]) + 1
+            cost += rows * width
+        elif step[0] == "compact":
+            cost += _compact_cost(rows, width, step[1])
+        else:
+            cost += _roll_up_cost(rows, cardinalities, len(query.measures) + (count_column is not None))
+            rows = 1
+            for cardinality in cardinalities:
+                rows *= cardinality
+            width = len(query.group_by) + sum(1 if aggregation == "count" else len(query.measures)
+                                              for aggregation in query.aggregations) + 1
+    return cost
+
+# all_columns: every column of the fact table enters the circuit and the cuboids are not used
+# (hashed input mode: the input of the circuit must be the committed dataset tensor)
+def plan_query(query, cube, lattice=None, bucket=None, verbose=True, all_columns=False):
+    """Cheapest QueryPlan of a LogicalQuery on the fact table cube (and on the cuboids of its lattice)."""
+    required = query.required_columns()
+    # Columns that are dropped early: every column the query does not read never enters the circuit
+    input_columns = [col for col in cube.df.columns if all_columns or col in required]
+    missing = [col for col in required if col not in input_columns]
+    if missing:
+        raise KeyError(f"Columns not found in the dataset: {missing}")
+
+    cardinalities = []
+    if query.is_roll_up():
+        group_values = cube.get_group_values([list(cube.df.columns).index(col) for col in query.group_by])
+        cardinalities = [len(values) for values in group_values.values()]
+
+    sources = [(None, len(cube.df), input_columns)]
+    if lattice is not None and query.is_roll_up() and not all_columns:
+        # cuboids that contain every level the query reads (the measures are summed in every cuboid)
+        for cuboid in lattice["cuboids"]:
+            if set(query.group_by + query.filter_columns()) <= set(cuboid["levels"]):
+                cuboid_columns = cuboid["levels"] + cuboid["measures"] + [COUNT_COLUMN]
+                sources.append((cuboid, cuboid["rows"], [col for col in cuboid_columns if col in required or col == COUNT_COLUMN]))
+
+    best = None
+    for source, num_rows, source_columns in sources:
+        rows = bucket_rows(num_rows, bucket) if bucket is not None else num_rows
+        count_column = COUNT_COLUMN if source is not None else None
+        for steps in _candidate_steps(query, source_columns):
+            if query.limit is not None:
+                steps = steps + [("compact", query.limit)]
+            cost = _estimate(query, rows, source_columns, steps, cardinalities, count_column)
+            if best is None or cost < best.cost:
+                best = QueryPlan(query, source, rows, source_columns, steps, cost)
+
+    if verbose:
+        print(best.describe())
+    return best
@@ -0,0 +1,83 @@
+import json
+import hashlib
+from models.query_planner import LogicalQuery
+
+# Declarative query specs: what a query computes, with the names of the DFM (dimensions, levels, measures) and
+# the category labels, as a dictionary (e.g. read from JSON). A spec is compiled against the DatasetSchema of a
+# dataset into the LogicalQuery of the planner (models/query_planner.py).
+#
+# {
+#   "filter": {"Material": "Canvas", "Year": [2021, 2022]},  -> or a condition tree of operations/predicates.py,
+#                                                               e.g. ["and", ["=", "Material", "Canvas"], [">=", "Year", 2021]]
+#   "slice": ["Clothes Type"],                               -> dimensions removed from the result
+#   "roll_up": {"Date": "Year"},                             -> dimension: level kept (the lower levels are aggregated)
+#   "group_by": ["Material", "Year"],                        -> or the levels to group by, explicitly
+#   "measures": ["Total Emissions (kgCO₂e)"],                -> measures of the roll-up (default: every measure)
+#   "aggregations": ["sum", "count"],
+#   "columns": [...],                                        -> columns of a row-level query (default: every column)
+#   "limit": 100                                             -> rows of the result: the matching rows (or non-empty groups)
+#                                                               are compacted into the first rows of an output of this size
+# }
+# A spec with slice, roll_up or group_by is a roll-up grouped by the levels left, otherwise a row-level query.
+# The hash of a spec identifies it (key order does not matter): plans and exported models are memoized by it.
+
+RANGE_OPERATORS = ("<", "<=", ">", ">=", "between")
+
+def spec_hash(spec):
+    return hashlib.sha256(json.dumps(spec, sort_keys=True, separators=(",", ":"), ensure_ascii=False).encode()).hexdigest()
+
+def load_spec(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def _encode_condition(tree, schema):
+    """Condition tree with the column names checked and the category labels replaced by their codes."""
+    if isinstance(tree, dict):
+        tree = ["and"] + [["in", col, value if isinstance(value, (list, tuple)) else [value]] for col, value in tree.items()]
+    op = str(tree[0]).lower()
+    if op in ("and", "or"):
+        return (op,) + tuple(_encode_condition(child, schema) for child in tree[1:])
+    if op == "not":
+        return ("not", _encode_condition(tree[1], schema))
+    if op in ("true", "false"):
+        return (op,)
+    col = schema.column(tree[1])
+    if op == "in":
+        return ("in", col, tuple(schema.code(col, value) for value in tree[2]))
+    if op in RANGE_OPERATORS and schema.is_categorical(col):
+        raise ValueError(f"Range condition on the categorical column {col}: the codes of its labels are not ordered")
+    return (op, col) + tuple(schema.code(col, value) for value in tree[2:])
+
+def compile_spec(spec, schema):
+    """LogicalQuery of a spec on the dataset of the schema."""
+    unknown = set(spec) - {"filter", "slice", "roll_up", "group_by", "measures", "aggregations", "columns", "limit"}
+    if unknown:
+        raise ValueError(f"Unknown fields in the query spec: {sorted(unknown)}")
+    filters = _encode_condition(spec["filter"], schema) if spec.get("filter") else None
+    aggregations = spec.get("aggregations", ("sum", "count"))
+    limit = spec.get("limit")
+    if limit is not None and (isinstance(limit, bool) or not isinstance(limit, int) or limit < 1):
+        raise ValueError(f"The limit of the query spec must be a positive integer: {limit}")
+
+    if "group_by" in spec or "slice" in spec or "roll_up" in spec:
+        if "group_by" in spec:
+            group_by = [schema.column(level) for level in spec["group_by"]]
+        else:
+            sliced = set(spec.get("slice", []))
+            for dimension in sliced:
+                schema.levels(dimension)
+            group_by = []
+            for dimension, levels in schema.hierarchies.items():
+                if dimension in sliced:
+                    continue
+                if dimension in spec.get("roll_up", {}):
+                    levels = schema.levels_above(dimension, spec["roll_up"][dimension])
+                group_by.extend(levels)
+            for dimension in spec.get("roll_up", {}):
+                schema.levels(dimension)
+            group_by.sort(key=schema.index.get) # in the order of the columns of the dataset
+        measures = [schema.column(measure) for measure in spec.get("measures", schema.measures)]
+        return LogicalQuery(filters=filters, group_by=group_by, measures=measures, aggregations=aggregations, limit=limit)
+
+    output_columns = [schema.column(col) for col in spec.get("columns", schema.columns)]
+    return LogicalQuery(filters=filters, output_columns=output_columns, limit=limit)
@@ -0,0 +1,48 @@
+import torch
+from models.olap_operations import OLAPOperation
+
+# Compaction of the valid rows: the output has top_k rows instead of the rows of the input tensor.
+# The valid rows (validity column > 0) are moved to the front in their order, the rows after them are zeros,
+# and a last column carries the number of valid rows of the input (the same value on every row).
+# The public outputs of the proof then grow with the size of the result, not with the size of the table.
+#
+# Example: CompactModel(2, validity_column=2) on
+#   [[1, 5, 0], [2, 6, 1], [3, 7, 0], [4, 8, 1]]  ->  [[2, 6, 1, 2], [4, 8, 1, 2]]
+#
+# If more than top_k rows are valid only the first top_k are kept: the match count tells the reader
+# that the result was truncated. Every operation is exportable (CumSum is in ONNX opset 11):
+# - position of every row among the valid ones: cumulative sum of the validity column
+# - one-hot matrix [top_k, rows] of the valid rows by position, the output is its product with the input
+
+MATCH_COUNT_COLUMN = "__matches__"
+
+class CompactModel(OLAPOperation):
+    def __init__(self, top_k, validity_column):
+        super(CompactModel, self).__init__()
+        if top_k < 1:
+            raise ValueError(f"The compacted output needs at least one row (top_k={top_k})")
+        self.top_k = top_k
+        self.validity_column = validity_column
+        self.register_buffer("slots", torch.arange(top_k, dtype=torch.float32))
+
+    def output_columns(self, column_names):
+        return list(column_names) + [MATCH_COUNT_COLUMN]
+
+    def compact(self, x):
+        valid = torch.clamp(x[:, self.validity_column], min=0.0, max=1.0) # 0/1 for every row
+        position = torch.cumsum(valid, dim=0) - 1.0                        # index of the row in the output
+        # invalid rows share the position of the previous valid row: the product with valid discards them
+        scatter = (position.unsqueeze(0) == self.slots.unsqueeze(1)).to(x.dtype) * valid.unsqueeze(0) # [top_k, rows]
+        return scatter.matmul(x), valid.sum()
+
+    def forward(self, x):
+        rows, matches = self.compact(x)
+        return torch.cat([rows, matches.reshape(1, 1).expand(self.top_k, 1)], dim=1)
+
+    # This method merges the outputs of the same compaction run on disjoint sets of rows (e.g. the shards of a
+    # tensor): the valid rows of every part are compacted again, in the order of the parts, and the counts are added
+    def merge_partials(self, outputs):
+        outputs = list(outputs)
+        rows, _ = self.compact(torch.cat([output[:, :-1] for output in outputs], dim=0))
+        matches = torch.stack([output[0, -1] for output in outputs]).sum()
+        return torch.cat([rows, matches.reshape(1, 1).expand(self.top_k, 1)], dim=1)
@@ -1,21 +1,12 @@
 from models.olap_operations import OLAPOperation
+from operations.filter_model import FilteringModel
 import torch
 from torch import nn
 
-class DicingModel(OLAPOperation):
+# Example: DicingModel({2: 2, 21: [3, 4], 27: 4})
+# -> rows where column 2 is ==2, column 21 is 3 or 4 and column 27 is ==4
+# Every list becomes a single IN comparison against a constant vector (see operations/predicates.py)
+class DicingModel(FilteringModel):
     def __init__(self, conditions):
-        super(DicingModel, self).__init__()
+        super(DicingModel, self).__init__(conditions)
         self.conditions = conditions
-
-    def forward(self, x):
-        mask = torch.ones(x.size(0), dtype=torch.bool)
-        for column, value in self.conditions.items():
-            if isinstance(value, list):
-                temp_mask = torch.zeros(x.size(0), dtype=torch.bool)
-                for val in value:
-                    temp_mask = temp_mask | (x[:, column] == val)
-                mask = mask & temp_mask
-            else:
-                mask = mask & (x[:, column] == value)
-        return x * mask.unsqueeze(1)
-    
\ No newline at end of file
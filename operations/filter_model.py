@@ -1,23 +1,34 @@
 # Is that filtering and not slicing?
 
-# Example: SlicingModel({14: 1, 21: 12, 27: 0})
+# Example: FilteringModel({14: 1, 21: 12, 27: 0})
 # -> filter to have only the rows where column 14 is ==1, column 21 is ==12 and column 27 is ==0
+# Example: FilteringModel(("and", ("in", 2, [0, 3]), ("between", 3, 2021, 2023)))
+# -> any condition tree of operations/predicates.py (=, IN, <, <=, >, >=, BETWEEN, NOT, AND, OR)
 
 import torch
 from models.olap_operations import OLAPOperation
+from operations.predicates import compile_predicate, describe
 from torch import nn
 
 class FilteringModel(OLAPOperation):
-    def __init__(self, filter_conditions):
+    def __init__(self, filter_conditions, validity_column=None):
         super(FilteringModel, self).__init__()
         self.filter_conditions = filter_conditions
+        # validity_column: only the validity column is multiplied by the mask (1 value per row instead of the whole row).
+        # Only for inputs of a roll-up, which ignores invalid rows: the other columns of the rows are left as they are
+        self.validity_column = validity_column
+        # the conditions are compiled once into a single vectorized mask expression
+        self.predicate, self.mask = compile_predicate(filter_conditions)
+
+    def describe(self):
+        return describe(self.predicate)
 
     def forward(self, x):
-        # create a mask of ones with the same size as the rows of x
-        mask = torch.ones(x.size(0), dtype=torch.bool)
-        for column, value in self.filter_conditions.items():
-            # x[:, column] -> select all rows of the "column"
-            mask = mask & (x[:, column] == value)
+        # 0/1 mask with the same size as the rows of x
+        mask = self.mask(x)
+        if self.validity_column is not None:
+            v = self.validity_column
+            return torch.cat([x[:, :v], (x[:, v] * mask).unsqueeze(1), x[:, v + 1:]], dim=1)
         return x * mask.unsqueeze(1) 
         # make zero the rows that do not match the conditions
         # Il modello lavora sempre su tensori di shape fissa, bisogna restituire un tensore con righe di 0
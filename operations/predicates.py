@@ -0,0 +1,280 @@
+# Predicate compiler for the masks of FilteringModel and DicingModel.
+#
+# A condition is a tree of tuples (lists are accepted too, e.g. from JSON):
+#   ("=", col, value)              ("in", col, [v1, v2, ...])
+#   ("<", col, v)  ("<=", col, v)  (">", col, v)  (">=", col, v)
+#   ("between", col, low, high)    -> low <= x <= high
+#   ("not", cond)  ("and", cond1, cond2, ...)  ("or", cond1, cond2, ...)
+# The legacy dictionaries are accepted as well: {col: value} or {col: [values]} is the AND of the columns.
+#
+# The tree is normalized and simplified (equalities become IN-lists, IN-lists and ranges on the same column
+# are intersected/united, constants are folded) and then compiled into one nn.Module that computes a 0/1
+# float mask: an IN-list is a single broadcast comparison against a constant vector, AND/OR/NOT are products
+# and differences, and ranges only use strict Less/Greater, which every exporter and ezkl support.
+
+import torch
+from torch import nn
+
+TRUE = ("true",)
+FALSE = ("false",)
+
+def normalize(tree):
+    if isinstance(tree, dict):
+        return ("and",) + tuple(
+            ("in", col, tuple(value)) if isinstance(value, (list, tuple)) else ("in", col, (value,))
+            for col, value in tree.items())
+    op = str(tree[0]).lower()
+    if op in ("and", "or"):
+        return (op,) + tuple(normalize(child) for child in tree[1:])
+    if op == "not":
+        return ("not", normalize(tree[1]))
+    if op in ("true", "false"):
+        return (op,)
+    if op == "range": # already normalized
+        return tuple(tree)
+    col = tree[1]
+    if op in ("=", "=="):
+        return ("in", col, (tree[2],))
+    if op == "in":
+        return ("in", col, tuple(tree[2]))
+    if op == "between":
+        return ("range", col, tree[2], tree[3], True, True)
+    if op == "<":
+        return ("range", col, None, tree[2], False, False)
+    if op == "<=":
+        return ("range", col, None, tree[2], False, True)
+    if op == ">":
+        return ("range", col, tree[2], None, False, False)
+    if op == ">=":
+        return ("range", col, tree[2], None, True, False)
+    raise ValueError(f"Unsupported predicate operator: {tree[0]}")
+
+def _in_range(value, node):
+    _, _, low, high, low_inclusive, high_inclusive = node
+    if low is not None and (value < low or (value == low and not low_inclusive)):
+        return False
+    if high is not None and (value > high or (value == high and not high_inclusive)):
+        return False
+    return True
+
+def _intersect_ranges(a, b):
+    col = a[1]
+    low, low_inclusive = a[2], a[4]
+    if b[2] is not None and (low is None or b[2] > low or (b[2] == low and not b[4])):
+        low, low_inclusive = b[2], b[4]
+    high, high_inclusive = a[3], a[5]
+    if b[3] is not None and (high is None or b[3] < high or (b[3] == high and not b[5])):
+        high, high_inclusive = b[3], b[5]
+    if low is not None and high is not None and (low > high or (low == high and not (low_inclusive and high_inclusive))):
+        return FALSE
+    return ("range", col, low, high, low_inclusive, high_inclusive)
+
+def _simplify_and(children):
+    in_lists, ranges, others = {}, {}, []
+    for child in children:
+        if child == FALSE:
+            return FALSE
+        if child == TRUE:
+            continue
+        if child[0] == "in":
+            values = in_lists.get(child[1])
+            in_lists[child[1]] = child[2] if values is None else tuple(v for v in values if v in child[2])
+        elif child[0] == "range":
+            current = ranges.get(child[1])
+            ranges[child[1]] = child if current is None else _intersect_ranges(current, child)
+            if ranges[child[1]] == FALSE:
+                return FALSE
+        else:
+            others.append(child)
+    merged = []
+    for col, values in in_lists.items():
+        if col in ranges:
+            col_range = ranges.pop(col)
+            values = tuple(v for v in values if _in_range(v, col_range))
+        if not values:
+            return FALSE
+        merged.append(("in", col, values))
+    merged.extend(ranges.values())
+    merged.extend(others)
+    if not merged:
+        return TRUE
+    return merged[0] if len(merged) == 1 else ("and",) + tuple(merged)
+
+def _simplify_or(children):
+    in_lists, others = {}, []
+    for child in children:
+        if child == TRUE:
+            return TRUE
+        if child == FALSE:
+            continue
+        if child[0] == "in":
+            values = in_lists.get(child[1], ())
+            in_lists[child[1]] = values + tuple(v for v in child[2] if v not in values)
+        else:
+            others.append(child)
+    merged = [("in", col, values) for col, values in in_lists.items()] + others
+    if not merged:
+        return FALSE
+    return merged[0] if len(merged) == 1 else ("or",) + tuple(merged)
+
+def simplify(tree):
+    op = tree[0]
+    if op in ("and", "or"):
+        children = []
+        for child in (simplify(c) for c in tree[1:]):
+            children.extend(child[1:] if child[0] == op else [child]) # flatten nested AND/OR
+        return _simplify_and(children) if op == "and" else _simplify_or(children)
+    if op == "not":
+        child = simplify(tree[1])
+        if child == TRUE:
+            return FALSE
+        if child == FALSE:
+            return TRUE
+        return child[1] if child[0] == "not" else ("not", child)
+    if op == "in":
+        values = tuple(dict.fromkeys(tree[2])) # no duplicates, same order
+        return ("in", tree[1], values) if values else FALSE
+    return tree
+
+def remap_columns(tree, column_map):
+    """Same predicate with every column index replaced by column_map(col)."""
+    op = tree[0]
+    if op in ("and", "or"):
+        return (op,) + tuple(remap_columns(child, column_map) for child in tree[1:])
+    if op == "not":
+        return ("not", remap_columns(tree[1], column_map))
+    if op in ("in", "range"):
+        return (op, column_map(tree[1])) + tuple(tree[2:])
+    return tree
+
+def columns(tree):
+    """Column indices read by the predicate."""
+    op = tree[0]
+    if op in ("and", "or"):
+        return sorted(set(col for child in tree[1:] for col in columns(child)))
+    if op == "not":
+        return columns(tree[1])
+    if op in ("in", "range"):
+        return [tree[1]]
+    return []
+
+def describe(tree):
+    op = tree[0]
+    if op in ("and", "or"):
+        return "(" + f" {op.upper()} ".join(describe(child) for child in tree[1:]) + ")"
+    if op == "not":
+        return f"NOT {describe(tree[1])}"
+    if op == "in":
+        return f"[{tree[1]}] = {tree[2][0]}" if len(tree[2]) == 1 else f"[{tree[1]}] IN {list(tree[2])}"
+    if op == "range":
+        _, col, low, high, low_inclusive, high_inclusive = tree
+        parts = []
+        if low is not None:
+            parts.append(f"{low} {'<=' if low_inclusive else '<'}")
+        parts.append(f"[{col}]")
+        if high is not None:
+            parts.append(f"{'<=' if high_inclusive else '<'} {high}")
+        return " ".join(parts)
+    return op.upper()
+
+def count_comparisons(tree):
+    """Number of element-wise comparisons per row of the compiled mask (used to estimate its cost)."""
+    op = tree[0]
+    if op in ("and", "or"):
+        return sum(count_comparisons(child) for child in tree[1:])
+    if op == "not":
+        return count_comparisons(tree[1])
+    if op == "in":
+        return len(tree[2])
+    if op == "range":
+        return (tree[2] is not None) + (tree[3] is not None)
+    return 0
+
+
+class _InMask(nn.Module):
+    def __init__(self, col, values):
+        super(_InMask, self).__init__()
+        self.col = col
+        self.register_buffer("values", torch.tensor([float(v) for v in values], dtype=torch.float32))
+
+    def forward(self, x):
+        column = x[:, self.col]
+        if self.values.numel() == 1:
+            return (column == self.values[0]).to(x.dtype)
+        # one broadcast comparison [rows, values]; the values are distinct, so the sum is 0 or 1
+        return (column.unsqueeze(1) == self.values.unsqueeze(0)).to(x.dtype).sum(dim=1)
+
+class _RangeMask(nn.Module):
+    def __init__(self, col, low, high, low_inclusive, high_inclusive):
+        super(_RangeMask, self).__init__()
+        self.col = col
+        self.low, self.high = low, high
+        self.low_inclusive, self.high_inclusive = low_inclusive, high_inclusive
+
+    def forward(self, x):
+        column = x[:, self.col]
+        mask = torch.ones_like(column)
+        # x >= low is computed as 1 - (x < low), x <= high as 1 - (x > high): only strict comparisons
+        if self.low is not None:
+            mask = mask * ((1 - (column < self.low).to(x.dtype)) if self.low_inclusive else (column > self.low).to(x.dtype))
+        if self.high is not None:
+            mask = mask * ((1 - (column > self.high).to(x.dtype)) if self.high_inclusive else (column < self.high).to(x.dtype))
+        return mask
+
+class _AndMask(nn.Module):
+    def __init__(self, children):
+        super(_AndMask, self).__init__()
+        self.terms = nn.ModuleList(children)
+
+    def forward(self, x):
+        mask = self.terms[0](x)
+        for term in self.terms[1:]:
+            mask = mask * term(x)
+        return mask
+
+class _OrMask(nn.Module):
+    def __init__(self, children):
+        super(_OrMask, self).__init__()
+        self.terms = nn.ModuleList(children)
+
+    def forward(self, x):
+        # a OR b = 1 - (1 - a) * (1 - b)
+        none = 1 - self.terms[0](x)
+        for term in self.terms[1:]:
+            none = none * (1 - term(x))
+        return 1 - none
+
+class _NotMask(nn.Module):
+    def __init__(self, child):
+        super(_NotMask, self).__init__()
+        self.term = child
+
+    def forward(self, x):
+        return 1 - self.term(x)
+
+class _ConstMask(nn.Module):
+    def __init__(self, value):
+        super(_ConstMask, self).__init__()
+        self.value = float(value)
+
+    def forward(self, x):
+        return torch.full((x.size(0),), self.value, dtype=x.dtype)
+
+def _build(tree):
+    op = tree[0]
+    if op == "in":
+        return _InMask(tree[1], tree[2])
+    if op == "range":
+        return _RangeMask(*tree[1:])
+    if op == "and":
+        return _AndMask([_build(child) for child in tree[1:]])
+    if op == "or":
+        return _OrMask([_build(child) for child in tree[1:]])
+    if op == "not":
+        return _NotMask(_build(tree[1]))
+    return _ConstMask(op == "true")
+
+def compile_predicate(tree):
+    """(simplified tree, nn.Module computing the 0/1 mask of the rows) of a condition tree or legacy dictionary."""
+    tree = simplify(normalize(tree))
+    return tree, _build(tree)
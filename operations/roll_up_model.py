@@ -2,29 +2,119 @@ from models.olap_operations import OLAPOperation
 from torch import nn
 import torch
 
+# Example: RollUpModel({2: [0, 1, 2], 3: [2020, 2021]}, [6])
+# -> one output row for every (Material, Year) pair, with the sum of column 6 and the number of rows of the group
+# The set of groups is fixed when the model is built (known values of each dimension),
+# so the output shape does not depend on the data and the model can be exported to ONNX / ezkl.
+
+AGGREGATIONS = ("sum", "count", "avg")
+
 class RollUpModel(OLAPOperation):
-    def __init__(self, remove_columns=None):
+    def __init__(self, group_values, measure_columns, aggregations=("sum", "count"), validity_column=None, count_column=None):
         super(RollUpModel, self).__init__()
-        # ensure to sort the list of columns (1, 2, 3, ...) or to create an empty list
-        self.remove_columns = sorted(remove_columns) if remove_columns is not None else []
+        # count_column: index of a column with the number of fact rows behind each input row, for inputs that are
+        # already aggregated (e.g. a cuboid of models/cuboid_lattice.py): the count of a group is the sum of it
+        self.count_column = count_column
+        # validity_column: index of the validity column of a padded tensor (see OLAPCube.to_tensor),
+        # padding rows and filtered rows are not counted and the output gets a validity column (group not empty)
+        self.validity_column = validity_column
+        # group_values: {column index: list of the values that column can take}, e.g. from OLAPCube.get_group_values()
+        self.group_columns = list(group_values.keys())
+        self.group_values = {col: [float(v) for v in values] for col, values in group_values.items()}
+        self.measure_columns = list(measure_columns)
+        for aggregation in aggregations:
+            if aggregation not in AGGREGATIONS:
+                raise ValueError(f"Unsupported aggregation '{aggregation}', expected one of {AGGREGATIONS}")
+        self.aggregations = list(aggregations)
+
+        # Constant values of every dimension (one buffer per group column, exported as constants of the graph)
+        for i, col in enumerate(self.group_columns):
+            self.register_buffer(f"values_{i}", torch.tensor(self.group_values[col], dtype=torch.float32))
+        # Key columns of the output: the cartesian product of the group values (one row per group)
+        self.register_buffer("group_keys", self._group_keys())
+
+    def _group_keys(self):
+        if not self.group_columns:
+            return torch.zeros((1, 0), dtype=torch.float32)
+        grids = torch.meshgrid(*[getattr(self, f"values_{i}") for i in range(len(self.group_columns))], indexing="ij")
+        return torch.stack([g.reshape(-1) for g in grids], dim=1)
+
+    def num_groups(self):
+        return self.group_keys.size(0)
+
+    def output_columns(self, column_names):
+        # Names of the output columns given the names of the input columns
+        names = [column_names[col] for col in self.group_columns]
+        for aggregation in self.aggregations:
+            if aggregation == "count":
+                names.append("Count")
+            else:
+                names.extend(f"{aggregation.capitalize()} {column_names[col]}" for col in self.measure_columns)
+        if self.validity_column is not None:
+            names.append(column_names[self.validity_column])
+        return names
+
+    def group_one_hot(self, x):
+        # one_hot[i, g] = 1 if row i belongs to group g (outer product of the one-hot encoding of every dimension)
+        one_hot = torch.ones((x.size(0), 1), dtype=x.dtype)
+        for i, col in enumerate(self.group_columns):
+            values = getattr(self, f"values_{i}")
+            col_one_hot = (x[:, col].unsqueeze(1) == values.unsqueeze(0)).to(x.dtype)  # [rows, cardinality]
+            one_hot = (one_hot.unsqueeze(2) * col_one_hot.unsqueeze(1)).reshape(x.size(0), -1)
+        if self.validity_column is not None:
+            one_hot = one_hot * x[:, self.validity_column].unsqueeze(1)
+        return one_hot
 
     def forward(self, x):
-        if not self.remove_columns:
-            return x  # Nessuna colonna da rimuovere, ritorna x inalterato
-        
-        # Crea una lista di intervalli per mantenere le colonne
-        ranges_to_keep = []
-        start = 0
-        for col in self.remove_columns:
-            if col > start:
-                ranges_to_keep.append((start, col))
-            start = col + 1
-        
-        # Aggiungi l'ultimo intervallo se c'è ancora qualcosa dopo l'ultima colonna rimossa
-        if start < x.size(1):
-            ranges_to_keep.append((start, x.size(1)))
-        
-        # Concatena le parti da mantenere
-        x_kept_parts = [x[:, s:e] for s, e in ranges_to_keep]
-        return torch.cat(x_kept_parts, dim=1)
-    
+        one_hot = self.group_one_hot(x)                  # [rows, groups]
+        measures = x[:, self.measure_columns]            # [rows, measures]
+        sums = one_hot.t().matmul(measures)              # scatter-add of the measures into their group
+        if self.count_column is not None:
+            counts = one_hot.t().matmul(x[:, self.count_column].unsqueeze(1))
+        else:
+            counts = one_hot.sum(dim=0).unsqueeze(1)     # [groups, 1]
+
+        parts = [self.group_keys]
+        for aggregation in self.aggregations:
+            if aggregation == "sum":
+                parts.append(sums)
+            elif aggregation == "count":
+                parts.append(counts)
+            elif aggregation == "avg":
+                # empty groups would divide by zero: they keep an average of 0
+                parts.append(sums / torch.clamp(counts, min=1.0))
+        if self.validity_column is not None:
+            parts.append(torch.clamp(counts, max=1.0))  # 1 if the group contains at least one row
+        return torch.cat(parts, dim=1)
+
+    # This method merges the outputs of the same roll-up run on disjoint sets of rows (e.g. the shards of a tensor)
+    # into the output the roll-up would give on all the rows: sums and counts are added, averages are re-weighted
+    def merge_partials(self, outputs):
+        stacked = torch.stack(list(outputs))  # [parts, groups, columns]
+        num_measures = len(self.measure_columns)
+        offset = len(self.group_columns)
+        blocks = {}
+        for aggregation in self.aggregations:
+            width = 1 if aggregation == "count" else num_measures
+            blocks[aggregation] = (offset, offset + width)
+            offset += width
+
+        if "avg" in blocks and "count" not in blocks:
+            raise ValueError("Merging averages requires the 'count' aggregation")
+
+        parts = [stacked[0][:, :len(self.group_columns)]]
+        counts = None
+        if "count" in blocks:
+            start, end = blocks["count"]
+            counts = stacked[:, :, start:end].sum(dim=0)
+        for aggregation in self.aggregations:
+            start, end = blocks[aggregation]
+            if aggregation in ("sum", "count"):
+                parts.append(stacked[:, :, start:end].sum(dim=0))
+            elif aggregation == "avg":
+                count_start, count_end = blocks["count"]
+                weighted = (stacked[:, :, start:end] * stacked[:, :, count_start:count_end]).sum(dim=0)
+                parts.append(weighted / torch.clamp(counts, min=1.0))
+        if self.validity_column is not None:
+            parts.append(stacked[:, :, offset:offset + 1].amax(dim=0))
+        return torch.cat(parts, dim=1)
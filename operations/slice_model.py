@@ -8,22 +8,16 @@ class SliceModel(OLAPOperation):
         # ensure to sort the list of columns (1, 2, 3, ...) or to create an empty list
         self.remove_columns = sorted(remove_columns) if remove_columns is not None else []
     
+    def kept_columns(self, num_columns):
+        return [i for i in range(num_columns) if i not in self.remove_columns]
+
+    def output_columns(self, column_names):
+        return [column_names[i] for i in self.kept_columns(len(column_names))]
+
     def forward(self, x):
         if not self.remove_columns:
             return x  # Nessuna colonna da rimuovere, ritorna x inalterato
         
-        # Crea una lista di intervalli per mantenere le colonne
-        ranges_to_keep = []
-        start = 0
-        for col in self.remove_columns:
-            if col > start:
-                ranges_to_keep.append((start, col))
-            start = col + 1
-        
-        # Aggiungi l'ultimo intervallo se c'è ancora qualcosa dopo l'ultima colonna rimossa
-        if start < x.size(1):
-            ranges_to_keep.append((start, x.size(1)))
-        
-        # Concatena le parti da mantenere
-        x_kept_parts = [x[:, s:e] for s, e in ranges_to_keep]
-        return torch.cat(x_kept_parts, dim=1)
+        # Una sola gather con gli indici delle colonne da mantenere (costanti al momento dell'export)
+        keep = torch.tensor(self.kept_columns(x.size(1)), dtype=torch.long)
+        return torch.index_select(x, 1, keep)
@@ -0,0 +1,253 @@
+import os
+import re
+import json
+import asyncio
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import main
+from web3_client import get_client
+from job_scheduler import QueryScheduler, DONE, FAILED
+from hash_utils import verify_dataset
+from trace_utils import span, get_tracer
+
+# Long-running local query service: the publish, verify and query operations of main.py behind a small
+# JSON-over-HTTP API, in a process that stays up between requests. What stays warm:
+# - the imports (torch, onnx, ezkl, web3) and the DFM dimension hierarchy
+# - the encoded cubes and cuboids (main.CUBE_CACHE, memory-mapped snapshots)
+# - the web3 client with its keep-alive connection and contract instances (web3_client.get_client)
+# - the proving worker processes of the scheduler; the compiled circuits, keys and SRS come from the artifact
+#   cache on disk (and the page cache), so a repeat query costs about witness + prove
+#
+#   GET  /health                 -> {"status": "ok", "workers": [...]}
+#   GET  /datasets               -> published hashes {file: hash}
+#   POST /publish {"file", "merkle": false} -> {"file", "hash"} (merkle: root of the row chunks of the file)
+#   POST /publish_appended {"file"} -> {"file", "hash"} (new root of a Merkle-published file with appended rows)
+#   POST /publish_batch {"files"} -> {"hashes": {file: hash}} (one Merkle root for the whole batch)
+#   POST /verify  {"file"}       -> {"file", "hash", "verified", "error"}
+#   POST /query   {"file", "spec": {...}, "wait": false} -> job (202 while running, 200 once finished with "wait": true),
+#                                                         spec: declarative query of models/query_spec.py (optional)
+#   GET  /jobs                   -> all the jobs
+#   GET  /jobs/<id>              -> one job (status: queued, preparing, proving, finishing, done, failed)
+#   GET  /metrics                -> per-stage metrics in the Prometheus text format
+#
+# Usage: python query_service.py [--host 127.0.0.1] [--port 8080] [--prove-workers N]
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8080
+PUBLISHED_HASH_PATH = os.path.join('data', 'published_hash.json')
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def load_published_hashes():
+    if not os.path.exists(PUBLISHED_HASH_PATH):
+        return {}
+    with open(PUBLISHED_HASH_PATH, 'r') as f:
+        return json.load(f)
+
+
+class QueryService:
+    def __init__(self, max_prepare=4, max_prove_workers=None):
+        # The scheduler lives on an event loop of its own thread; the HTTP threads hand it work
+        self.loop = asyncio.new_event_loop()
+        self._loop_thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._loop_thread.start()
+        self.scheduler = self._run(self._create_scheduler(max_prepare, max_prove_workers))
+        self._publish_lock = threading.Lock() # publications write published_hash.json and the snapshots
+        self.workers = []
+
+    async def _create_scheduler(self, max_prepare, max_prove_workers):
+        return QueryScheduler(main.prepare_query, main.finish_query, max_prepare=max_prepare,
+                              max_prove_workers=max_prove_workers)
+
+    def _run(self, coroutine, timeout=None):
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result(timeout)
+
+    def warm_up(self):
+        with span("service_warm_up"):
+            main.load_dimension_hierarchy()
+            try:
+                get_client().ensure_connected()
+            except Exception as e:
+                logging.warning(f"Blockchain not reachable yet: {e}")
+            for dataset_hash in load_published_hashes().values():
+                main.CUBE_CACHE.get_or_load(dataset_hash, lambda: main.load_snapshot(dataset_hash))
+            self.workers = self._run(self.scheduler.warm_up())
+        print(f"Service warm: {len(self.workers)} proving workers")
+
+    def _file_path(self, file_name):
+        if not file_name or os.path.basename(file_name) != file_name:
+            raise RequestError(400, "A file name of data/uploaded is required")
+        file_path = os.path.join('data', 'uploaded', file_name)
+        if not os.path.exists(file_path):
+            raise RequestError(404, f"File not found: {file_name}")
+        return file_path
+
+    def _published_hash(self, file_name):
+        dataset_hash = load_published_hashes().get(file_name)
+        if dataset_hash is None:
+            raise RequestError(404, f"No published hash for {file_name}")
+        return dataset_hash
+
+    def publish(self, file_name, merkle=False):
+        self._file_path(file_name)
+        with self._publish_lock, span("service_publish", file=file_name, merkle=merkle):
+            dataset_hash = main.op_publish_dataset(file_name, merkle=merkle)
+        return dict(file=file_name, hash=dataset_hash)
+
+    def publish_appended(self, file_name):
+        self._file_path(file_name)
+        with self._publish_lock, span("service_publish_appended", file=file_name):
+            try:
+                dataset_hash = main.op_publish_appended_rows(file_name)
+            except FileNotFoundError as e:
+                raise RequestError(409, str(e))
+        return dict(file=file_name, hash=dataset_hash)
+
+    def publish_batch(self, file_names):
+        if not isinstance(file_names, list) or not file_names:
+            raise RequestError(400, "A list of file names of data/uploaded is required")
+        for file_name in file_names:
+            self._file_path(file_name)
+        with self._publish_lock, span("service_publish_batch", files=len(file_names)):
+            hashes = main.op_publish_datasets(list(dict.fromkeys(file_names)))
+        return dict(hashes=hashes)
+
+    def verify(self, file_name):
+        file_path = self._file_path(file_name)
+        dataset_hash = self._published_hash(file_name)
+        with span("service_verify", file=file_name):
+            try:
+                verify_dataset(file_path) # local Merkle check when the file was published in a batch
+                return dict(file=file_name, hash=dataset_hash, verified=True, error=None)
+            except ValueError as e:
+                return dict(file=file_name, hash=dataset_hash, verified=False, error=str(e))
+
+    def query(self, file_name, wait=False, spec=None):
+        if spec is not None and not isinstance(spec, dict):
+            raise RequestError(400, "The query spec must be a JSON object")
+        file_path = self._file_path(file_name)
+        dataset_hash = self._published_hash(file_name)
+        job_id = self._run(self._submit(file_path, file_name, dataset_hash, spec))
+        if wait:
+            return self._run(self.scheduler.wait(job_id))
+        return self.scheduler.status(job_id)
+
+    async def _submit(self, file_path, file_name, dataset_hash, spec):
+        return self.scheduler.submit(file_path, file_name, dataset_hash, spec)
+
+    def job(self, job_id):
+        try:
+            return self.scheduler.status(job_id)
+        except KeyError:
+            raise RequestError(404, f"Unknown job: {job_id}")
+
+    def jobs(self):
+        return self.scheduler.jobs()
+
+    def shutdown(self):
+        self.scheduler.shutdown()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._loop_thread.join()
+
+
+class QueryRequestHandler(BaseHTTPRequestHandler):
+    service = None # set by serve()
+
+    def _send(self, status, body, content_type="application/json"):
+        data = body.encode() if isinstance(body, str) else json.dumps(body, default=str).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            body = json.loads(self.rfile.read(length))
+        except json.JSONDecodeError:
+            raise RequestError(400, "The request body is not valid JSON")
+        if not isinstance(body, dict):
+            raise RequestError(400, "The request body must be a JSON object")
+        return body
+
+    def _handle(self, route):
+        try:
+            status, body = route()
+            self._send(status, body)
+        except RequestError as e:
+            self._send(e.status, dict(error=str(e)))
+        except Exception as e:
+            logging.exception("Request failed")
+            self._send(500, dict(error=f"{type(e).__name__}: {e}"))
+
+    def do_GET(self):
+        def route():
+            if self.path == "/health":
+                return 200, dict(status="ok", workers=self.service.workers)
+            if self.path == "/datasets":
+                return 200, load_published_hashes()
+            if self.path == "/jobs":
+                return 200, self.service.jobs()
+            match = re.fullmatch(r"/jobs/([0-9a-f]+)", self.path)
+            if match:
+                return 200, self.service.job(match.group(1))
+            raise RequestError(404, f"Unknown path: {self.path}")
+        if self.path == "/metrics":
+            self._send(200, get_tracer().metrics_text(), content_type="text/plain; version=0.0.4")
+            return
+        self._handle(route)
+
+    def do_POST(self):
+        def route():
+            body = self._read_json()
+            if self.path == "/publish":
+                return 200, self.service.publish(body.get("file"), merkle=bool(body.get("merkle", False)))
+            if self.path == "/publish_appended":
+                return 200, self.service.publish_appended(body.get("file"))
+            if self.path == "/publish_batch":
+                return 200, self.service.publish_batch(body.get("files"))
+            if self.path == "/verify":
+                return 200, self.service.verify(body.get("file"))
+            if self.path == "/query":
+                job = self.service.query(body.get("file"), wait=bool(body.get("wait", False)), spec=body.get("spec"))
+                return (200 if job["status"] in (DONE, FAILED) else 202), job
+            raise RequestError(404, f"Unknown path: {self.path}")
+        self._handle(route)
+
+    def log_message(self, format, *args):
+        logging.info("%s - %s", self.address_string(), format % args)
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, max_prove_workers=None):
+    service = QueryService(max_prove_workers=max_prove_workers)
+    service.warm_up()
+    QueryRequestHandler.service = service
+    server = ThreadingHTTPServer((host, port), QueryRequestHandler)
+    print(f"Query service listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local query service (publish, verify, query)")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--prove-workers", type=int, default=None, help="proving processes (default: cores and memory)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    serve(args.host, args.port, args.prove_workers)
@@ -0,0 +1,201 @@
+import os
+import json
+import time
+import uuid
+import resource
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Structured tracing of the query/proof pipeline.
+#
+# Every stage runs inside a span: span("prove", logrows=17) measures its duration and the peak RSS of the
+# process while it runs (sampled from /proc/self/status by a background thread, ezkl runs in-process) and
+# keeps the attributes set on it (tensor shapes, ONNX node count, logrows, proof size, ...). Spans nest
+# (threads and asyncio tasks included), every finished span is appended as one JSON line to the trace log
+# and aggregated in per-stage metrics, which dump_metrics() writes in the Prometheus text format.
+#
+# output/traces/
+#   spans.jsonl    -> {"trace_id", "span_id", "parent_id", "name", "start", "duration_s", "peak_rss_bytes", "attributes"}
+#   metrics.prom   -> zkolap_stage_duration_seconds_{sum,count,max}, zkolap_stage_peak_rss_bytes, zkolap_stage_value
+
+TRACE_DIR = os.path.join("output", "traces")
+SPANS_PATH = os.path.join(TRACE_DIR, "spans.jsonl")
+METRICS_PATH = os.path.join(TRACE_DIR, "metrics.prom")
+METRIC_PREFIX = "zkolap"
+RSS_SAMPLE_INTERVAL = 0.01
+
+def current_rss():
+    """Resident set size of the process in bytes."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # no /proc: peak of the whole process
+
+
+class RSSSampler:
+    """Background thread that raises the peak_rss of every open span to the current RSS."""
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self._spans = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            rss = current_rss()
+            with self._lock:
+                for span in self._spans:
+                    span.peak_rss = max(span.peak_rss, rss)
+
+    def add(self, span):
+        with self._lock:
+            self._spans.add(span)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def remove(self, span):
+        with self._lock:
+            self._spans.discard(span)
+
+
+class Span:
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.trace_id = parent.trace_id if parent is not None else uuid.uuid4().hex
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent is not None else None
+        self.attributes = dict(attributes or {})
+        self.start = time.time()
+        self.duration = None
+        self.peak_rss = current_rss()
+        self.error = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self):
+        record = dict(
+            trace_id=self.trace_id,
+            span_id=self.span_id,
+            parent_id=self.parent_id,
+            name=self.name,
+            start=self.start,
+            duration_s=round(self.duration, 6),
+            peak_rss_bytes=self.peak_rss,
+            attributes=self.attributes,
+        )
+        if self.error is not None:
+            record["error"] = self.error
+        return record
+
+
+class Tracer:
+    def __init__(self, spans_path=SPANS_PATH, metrics_path=METRICS_PATH):
+        self.spans_path = spans_path
+        self.metrics_path = metrics_path
+        self.sampler = RSSSampler()
+        self._current = contextvars.ContextVar("current_span", default=None)
+        self._metrics = {} # stage -> {"count", "sum", "max", "peak_rss", "values": {attribute: last value}}
+        self._lock = threading.Lock()
+
+    def current_span(self):
+        return self._current.get()
+
+    @contextmanager
+    def span(self, name, **attributes):
+        span = Span(name, self._current.get(), attributes)
+        token = self._current.set(span)
+        self.sampler.add(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.duration = time.perf_counter() - started
+            self.sampler.remove(span)
+            span.peak_rss = max(span.peak_rss, current_rss())
+            self._current.reset(token)
+            self._record(span)
+
+    def _record(self, span):
+        record = span.to_dict()
+        with self._lock:
+            os.makedirs(os.path.dirname(self.spans_path) or ".", exist_ok=True)
+            with open(self.spans_path, "a") as f:
+                f.write(json.dumps(record, default=str) + "\n")
+            metrics = self._metrics.setdefault(span.name, dict(count=0, sum=0.0, max=0.0, peak_rss=0, errors=0, values={}))
+            metrics["count"] += 1
+            metrics["sum"] += span.duration
+            metrics["max"] = max(metrics["max"], span.duration)
+            metrics["peak_rss"] = max(metrics["peak_rss"], span.peak_rss)
+            metrics["errors"] += span.error is not None
+            for key, value in span.attributes.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    metrics["values"][key] = value
+
+    def metrics_text(self):
+        """Per-stage metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = {name: dict(m, values=dict(m["values"])) for name, m in self._metrics.items()}
+        p = METRIC_PREFIX
+        lines = [f"# HELP {p}_stage_duration_seconds Wall time of the pipeline stages.",
+                 f"# TYPE {p}_stage_duration_seconds summary"]
+        for name, m in sorted(metrics.items()):
+            lines.append(f'{p}_stage_duration_seconds_sum{{stage="{name}"}} {m["sum"]:.6f}')
+            lines.append(f'{p}_stage_duration_seconds_count{{stage="{name}"}} {m["count"]}')
+        lines += [f"# HELP {p}_stage_duration_seconds_max Longest run of the pipeline stages.",
+                  f"# TYPE {p}_stage_duration_seconds_max gauge"]
+        lines += [f'{p}_stage_duration_seconds_max{{stage="{name}"}} {m["max"]:.6f}' for name, m in sorted(metrics.items())]
+        lines += [f"# HELP {p}_stage_peak_rss_bytes Peak resident memory of the process during the stages.",
+                  f"# TYPE {p}_stage_peak_rss_bytes gauge"]
+        lines += [f'{p}_stage_peak_rss_bytes{{stage="{name}"}} {m["peak_rss"]}' for name, m in sorted(metrics.items())]
+        lines += [f"# HELP {p}_stage_errors_total Failed runs of the pipeline stages.",
+                  f"# TYPE {p}_stage_errors_total counter"]
+        lines += [f'{p}_stage_errors_total{{stage="{name}"}} {m["errors"]}' for name, m in sorted(metrics.items())]
+        lines += [f"# HELP {p}_stage_value Last numeric attribute of the stages (logrows, proof bytes, rows, ...).",
+                  f"# TYPE {p}_stage_value gauge"]
+        for name, m in sorted(metrics.items()):
+            lines += [f'{p}_stage_value{{stage="{name}",attribute="{key}"}} {value}' for key, value in sorted(m["values"].items())]
+        return "\n".join(lines) + "\n"
+
+    def dump_metrics(self, path=None):
+        path = path or self.metrics_path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.metrics_text())
+        os.replace(tmp_path, path)
+        return path
+
+
+_tracer = Tracer()
+
+def get_tracer():
+    return _tracer
+
+def span(name, **attributes):
+    """Context manager of a span of the process-wide tracer: with span("prove", logrows=17) as s: ... s.set(...)"""
+    return _tracer.span(name, **attributes)
+
+def dump_metrics(path=None):
+    return _tracer.dump_metrics(path)
+
+# Helpers for the attributes of the spans
+def tensor_shape(tensor):
+    return list(tensor.shape)
+
+def onnx_node_count(model_onnx_path):
+    import onnx
+    return len(onnx.load(model_onnx_path).graph.node)
+
+def file_size(path):
+    return os.path.getsize(path) if os.path.exists(path) else None
@@ -0,0 +1,125 @@
+import os
+import json
+import logging
+import threading
+import requests
+from web3 import Web3
+
+# Process-wide blockchain client: one provider (with a keep-alive HTTP session) and one contract
+# instance per (contract, address), built from the full ABI produced by truffle in build/contracts.
+# get_client() returns the shared instance; Web3Client.eth_tester() gives an in-process chain
+# (eth-tester) with freshly deployed contracts, useful to benchmark without a node.
+
+BASE_DIR = os.path.dirname(__file__)
+BUILD_DIR = os.path.join(BASE_DIR, 'build', 'contracts')
+CONFIG_PATH = os.path.join(BASE_DIR, 'config', 'contract_addresses.json')
+DEFAULT_ENDPOINT = "http://127.0.0.1:8545"
+
+def load_artifact(contract_name):
+    """Truffle build artifact (abi, bytecode, ...) of a contract."""
+    with open(os.path.join(BUILD_DIR, f"{contract_name}.json"), 'r') as f:
+        return json.load(f)
+
+def load_contract_addresses():
+    with open(CONFIG_PATH, 'r') as f:
+        return json.load(f)
+
+
+class Web3Client:
+    def __init__(self, provider=None, endpoint=DEFAULT_ENDPOINT, contract_addresses=None):
+        if provider is None:
+            # The session keeps the TCP connection to the node open between requests
+            session = requests.Session()
+            session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=16))
+            provider = Web3.HTTPProvider(endpoint, session=session)
+        self.web3 = Web3(provider)
+        self._contract_addresses = contract_addresses
+        self._contracts = {}
+        self._abis = {}
+        self._default_account = None
+        self._connected = False
+        self._lock = threading.Lock()
+
+    def ensure_connected(self):
+        if not self._connected:
+            if not self.web3.is_connected():
+                logging.error("Failed to connect to the blockchain.")
+                raise ConnectionError("Failed to connect to the blockchain.")
+            self._connected = True
+        return self.web3
+
+    def contract_address(self, contract_name):
+        if self._contract_addresses is None:
+            self._contract_addresses = load_contract_addresses()
+        address = self._contract_addresses.get(contract_name)
+        if not address:
+            raise KeyError(f"{contract_name} address not found in configuration.")
+        return address
+
+    def abi(self, contract_name):
+        if contract_name not in self._abis:
+            self._abis[contract_name] = load_artifact(contract_name)["abi"]
+        return self._abis[contract_name]
+
+    def contract(self, contract_name, address=None):
+        """Cached contract instance (default address from config/contract_addresses.json)."""
+        address = address or self.contract_address(contract_name)
+        key = (contract_name, address)
+        with self._lock:
+            if key not in self._contracts:
+                self.ensure_connected()
+                self._contracts[key] = self.web3.eth.contract(address=address, abi=self.abi(contract_name))
+            return self._contracts[key]
+
+    @property
+    def default_account(self):
+        if self._default_account is None:
+            self._default_account = self.ensure_connected().eth.accounts[0]
+        return self._default_account
+
+    def batch_call(self, calls):
+        """Run a list of read-only contract calls (e.g. contract.functions.getHash()) in one JSON-RPC batch
+        when the installed web3 supports it, one request per call otherwise."""
+        if not calls:
+            return []
+        self.ensure_connected()
+        if hasattr(self.web3, "batch_requests"):
+            with self.web3.batch_requests() as batch:
+                for call in calls:
+                    batch.add(call)
+                return list(batch.execute())
+        return [call.call() for call in calls]
+
+    @classmethod
+    def eth_tester(cls, contract_names=("DataFactModel", "DatasetRegistry")):
+        """In-process chain (requires eth-tester) with the given contracts deployed from their build artifacts.
+        The first account deploys them: it is the owner of the DatasetRegistry, as ORG 1 on a real node."""
+        web3 = Web3(Web3.EthereumTesterProvider())
+        account = web3.eth.accounts[0]
+        addresses = {}
+        for name in contract_names:
+            artifact = load_artifact(name)
+            if not artifact.get("bytecode"):
+                raise RuntimeError(f"The build artifact of {name} has no bytecode: run 'truffle compile' first")
+            factory = web3.eth.contract(abi=artifact["abi"], bytecode=artifact["bytecode"])
+            tx_hash = factory.constructor().transact({'from': account})
+            addresses[name] = web3.eth.wait_for_transaction_receipt(tx_hash).contractAddress
+        return cls(provider=web3.provider, contract_addresses=addresses)
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_client():
+    """Shared Web3Client of the process."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = Web3Client()
+        return _client
+
+def set_client(client):
+    """Replace the shared client (e.g. with Web3Client.eth_tester() for local benchmarks)."""
+    global _client
+    with _client_lock:
+        _client = client